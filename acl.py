@@ -0,0 +1,199 @@
+"""
+Per-device access control compiled into nftables
+Allow rules for users and groups are turned into two named sets keyed by
+VPN IP, so the forward chain is a fixed handful of set lookups no matter
+how many peers or rules exist:
+
+    unrestricted  VPN IPs allowed everywhere (users without rules, ACL_DEFAULT=allow)
+    allowed       VPN IP . destination pairs (interval set)
+
+The table is (re)created as a whole with apply_ruleset(). When devices or
+rules change, sync() diffs the live sets against the database and applies
+only the added and removed elements, in one atomic 'nft -f' transaction.
+Everything is rendered to text first, so dry runs need no nftables.
+"""
+import ipaddress
+import json
+import subprocess
+from models import db, User, Device, AccessRule, user_access_groups
+from config import Config
+
+TABLE = 'wireguard_gui'
+ELEMENT_CHUNK = 1000  # Elements per add/delete statement
+
+
+def normalize_destination(destination):
+    """Canonical IPv4 network string, raises ValueError for anything else"""
+    network = ipaddress.ip_network(destination.strip(), strict=False)
+    if network.version != 4:
+        raise ValueError(f"Only IPv4 destinations are supported: {destination}")
+    return str(network)
+
+
+def _element(network):
+    # nft lists single hosts without a prefix length, do the same so diffs match
+    return str(network.network_address) if network.prefixlen == 32 else str(network)
+
+
+def get_elements():
+    """(unrestricted VPN IPs, {(VPN IP, destination)}) for every peer on the live interfaces"""
+    rules = {}
+    for user_id, destination in db.session.query(AccessRule.user_id, AccessRule.destination) \
+            .filter(AccessRule.user_id.isnot(None)):
+        rules.setdefault(user_id, []).append(destination)
+    group_rules = db.session.query(user_access_groups.c.user_id, AccessRule.destination) \
+        .join(AccessRule, AccessRule.group_id == user_access_groups.c.group_id)
+    for user_id, destination in group_rules:
+        rules.setdefault(user_id, []).append(destination)
+    
+    # Same conditions as the server configs, so the sets hold exactly the live peers
+    from wireguard_manager import WireGuardManager
+    addresses = db.session.query(Device.wg_ip_address, Device.user_id).join(User, Device.user_id == User.id) \
+        .filter(WireGuardManager.live_device_condition()).all()
+    addresses += db.session.query(User.wg_ip_address, User.id) \
+        .filter(WireGuardManager.live_legacy_user_condition()).all()
+    
+    unrestricted = set()
+    allowed = set()
+    for address, user_id in addresses:
+        destinations = rules.get(user_id)
+        if not destinations:
+            if Config.ACL_DEFAULT == 'allow':
+                unrestricted.add(address)
+            continue
+        # Overlapping intervals are rejected by nft, merge them per address first
+        networks = ipaddress.collapse_addresses(ipaddress.ip_network(d, strict=False) for d in destinations)
+        allowed.update((address, _element(network)) for network in networks)
+    return unrestricted, allowed
+
+
+def _format_allowed(pairs):
+    return [f'{address} . {destination}' for address, destination in sorted(pairs)]
+
+
+def _chunks(items):
+    for index in range(0, len(items), ELEMENT_CHUNK):
+        yield ', '.join(items[index:index + ELEMENT_CHUNK])
+
+
+def render_ruleset(elements, interface_names, net_interface):
+    """Full table definition, replacing any previous one in the same transaction"""
+    unrestricted, allowed = elements
+    interfaces = ', '.join(f'"{name}"' for name in interface_names)
+    lines = [
+        f'table inet {TABLE} {{}}',
+        f'delete table inet {TABLE}',
+        f'table inet {TABLE} {{',
+        '\tset unrestricted {',
+        '\t\ttype ipv4_addr',
+        '\t}',
+        '\tset allowed {',
+        '\t\ttype ipv4_addr . ipv4_addr',
+        '\t\tflags interval',
+        '\t}',
+        '\tchain forward {',
+        '\t\ttype filter hook forward priority filter; policy accept;',
+        f'\t\tiifname != {{ {interfaces} }} accept',
+        '\t\tct state established,related accept',
+        '\t\tip saddr @unrestricted accept',
+        '\t\tip saddr . ip daddr @allowed accept',
+        '\t\tcounter drop',
+        '\t}',
+        '\tchain postrouting {',
+        '\t\ttype nat hook postrouting priority srcnat; policy accept;',
+        f'\t\tiifname {{ {interfaces} }} oifname "{net_interface}" masquerade',
+        '\t}',
+        '}',
+    ]
+    for chunk in _chunks(sorted(unrestricted)):
+        lines.append(f'add element inet {TABLE} unrestricted {{ {chunk} }}')
+    for chunk in _chunks(_format_allowed(allowed)):
+        lines.append(f'add element inet {TABLE} allowed {{ {chunk} }}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_element_diff(current, desired):
+    """add/delete element statements turning current into desired, '' if they match"""
+    lines = []
+    # Deletes first so a replaced interval never overlaps its successor
+    for verb, pick in (('delete', lambda have, want: have - want), ('add', lambda have, want: want - have)):
+        for chunk in _chunks(sorted(pick(current[0], desired[0]))):
+            lines.append(f'{verb} element inet {TABLE} unrestricted {{ {chunk} }}')
+        for chunk in _chunks(_format_allowed(pick(current[1], desired[1]))):
+            lines.append(f'{verb} element inet {TABLE} allowed {{ {chunk} }}')
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _parse_value(value):
+    if isinstance(value, str):
+        return value
+    if 'prefix' in value:
+        network = ipaddress.ip_network(f"{value['prefix']['addr']}/{value['prefix']['len']}")
+        return _element(network)
+    if 'range' in value:
+        return '-'.join(value['range'])
+    raise ValueError(f"Unexpected set element {value}")
+
+
+def parse_elements(listing):
+    """Elements from 'nft -j list table' output, in get_elements() form"""
+    unrestricted, allowed = set(), set()
+    for item in json.loads(listing).get('nftables', []):
+        nft_set = item.get('set')
+        if not nft_set or nft_set.get('table') != TABLE:
+            continue
+        for element in nft_set.get('elem', []):
+            if isinstance(element, dict) and 'elem' in element:
+                element = element['elem']['val']  # Elements with counters or comments
+            if nft_set['name'] == 'unrestricted':
+                unrestricted.add(_parse_value(element))
+            elif nft_set['name'] == 'allowed':
+                address, destination = element['concat']
+                allowed.add((_parse_value(address), _parse_value(destination)))
+    return unrestricted, allowed
+
+
+def read_elements():
+    """Elements currently loaded in the kernel, None if the table doesn't exist"""
+    try:
+        result = subprocess.run([Config.NFT_BINARY, '-j', 'list', 'table', 'inet', TABLE], capture_output=True)
+    except OSError:
+        return None  # nft not installed, e.g. a dry run on a workstation
+    if result.returncode != 0:
+        return None
+    return parse_elements(result.stdout)
+
+
+def run_script(script):
+    """Apply an nft script as one atomic transaction"""
+    result = subprocess.run([Config.NFT_BINARY, '-f', '-'], input=script.encode(), capture_output=True)
+    if result.returncode != 0:
+        raise Exception(f"nft failed: {result.stderr.decode().strip()}")
+
+
+def render_full():
+    from wireguard_manager import WireGuardManager
+    names = [interface.name for interface in WireGuardManager.get_interfaces()]
+    return render_ruleset(get_elements(), names, WireGuardManager.get_default_interface())
+
+
+def apply_ruleset(dry_run=False):
+    """Recreate the whole table from the database, returns the script"""
+    script = render_full()
+    if not dry_run:
+        run_script(script)
+    return script
+
+
+def sync(dry_run=False):
+    """Apply only the set elements that differ from the database, returns the script ('' if in sync)
+
+    Falls back to the full ruleset if the table isn't loaded yet.
+    """
+    current = read_elements()
+    if current is None:
+        return apply_ruleset(dry_run)
+    script = render_element_diff(current, get_elements())
+    if script and not dry_run:
+        run_script(script)
+    return script
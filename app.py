@@ -1,9 +1,25 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, Response, stream_with_context, session, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, WireGuardConfig, Device
+from models import db, User, WireGuardConfig, Device, WireGuardInterface, ApiToken
 from wireguard_manager import WireGuardManager
 from config import Config
+from metrics import (REGISTRY, CONTENT_TYPE, CONFIG_APPLY_SECONDS, QR_RENDER_SECONDS, DB_UPDATE_SECONDS, DUMP_PARSE_SECONDS,
+                     RATE_LIMITED_TOTAL, RATE_LIMIT_ERRORS_TOTAL)
+import instrumentation
+import timing
+import assets
+import fragment_cache
+import session_log
+import endpoint_tracker
+import export
+import lookup_index
+import ratelimit
 import io
+import gzip
+import hmac
+import json
+import time
+from datetime import datetime, timedelta
 from functools import wraps
 
 app = Flask(__name__)
@@ -15,6 +31,23 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Time routes and WireGuardManager calls, count SQL queries and subprocesses
+instrumentation.init_app(app)
+timing.instrument_class(WireGuardManager)
+
+# Fingerprinted CSS/JS under /assets/, see assets.py
+assets.init_app(app)
+
+# Rendered table rows, see fragment_cache.py
+fragment_cache.init_app(app)
+
+# Bulk key/IP lookups are served from memory, see lookup_index.py
+peer_lookup = lookup_index.LookupIndex(Config.LOOKUP_INDEX_PATH, Config.LOOKUP_INDEX_MAX_AGE)
+api_token_cache = {}  # token hash -> (ApiToken id, checked at)
+
+# Per user and route token buckets for expensive routes, shared by all workers
+rate_limiter = ratelimit.TokenBucketLimiter(Config.RATE_LIMIT_DB_PATH, Config.RATE_LIMIT_CAPACITY, Config.RATE_LIMIT_RATE)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -29,6 +62,118 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def authenticate_api_token(token):
+    """ApiToken id for a valid bearer token, or None; valid tokens are cached for API_TOKEN_CACHE_SECONDS"""
+    token_hash = ApiToken.hash_token(token)
+    cached = api_token_cache.get(token_hash)
+    if cached and time.monotonic() - cached[1] < Config.API_TOKEN_CACHE_SECONDS:
+        return cached[0]
+    
+    api_token = ApiToken.query.filter_by(token_hash=token_hash, is_active=True).first()
+    if not api_token:
+        api_token_cache.pop(token_hash, None)
+        return None
+    api_token.last_used_at = datetime.utcnow()
+    db.session.commit()
+    api_token_cache[token_hash] = (api_token.id, time.monotonic())
+    return api_token.id
+
+def api_auth_required(f):
+    """Decorator for the read-only API: an API token (Authorization: Bearer ...) or an admin session"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            if authenticate_api_token(header[7:].strip()) is None:
+                return compact_json_response({'success': False, 'error': 'Invalid API token'}, 401)
+        elif not current_user.is_authenticated or not current_user.is_admin:
+            return compact_json_response({'success': False, 'error': 'Authentication required'}, 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def rate_limited(cost, as_json=False, methods=None):
+    """Decorator taking cost tokens from the user's bucket for this route
+
+    Requests without enough tokens get a 429 with Retry-After. If the
+    bucket store fails, requests are let through. Goes above login_required:
+    the user id comes from the session, so rejecting doesn't load the user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if Config.RATE_LIMIT_ENABLED and (methods is None or request.method in methods):
+                client = session.get('_user_id') or request.remote_addr
+                try:
+                    allowed, retry_after = rate_limiter.acquire(f'{client}:{request.endpoint}', cost)
+                except Exception as e:
+                    RATE_LIMIT_ERRORS_TOTAL.inc()
+                    app.logger.warning(f'Rate limiter unavailable: {e}')
+                    allowed = True
+                if not allowed:
+                    RATE_LIMITED_TOTAL.inc(endpoint=request.endpoint)
+                    message = f'Too many requests, try again in {retry_after} seconds'
+                    if as_json:
+                        response = jsonify({'success': False, 'error': message, 'retry_after': retry_after})
+                        response.status_code = 429
+                    else:
+                        response = Response(message + '\n', status=429, mimetype='text/plain')
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def compact_json_response(payload, status=200):
+    """Serialize payload without whitespace and gzip it when the client accepts it"""
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    response = Response(body, status=status, mimetype='application/json')
+    
+    # Small bodies are not worth the compression overhead
+    if len(body) >= Config.API_GZIP_MIN_SIZE and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.template_filter('filesize')
+def filesize(value):
+    """Human readable byte count"""
+    value = float(value or 0)
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if value < 1024:
+            return f'{value:.2f} {unit}'
+        value /= 1024
+    return f'{value:.2f} PB'
+
+def parse_quota(value):
+    """Quota form field in GB -> bytes, empty means unlimited"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    gigabytes = float(value)
+    if gigabytes <= 0:
+        raise ValueError('Quota must be positive')
+    return int(gigabytes * 1024 ** 3)
+
+def page_args():
+    """(offset, limit) from the query string, raises ValueError"""
+    offset = max(int(request.args.get('offset', 0)), 0)
+    limit = min(max(int(request.args.get('limit', Config.API_MAX_PAGE_SIZE)), 1), Config.API_MAX_PAGE_SIZE)
+    return offset, limit
+
+def history_args():
+    """(start, end, limit) of the device history routes from the query string, raises ValueError
+    
+    start and end are ISO 8601 and default to the last 7 days.
+    """
+    try:
+        end = datetime.fromisoformat(request.args['end']) if 'end' in request.args else datetime.now()
+        start = datetime.fromisoformat(request.args['start']) if 'start' in request.args else end - timedelta(days=7)
+        limit = min(max(int(request.args.get('limit', Config.API_MAX_PAGE_SIZE)), 1), Config.API_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('start/end must be ISO 8601 and limit an integer')
+    return start, end, limit
+
 # ==================== Public Routes ====================
 
 @app.route('/')
@@ -55,6 +200,14 @@ def login():
         
         if user and user.check_password(password) and user.is_active:
             login_user(user)
+            
+            # Logging in to the portal brings idle devices back onto the interface
+            try:
+                WireGuardManager.unpark_user_devices(user)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error re-activating parked devices for {user.username}: {e}")
+            
             next_page = request.args.get('next')
             return redirect(next_page or url_for('index'))
         else:
@@ -82,6 +235,7 @@ def user_dashboard():
     return render_template('user_dashboard.html', user=current_user)
 
 @app.route('/download-config')
+@rate_limited(2)
 @login_required
 def download_config():
     """Download WireGuard configuration file"""
@@ -110,6 +264,7 @@ def download_config():
         return redirect(url_for('user_dashboard'))
 
 @app.route('/qr-code')
+@rate_limited(4, as_json=True)
 @login_required
 def qr_code():
     """Get QR code for mobile setup"""
@@ -138,7 +293,15 @@ def admin_dashboard():
     """Admin dashboard - manage users"""
     users = User.query.filter_by(is_admin=False).all()
     wg_config = WireGuardConfig.query.first()
-    return render_template('admin_dashboard.html', users=users, wg_config=wg_config)
+    interfaces = WireGuardManager.get_interfaces() if wg_config else []
+    interface_loads = WireGuardManager.get_interface_loads() if wg_config else {}
+    # Usage is part of the row keys because it resets at midnight without a write
+    rows = [(user, user.get_usage()) for user in users]
+    return render_template('admin_dashboard.html', users=users, wg_config=wg_config,
+                         interfaces=interfaces, interface_loads=interface_loads,
+                         parked_count=WireGuardManager.get_parked_count(), rows=rows,
+                         table_version=fragment_cache.version(
+                             (user.id, user.updated_at, usage) for user, usage in rows))
 
 @app.route('/admin/add-user', methods=['GET', 'POST'])
 @login_required
@@ -168,7 +331,9 @@ def add_user():
                 username=username,
                 email=email,
                 is_admin=False,
-                max_connections=max_conn
+                max_connections=max_conn,
+                quota_daily_bytes=parse_quota(request.form.get('quota_daily_gb')),
+                quota_monthly_bytes=parse_quota(request.form.get('quota_monthly_gb'))
             )
             user.set_password(password)
             
@@ -221,6 +386,13 @@ def edit_user(user_id):
             except ValueError:
                 flash('Invalid max connections value', 'warning')
         
+        # Update traffic quotas, enforced by the connection monitor
+        try:
+            user.quota_daily_bytes = parse_quota(request.form.get('quota_daily_gb'))
+            user.quota_monthly_bytes = parse_quota(request.form.get('quota_monthly_gb'))
+        except ValueError:
+            flash('Quotas must be positive numbers of GB', 'warning')
+        
         try:
             db.session.commit()
             
@@ -316,7 +488,57 @@ def regenerate_config(user_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/batch', methods=['POST'])
+@login_required
+@admin_required
+def batch_operation():
+    """Disable, enable, delete or rekey many users/devices with one server reconcile"""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    
+    if action not in WireGuardManager.BATCH_ACTIONS:
+        return jsonify({'error': f'action must be one of {", ".join(WireGuardManager.BATCH_ACTIONS)}'}), 400
+    
+    try:
+        user_ids = [int(i) for i in data.get('user_ids', [])]
+        device_ids = [int(i) for i in data.get('device_ids', [])]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_ids and device_ids must be lists of integers'}), 400
+    
+    if not user_ids and not device_ids:
+        return jsonify({'error': 'Select at least one user or device'}), 400
+    
+    try:
+        result = WireGuardManager.batch_update(action, user_ids, device_ids, dry_run=bool(data.get('dry_run')))
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/export')
+@login_required
+@admin_required
+def export_configs():
+    """Stream an archive of all active devices' configs and QR codes
+    
+    Query parameters:
+        format - 'zip' (default) or 'tar' for tar.gz
+        qr - 'png' (default), 'svg' or 'none'
+        user, interface - restrict to these usernames / interface names (repeatable)
+    """
+    archive_format = request.args.get('format', 'zip')
+    qr_format = request.args.get('qr', 'png')
+    if archive_format not in export.FORMATS or qr_format not in export.QR_FORMATS:
+        return jsonify({'error': 'format must be zip or tar, qr must be png, svg or none'}), 400
+    
+    mimetype, extension = export.FORMATS[archive_format]
+    chunks = export.stream_export(request.args.getlist('user'), request.args.getlist('interface'),
+                                  archive_format, qr_format)
+    filename = f"wireguard-configs-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/admin/peer-statistics')
+@rate_limited(1, as_json=True)
 @login_required
 @admin_required
 def peer_statistics():
@@ -332,6 +554,365 @@ def peer_statistics():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ==================== API Routes ====================
+
+@app.route('/api/v1/peer-statistics')
+@api_auth_required
+def api_peer_statistics():
+    """Peer statistics with field projection, filtering and pagination
+    
+    Query parameters:
+        fields - comma separated subset of WireGuardManager.PEER_STAT_FIELDS
+        online - 1 for online peers only, 0 for offline peers only
+        user   - only peers belonging to this username
+        offset, limit - pagination over the filtered peers
+        format - 'objects' (default) or 'columns' for an array of arrays
+    """
+    all_fields = WireGuardManager.PEER_STAT_FIELDS
+    fields = request.args.get('fields')
+    if fields:
+        fields = [f for f in fields.split(',') if f]
+        unknown = [f for f in fields if f not in all_fields]
+        if unknown:
+            return compact_json_response({'success': False, 'error': f"Unknown fields: {', '.join(unknown)}"}, 400)
+    else:
+        fields = list(all_fields)
+    
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', Config.API_MAX_PAGE_SIZE)), 1), Config.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return compact_json_response({'success': False, 'error': 'offset and limit must be integers'}, 400)
+    
+    output_format = request.args.get('format', 'objects')
+    if output_format not in ('objects', 'columns'):
+        return compact_json_response({'success': False, 'error': 'format must be objects or columns'}, 400)
+    
+    try:
+        peers = WireGuardManager.get_peer_statistics()
+    except Exception as e:
+        return compact_json_response({'success': False, 'error': str(e)}, 500)
+    
+    online_count = sum(1 for p in peers if p['is_online'])
+    total_count = len(peers)
+    
+    online = request.args.get('online')
+    if online in ('0', '1'):
+        peers = [p for p in peers if p['is_online'] == (online == '1')]
+    username = request.args.get('user')
+    if username:
+        peers = [p for p in peers if p['username'] == username]
+    
+    matched_count = len(peers)
+    peers = peers[offset:offset + limit]
+    
+    if output_format == 'columns':
+        data = [[p[f] for f in fields] for p in peers]
+    else:
+        data = [{f: p[f] for f in fields} for p in peers]
+    
+    return compact_json_response({
+        'success': True,
+        'version': 1,
+        'fields': fields,
+        'format': output_format,
+        'peers': data,
+        'offset': offset,
+        'limit': limit,
+        'matched_count': matched_count,
+        'online_count': online_count,
+        'total_count': total_count
+    })
+
+def device_json(device, username, interface):
+    """API representation of a device; keys other than the public key are never exposed"""
+    return {
+        'id': device.id,
+        'user_id': device.user_id,
+        'username': username,
+        'device_name': device.device_name,
+        'public_key': device.wg_public_key,
+        'ip_address': device.wg_ip_address,
+        'allowed_ips': device.wg_allowed_ips,
+        'interface': interface or WireGuardManager.get_primary_interface().name,
+        'is_active': device.is_active,
+        'is_parked': bool(device.is_parked),
+        'is_connected': bool(device.is_connected),
+        'last_handshake': device.last_handshake.isoformat() if device.last_handshake else None,
+        'created_at': device.created_at.isoformat() if device.created_at else None
+    }
+
+def device_query():
+    return db.session.query(Device, User.username, WireGuardInterface.name) \
+        .join(User, Device.user_id == User.id) \
+        .outerjoin(WireGuardInterface, Device.interface_id == WireGuardInterface.id)
+
+def user_json(user, device_count):
+    usage_day, usage_month = user.get_usage()
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'is_admin': user.is_admin,
+        'is_active': user.is_active,
+        'created_at': user.created_at.isoformat() if user.created_at else None,
+        'device_count': device_count,
+        'quota_daily_bytes': user.quota_daily_bytes,
+        'quota_monthly_bytes': user.quota_monthly_bytes,
+        'usage_day_bytes': usage_day,
+        'usage_month_bytes': usage_month,
+        'is_over_quota': bool(user.is_over_quota)
+    }
+
+@app.route('/api/v1/users')
+@api_auth_required
+def api_users():
+    """Users, paginated by offset/limit; active=1|0 filters by state"""
+    try:
+        offset, limit = page_args()
+    except ValueError:
+        return compact_json_response({'success': False, 'error': 'offset and limit must be integers'}, 400)
+    
+    query = User.query
+    active = request.args.get('active')
+    if active in ('0', '1'):
+        query = query.filter(User.is_active == (active == '1'))
+    total_count = query.count()
+    users = query.order_by(User.id).offset(offset).limit(limit).all()
+    
+    counts = dict(db.session.query(Device.user_id, db.func.count(Device.id))
+                  .filter(Device.user_id.in_([u.id for u in users])).group_by(Device.user_id)) if users else {}
+    return compact_json_response({
+        'success': True,
+        'users': [user_json(u, counts.get(u.id, 0)) for u in users],
+        'offset': offset,
+        'limit': limit,
+        'total_count': total_count
+    })
+
+@app.route('/api/v1/users/<int:user_id>')
+@api_auth_required
+def api_user(user_id):
+    """One user with their devices"""
+    user = User.query.get_or_404(user_id)
+    devices = device_query().filter(Device.user_id == user.id).order_by(Device.id).all()
+    payload = user_json(user, len(devices))
+    payload['devices'] = [device_json(*row) for row in devices]
+    return compact_json_response({'success': True, 'user': payload})
+
+@app.route('/api/v1/devices')
+@api_auth_required
+def api_devices():
+    """Devices, paginated by offset/limit
+    
+    Query parameters:
+        ids - comma separated device ids (at most API_LOOKUP_MAX)
+        user, interface - username / interface name
+        active, online - 1 or 0
+    """
+    try:
+        offset, limit = page_args()
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i]
+    except ValueError:
+        return compact_json_response({'success': False, 'error': 'ids, offset and limit must be integers'}, 400)
+    if len(ids) > Config.API_LOOKUP_MAX:
+        return compact_json_response({'success': False, 'error': f'At most {Config.API_LOOKUP_MAX} ids per request'}, 400)
+    
+    query = device_query()
+    if ids:
+        query = query.filter(Device.id.in_(ids))
+    if request.args.get('user'):
+        query = query.filter(User.username == request.args['user'])
+    interface = request.args.get('interface')
+    if interface:
+        if interface == WireGuardManager.get_primary_interface().name:
+            query = query.filter((WireGuardInterface.name == interface) | Device.interface_id.is_(None))
+        else:
+            query = query.filter(WireGuardInterface.name == interface)
+    for arg, column in (('active', Device.is_active), ('online', Device.is_connected)):
+        if request.args.get(arg) in ('0', '1'):
+            query = query.filter(column == (request.args[arg] == '1'))
+    
+    total_count = query.count()
+    rows = query.order_by(Device.id).offset(offset).limit(limit).all()
+    return compact_json_response({
+        'success': True,
+        'devices': [device_json(*row) for row in rows],
+        'offset': offset,
+        'limit': limit,
+        'total_count': total_count
+    })
+
+@app.route('/api/v1/devices/<int:device_id>')
+@api_auth_required
+def api_device(device_id):
+    row = device_query().filter(Device.id == device_id).first()
+    if row is None:
+        return compact_json_response({'success': False, 'error': 'Device not found'}, 404)
+    return compact_json_response({'success': True, 'device': device_json(*row)})
+
+@app.route('/api/v1/lookup', methods=['POST'])
+@api_auth_required
+def api_lookup():
+    """Resolve public keys and/or VPN IPs to their device and user in one call
+    
+    Body: {"public_keys": [...], "ips": [...]}, at most API_LOOKUP_MAX entries in total.
+    Served from the in-memory lookup index, unknown entries map to null.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return compact_json_response({'success': False, 'error': 'Expected a JSON object'}, 400)
+    public_keys = body.get('public_keys') or []
+    ips = body.get('ips') or []
+    if not all(isinstance(v, list) and all(isinstance(i, str) for i in v) for v in (public_keys, ips)):
+        return compact_json_response({'success': False, 'error': 'public_keys and ips must be lists of strings'}, 400)
+    if len(public_keys) + len(ips) > Config.API_LOOKUP_MAX:
+        return compact_json_response({'success': False, 'error': f'At most {Config.API_LOOKUP_MAX} keys and IPs per request'}, 400)
+    
+    keys, addresses = peer_lookup.lookup(public_keys, ips)
+    return compact_json_response({
+        'success': True,
+        'source': peer_lookup.source,
+        'public_keys': keys,
+        'ips': addresses,
+        'matched_count': sum(1 for v in keys.values() if v) + sum(1 for v in addresses.values() if v)
+    })
+
+@app.route('/api/v1/devices/<int:device_id>/sessions')
+@login_required
+def api_device_sessions(device_id):
+    """Connection sessions of a device
+    
+    Query parameters:
+        start, end - ISO 8601 range, defaults to the last 7 days
+        limit - maximum sessions returned, newest first
+    """
+    device = Device.query.get_or_404(device_id)
+    
+    # Check ownership
+    if device.user_id != current_user.id and not current_user.is_admin:
+        return compact_json_response({'success': False, 'error': 'Access denied'}, 403)
+    
+    try:
+        start, end, limit = history_args()
+    except ValueError as e:
+        return compact_json_response({'success': False, 'error': str(e)}, 400)
+    
+    sessions = session_log.get_device_sessions(device.id, start, end, limit)
+    return compact_json_response({
+        'success': True,
+        'device_id': device.id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'sessions': [{
+            'started_at': s['started_at'].isoformat(),
+            'ended_at': s['ended_at'].isoformat() if s['ended_at'] else None,
+            'endpoint': s['endpoint'],
+            'rx_bytes': s['rx_bytes'],
+            'tx_bytes': s['tx_bytes']
+        } for s in sessions]
+    })
+
+@app.route('/api/v1/devices/<int:device_id>/endpoints')
+@login_required
+def api_device_endpoints(device_id):
+    """Endpoint changes of a device (same start/end/limit parameters as sessions)"""
+    device = Device.query.get_or_404(device_id)
+    
+    # Check ownership
+    if device.user_id != current_user.id and not current_user.is_admin:
+        return compact_json_response({'success': False, 'error': 'Access denied'}, 403)
+    
+    try:
+        start, end, limit = history_args()
+    except ValueError as e:
+        return compact_json_response({'success': False, 'error': str(e)}, 400)
+    
+    events = endpoint_tracker.get_endpoint_history(device.id, start, end, limit)
+    return compact_json_response({
+        'success': True,
+        'device_id': device.id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'events': [{
+            'seen_at': e.seen_at.isoformat(),
+            'ip': e.ip,
+            'port': e.port,
+            'previous_ip': e.previous_ip,
+            'previous_port': e.previous_port,
+            'is_flapping': e.is_flapping
+        } for e in events]
+    })
+
+@app.route('/api/v1/endpoints/flapping')
+@login_required
+@admin_required
+def api_flapping_endpoints():
+    """Devices whose endpoint changed across IPs at least ENDPOINT_FLAP_CHANGES times
+    
+    Query parameters:
+        window - seconds to look back, defaults to ENDPOINT_FLAP_WINDOW
+        changes - minimum number of changes, defaults to ENDPOINT_FLAP_CHANGES
+    """
+    try:
+        window = int(request.args.get('window', Config.ENDPOINT_FLAP_WINDOW))
+        min_changes = int(request.args.get('changes', Config.ENDPOINT_FLAP_CHANGES))
+    except ValueError:
+        return compact_json_response({'success': False, 'error': 'window and changes must be integers'}, 400)
+    
+    rows = endpoint_tracker.get_flapping_devices(datetime.now() - timedelta(seconds=window), min_changes)
+    devices = {d.id: d for d in Device.query.filter(Device.id.in_([row[0] for row in rows]))} if rows else {}
+    return compact_json_response({
+        'success': True,
+        'window': window,
+        'devices': [{
+            'device_id': device_id,
+            'username': devices[device_id].user.username if device_id in devices else None,
+            'device_name': devices[device_id].device_name if device_id in devices else None,
+            'changes': changes,
+            'distinct_ips': ips
+        } for device_id, changes, ips in rows]
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this web process, only served when METRICS_TOKEN is set"""
+    if not Config.METRICS_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {Config.METRICS_TOKEN}'.encode()):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/admin/diagnostics')
+@login_required
+@admin_required
+def admin_diagnostics():
+    """Latency, SQL and subprocess statistics for this web process"""
+    sections = [
+        ('Routes', 'endpoint', instrumentation.summarize(instrumentation.HTTP_REQUEST_SECONDS)),
+        ('WireGuardManager', 'method', instrumentation.summarize(timing.MANAGER_CALL_SECONDS)),
+        ('Internals', None, [
+            dict(row, labels={'name': name})
+            for name, histogram in (('config apply', CONFIG_APPLY_SECONDS), ('QR render', QR_RENDER_SECONDS),
+                                    ('DB update', DB_UPDATE_SECONDS), ('dump parse', DUMP_PARSE_SECONDS))
+            for row in instrumentation.summarize(histogram)
+        ])
+    ]
+    sql = {row['labels']['endpoint']: row for row in instrumentation.summarize(instrumentation.HTTP_REQUEST_SQL_QUERIES)}
+    subprocesses = {row['labels']['endpoint']: row for row in instrumentation.summarize(instrumentation.HTTP_REQUEST_SUBPROCESSES)}
+    return render_template('admin_diagnostics.html', sections=sections, sql=sql, subprocesses=subprocesses,
+                         profiles=instrumentation.get_profiles())
+
+@app.route('/admin/diagnostics/profile/<int:profile_id>')
+@login_required
+@admin_required
+def admin_profile(profile_id):
+    """Show a captured cProfile run as plain text"""
+    profile = instrumentation.get_profile(profile_id)
+    if not profile:
+        return Response('Profile not found\n', status=404, mimetype='text/plain')
+    return Response(profile['text'], mimetype='text/plain')
+
 # ==================== Device Management Routes ====================
 
 @app.route('/devices')
@@ -343,17 +924,31 @@ def manage_devices():
     
     devices = Device.query.filter_by(user_id=current_user.id).order_by(Device.created_at.desc()).all()
     
-    # Update connection status
-    WireGuardManager.update_device_connection_status()
+    # The monitor keeps connection status current and publishes live stats;
+    # only collect (and store) them here when it isn't running
+    snapshot = WireGuardManager.get_published_snapshot()
+    if snapshot is None:
+        snapshot = WireGuardManager.collect_snapshot()
+        WireGuardManager.update_device_connection_status(snapshot)
     
     connected_count = sum(1 for d in devices if d.is_connected)
     
+    # Live endpoint and transfer are shown on the cards, so they are part of the keys
+    cards = []
+    for device in devices:
+        peer = snapshot.peers.get(device.wg_public_key)
+        live = (peer.endpoint, peer.rx_bytes, peer.tx_bytes) if peer and peer.endpoint else None
+        cards.append((device, peer, (device.id, device.updated_at, live)))
+    
     return render_template('manage_devices.html', 
                          user=current_user, 
                          devices=devices,
+                         cards=cards,
+                         cards_version=fragment_cache.version(key for _, _, key in cards),
                          connected_count=connected_count)
 
 @app.route('/devices/add', methods=['GET', 'POST'])
+@rate_limited(5, methods=('POST',))
 @login_required
 def add_device():
     """Add a new device"""
@@ -396,6 +991,9 @@ def download_device_config(device_id):
         return redirect(url_for('manage_devices'))
     
     try:
+        # A parked device is about to be used again
+        WireGuardManager.unpark_devices([device])
+        
         config = WireGuardManager.get_device_config(device)
         
         buffer = io.BytesIO()
@@ -415,6 +1013,7 @@ def download_device_config(device_id):
         return redirect(url_for('manage_devices'))
 
 @app.route('/devices/<int:device_id>/qr-code')
+@rate_limited(4, as_json=True)
 @login_required
 def device_qr_code(device_id):
     """Get QR code for device"""
@@ -425,6 +1024,9 @@ def device_qr_code(device_id):
         return jsonify({'error': 'Access denied'}), 403
     
     try:
+        # A parked device is about to be used again
+        WireGuardManager.unpark_devices([device])
+        
         config = WireGuardManager.get_device_config(device)
         qr_image = WireGuardManager.generate_qr_code(config)
         
@@ -432,6 +1034,23 @@ def device_qr_code(device_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/devices/<int:device_id>/activate', methods=['POST'])
+@login_required
+def activate_device(device_id):
+    """Put a parked device back on the live interface"""
+    device = Device.query.get_or_404(device_id)
+    
+    # Check ownership
+    if device.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        WireGuardManager.unpark_devices([device])
+        return jsonify({'success': True, 'is_parked': device.is_parked})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/devices/<int:device_id>/delete', methods=['POST'])
 @login_required
 def delete_device(device_id):
@@ -487,7 +1106,7 @@ def admin_view_devices():
     """Admin view of all devices"""
     devices = Device.query.join(User).order_by(User.username, Device.created_at.desc()).all()
     
-    # Update connection status
+    # Update connection status (no-op while the monitor is running)
     WireGuardManager.update_device_connection_status()
     
     return render_template('admin_devices.html', devices=devices)
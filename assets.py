@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Static asset pipeline
+Files under static/src are copied to static/dist with their content hash
+in the name (css/base.3f2a9c1e04b7.css), next to gzip and, if the brotli
+package is installed, brotli variants. Relative url()s in CSS are rewritten
+to the hashed names. static/dist/manifest.json maps source names to built
+ones; templates link assets with asset_url('css/base.css').
+
+/assets/ serves built files with a one year immutable Cache-Control, since
+a changed file gets a new name, and picks the precompressed variant the
+client accepts. The web app builds on startup; files that already exist
+are not rewritten, so this only costs hashing the sources.
+
+    python assets.py            # build
+    python assets.py --clean    # build and delete files of older builds
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is always built
+    brotli = None
+
+BASE_DIR = Path(__file__).parent
+SRC_DIR = BASE_DIR / 'static' / 'src'
+DIST_DIR = BASE_DIR / 'static' / 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt'}  # Fonts and images are compressed already
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# An optional leading ', ' so a missing source can be dropped from a src: list
+CSS_URL = re.compile(r"""(,\s*)?url\(\s*(['"]?)([^'")]+)\2\s*\)(\s*format\([^)]*\))?""")
+
+
+def _write(path, data, replace=False):
+    """Write atomically; existing files are kept unless replace, hashed names never change content"""
+    if path.exists() and not replace:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
+    return True
+
+
+def _rewrite_css(name, text, manifest):
+    """Point relative url()s at built names; sources that don't exist are dropped"""
+    def replace(match):
+        target = match.group(3)
+        if re.match(r'^([a-z]+:|/|#)', target):
+            return match.group(0)
+        source = os.path.normpath(os.path.join(os.path.dirname(name), target)).replace(os.sep, '/')
+        if source not in manifest:
+            print(f"assets: {name} references missing {source}, skipped", file=sys.stderr)
+            return ''
+        built = os.path.relpath(manifest[source], os.path.dirname(name)).replace(os.sep, '/')
+        return f"{match.group(1) or ''}url('{built}'){match.group(4) or ''}"
+    return CSS_URL.sub(replace, text)
+
+
+def build(src_dir=SRC_DIR, dist_dir=DIST_DIR, clean=False):
+    """Build every source file, returns the manifest {source name: built name}"""
+    src_dir, dist_dir = Path(src_dir), Path(dist_dir)
+    sources = sorted(path.relative_to(src_dir).as_posix() for path in src_dir.rglob('*')
+                     if path.is_file() and not path.name.startswith('.'))
+    # CSS last so the files it references are already hashed
+    sources.sort(key=lambda name: name.endswith('.css'))
+    
+    manifest = {}
+    written = []
+    for name in sources:
+        data = (src_dir / name).read_bytes()
+        if name.endswith('.css'):
+            data = _rewrite_css(name, data.decode(), manifest).encode()
+        stem, suffix = os.path.splitext(name)
+        built = f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{suffix}'
+        manifest[name] = built
+        
+        path = dist_dir / built
+        if _write(path, data):
+            written.append(built)
+        if suffix in COMPRESSIBLE:
+            _write(path.with_name(path.name + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(path.with_name(path.name + '.br'), brotli.compress(data, quality=11))
+    
+    body = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    manifest_path = dist_dir / MANIFEST
+    if not manifest_path.exists() or manifest_path.read_bytes() != body:
+        _write(manifest_path, body, replace=True)
+    
+    if clean:
+        keep = set(manifest.values())
+        for path in dist_dir.rglob('*'):
+            name = path.relative_to(dist_dir).as_posix()
+            if path.is_file() and name != MANIFEST and re.sub(r'\.(gz|br)$', '', name) not in keep:
+                path.unlink()
+    return manifest, written
+
+
+def load_manifest(dist_dir=DIST_DIR):
+    try:
+        with open(Path(dist_dir) / MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_app(app, src_dir=SRC_DIR, dist_dir=DIST_DIR):
+    """Build assets, register asset_url() for templates and the /assets/ route"""
+    from flask import abort, request, send_from_directory, url_for
+    
+    try:
+        manifest, _ = build(src_dir, dist_dir)
+    except OSError as e:
+        # Read-only install: use whatever was built before
+        app.logger.warning(f'Could not build static assets: {e}')
+        manifest = load_manifest(dist_dir)
+    built = set(manifest.values())
+    variants = {name: [(encoding, suffix) for encoding, suffix in ENCODINGS
+                       if (Path(dist_dir) / (name + suffix)).exists()]
+                for name in built}
+    
+    def asset_url(name):
+        if name in manifest:
+            return url_for('serve_asset', filename=manifest[name])
+        # Not built (e.g. added since startup): the plain source, without long caching
+        return url_for('static', filename=f'src/{name}')
+    
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        if filename not in built:
+            abort(404)
+        encoding = None
+        for candidate, suffix in variants[filename]:
+            if request.accept_encodings[candidate]:
+                encoding = candidate
+                filename += suffix
+                break
+        mimetype = mimetypes.guess_type(filename.removesuffix('.gz').removesuffix('.br'))[0]
+        response = send_from_directory(dist_dir, filename, mimetype=mimetype, max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    
+    app.jinja_env.globals['asset_url'] = asset_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build fingerprinted static assets')
+    parser.add_argument('--clean', action='store_true', help='delete files not in the new manifest')
+    args = parser.parse_args()
+    
+    manifest, written = build(clean=args.clean)
+    for name in written:
+        print(f"✓ {name}")
+    print(f"{len(manifest)} asset(s), {len(written)} new, brotli {'on' if brotli else 'off (pip install brotli)'}")
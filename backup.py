@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Online backup and restore
+A backup copies the live database with SQLite's online backup API a few
+pages at a time, so the web app and the monitor keep writing while it
+runs. The copy is archived together with every interface's rendered server
+config in one .tar.gz with a manifest of SHA-256 checksums:
+
+    manifest.json       created_at, interfaces, sha256 and size of each file
+    wireguard.db        consistent copy of the database, with all keys
+    configs/wg0.conf    server config as rendered from the database
+
+A restore verifies the checksums, writes the database back in one step,
+brings its schema up to date and reconciles the interfaces once. When the
+interfaces themselves are unchanged, only the peers that differ are sent
+with 'wg set'. Otherwise every config is rewritten and restarted.
+
+    python backup.py create                     # into BACKUP_DIR
+    python backup.py list
+    python backup.py verify FILE
+    python backup.py restore FILE [--no-apply]
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import tarfile
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import Config
+from models import db, create_data_app, Device
+from wireguard_manager import WireGuardManager
+
+ARCHIVE_PREFIX = 'wireguard-backup-'
+ARCHIVE_SUFFIX = '.tar.gz'
+DATABASE_NAME = 'wireguard.db'
+MANIFEST_NAME = 'manifest.json'
+CHUNK_SIZE = 1024 * 1024
+MAX_RESTARTS = 3  # Stepped copies restarted by writes before copying in one step
+
+
+def database_path():
+    """File of the app's SQLite database"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise Exception(f"Online backups need an SQLite database file, not {url}")
+    return url.database
+
+
+class _Restarted(Exception):
+    pass
+
+
+def copy_database(source_path, target_path, pages=None, pause=None):
+    """Copy a live database with the online backup API, returns the number of steps
+
+    Each step copies pages pages (-1 for all at once) under a short read
+    lock. A write by another connection between steps makes SQLite start
+    over, so the copy is always one consistent state. If writes keep
+    restarting it, the copy is finished in one step instead, which holds
+    the read lock until it is done.
+    """
+    pages = pages or Config.BACKUP_STEP_PAGES
+    pause = Config.BACKUP_STEP_PAUSE if pause is None else pause
+    state = {'steps': 0, 'restarts': 0, 'remaining': None}
+    
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+        # The source is unlocked between steps, give waiting writers their turn
+        if remaining and pause:
+            time.sleep(pause)
+    
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(target_path, timeout=30)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _Restarted:
+            source.backup(target)
+            state['steps'] += 1
+        result = target.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            raise Exception(f"Copied database failed its integrity check: {result}")
+    finally:
+        target.close()
+        source.close()
+    return state['steps']
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create_backup(directory=None, now=None):
+    """Write a backup archive into directory, returns its path"""
+    directory = directory or Config.BACKUP_DIR
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    now = now or datetime.utcnow()
+    name = f'{ARCHIVE_PREFIX}{now:%Y%m%d-%H%M%S}{ARCHIVE_SUFFIX}'
+    
+    # Staged next to the archive so the final rename is atomic
+    with tempfile.TemporaryDirectory(prefix='.backup-', dir=directory) as work:
+        files = {DATABASE_NAME: os.path.join(work, DATABASE_NAME)}
+        copy_database(database_path(), files[DATABASE_NAME])
+        
+        interfaces = WireGuardManager.get_interfaces()
+        for interface in interfaces:
+            config_path = os.path.join(work, f'{interface.name}.conf')
+            with open(config_path, 'w') as f:
+                f.write(WireGuardManager.update_server_config_with_devices(interface))
+            files[f'configs/{interface.name}.conf'] = config_path
+        
+        manifest = {
+            'created_at': now.isoformat(),
+            'interfaces': [interface.name for interface in interfaces],
+            'files': {member: {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+                      for member, path in files.items()},
+        }
+        manifest_path = os.path.join(work, MANIFEST_NAME)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        # Private keys inside: owner only
+        archive_path = os.path.join(work, name)
+        with os.fdopen(os.open(archive_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+            with tarfile.open(fileobj=f, mode='w:gz') as tar:
+                tar.add(manifest_path, arcname=MANIFEST_NAME)
+                for member, path in files.items():
+                    tar.add(path, arcname=member)
+        path = os.path.join(directory, name)
+        os.replace(archive_path, path)
+    return path
+
+
+def verify_backup(path, database_target=None):
+    """Check every file of an archive against its manifest, returns the manifest
+
+    With database_target the database is extracted there in the same pass.
+    """
+    manifest = None
+    found = {}
+    try:
+        with tarfile.open(path, 'r:gz') as tar:
+            for member in tar:
+                source = tar.extractfile(member)
+                if source is None:
+                    raise Exception(f"Unexpected entry {member.name}")
+                if member.name == MANIFEST_NAME:
+                    manifest = json.load(source)
+                    continue
+                target = open(database_target, 'wb') if database_target and member.name == DATABASE_NAME else None
+                digest = hashlib.sha256()
+                try:
+                    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        if target:
+                            target.write(chunk)
+                finally:
+                    if target:
+                        target.close()
+                found[member.name] = digest.hexdigest()
+    except (tarfile.TarError, EOFError, zlib.error, ValueError) as e:
+        raise Exception(f"{path} is damaged: {e}")
+    
+    if manifest is None:
+        raise Exception(f"{path} has no manifest")
+    expected = {member: entry['sha256'] for member, entry in manifest['files'].items()}
+    if DATABASE_NAME not in expected:
+        raise Exception(f"{path} has no database")
+    mismatched = sorted(member for member in expected.keys() | found.keys() if expected.get(member) != found.get(member))
+    if mismatched:
+        raise Exception(f"Checksum mismatch in {path}: {', '.join(mismatched)}")
+    return manifest
+
+
+def _interface_definitions(interfaces):
+    """What a restart would change besides the peers"""
+    return sorted((interface.name, interface.server_private_key, interface.address, interface.subnet,
+                   interface.listen_port) for interface in interfaces)
+
+
+def _upgrade_schema():
+    """Add tables and columns newer than the backup"""
+    db.create_all()
+    # Imports the web app, only needed here
+    from migrate_schema import add_missing_columns, enable_autoincrement, device_history_ids
+    added = add_missing_columns()
+    enable_autoincrement(Device, device_history_ids())
+    return added
+
+
+def reconcile(before=None):
+    """Bring the running interfaces in line with the database in one pass, returns a summary
+
+    before is (_interface_definitions, get_peer_sets) as they were before the
+    database changed. If the interfaces are the same, only the peers that
+    differ are pushed; otherwise all configs are rewritten and restarted.
+    """
+    interfaces = WireGuardManager.get_interfaces()
+    if before is not None and before[0] == _interface_definitions(interfaces):
+        diff = WireGuardManager.apply_peer_diff(interfaces, before[1])
+        changed = sum(len(entries) for changes in diff.values() for entries in changes.values())
+        return f"{changed} peer(s) updated in place"
+    WireGuardManager.apply_server_config_with_devices(ruleset=True)
+    return f"{len(interfaces)} interface(s) rewritten and restarted"
+
+
+def restore_backup(path, apply=True):
+    """Replace the database with an archive's copy, returns (manifest, reconcile summary or None)"""
+    live_path = database_path()
+    with tempfile.TemporaryDirectory(prefix='.restore-', dir=os.path.dirname(live_path) or '.') as work:
+        restored_path = os.path.join(work, DATABASE_NAME)
+        manifest = verify_backup(path, restored_path)
+        
+        before = None
+        if apply:
+            try:
+                interfaces = WireGuardManager.get_interfaces()
+                before = (_interface_definitions(interfaces), WireGuardManager.get_peer_sets(interfaces))
+            except Exception:
+                db.session.rollback()  # Empty or broken database: restart everything afterwards
+        
+        # No pooled connection may sit in a transaction while the file is rewritten
+        db.session.remove()
+        db.engine.dispose()
+        copy_database(restored_path, live_path, pages=-1, pause=0)
+        db.engine.dispose()
+    
+    _upgrade_schema()
+    if not apply:
+        return manifest, None
+    return manifest, reconcile(before)
+
+
+def list_backups(directory=None):
+    """Archive paths in directory, oldest first"""
+    directory = directory or Config.BACKUP_DIR
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names)
+            if name.startswith(ARCHIVE_PREFIX) and name.endswith(ARCHIVE_SUFFIX)]
+
+
+def last_backup_time(directory=None):
+    """Modification time of the newest archive, 0 if there is none"""
+    backups = list_backups(directory)
+    return os.path.getmtime(backups[-1]) if backups else 0.0
+
+
+def prune_backups(directory=None, keep=None):
+    """Delete all but the newest keep archives (0 keeps all), returns the deleted paths"""
+    keep = Config.BACKUP_KEEP if keep is None else keep
+    if keep <= 0:
+        return []
+    removed = list_backups(directory)[:-keep]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up and restore the database and server configs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    create = subparsers.add_parser('create', help='Write a backup now')
+    create.add_argument('--dir', default=Config.BACKUP_DIR, help='where archives are kept')
+    create.add_argument('--keep', type=int, default=Config.BACKUP_KEEP, help='newest archives to keep (0 keeps all)')
+    list_parser = subparsers.add_parser('list', help='List backups')
+    list_parser.add_argument('--dir', default=Config.BACKUP_DIR)
+    verify = subparsers.add_parser('verify', help='Check an archive against its checksums')
+    verify.add_argument('archive')
+    restore = subparsers.add_parser('restore', help='Restore the database and reconcile the interfaces')
+    restore.add_argument('archive')
+    restore.add_argument('--no-apply', action='store_true', help='only restore the database')
+    
+    args = parser.parse_args()
+    
+    with create_data_app().app_context():
+        try:
+            if args.command == 'create':
+                started = time.perf_counter()
+                path = create_backup(args.dir)
+                print(f"✓ Backup written to {path} ({os.path.getsize(path) / 1024:.0f} KiB "
+                      f"in {time.perf_counter() - started:.2f}s)")
+                for removed in prune_backups(args.dir, args.keep):
+                    print(f"  Deleted {removed}")
+            elif args.command == 'list':
+                backups = list_backups(args.dir)
+                print(f"{len(backups)} backup(s) in {args.dir}")
+                for path in backups:
+                    print(f"  {os.path.basename(path):<45} {os.path.getsize(path) / 1024:>10.0f} KiB")
+            elif args.command == 'verify':
+                manifest = verify_backup(args.archive)
+                print(f"✓ {args.archive} is intact: {len(manifest['files'])} file(s) "
+                      f"from {manifest['created_at']}")
+            elif args.command == 'restore':
+                manifest, summary = restore_backup(args.archive, apply=not args.no_apply)
+                print(f"✓ Database restored from {manifest['created_at']}")
+                print(f"✓ {summary}" if summary else "  Interfaces not touched (--no-apply)")
+        except Exception as e:
+            raise SystemExit(f"Error: {e}")
+
+if __name__ == '__main__':
+    main()
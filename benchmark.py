@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+"""
+Benchmark the WireGuardManager hot paths and main HTTP routes
+Seeds a throwaway SQLite database with N devices (N/2 users), points the
+app at fake_wg.py instead of the real 'wg'/'wg-quick', and records wall
+time, SQL query count and peak Python memory per operation.
+
+    python benchmark.py --sizes 100,1000,10000 --output results.json
+    python benchmark.py --sizes 100,1000 --compare results.json
+    python benchmark.py --load-test --duration 10
+
+Each size runs in its own subprocess so configuration, caches and peak
+memory never leak between sizes. Results are JSON so runs from different
+commits can be compared.
+
+--load-test serves the app from several processes and measures other users'
+latency while one user hammers the QR code route, with and without the rate
+limiter.
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+FAKE_WG = str(BASE_DIR / 'fake_wg.py')
+
+DEFAULT_SIZES = '100,1000,10000'
+
+
+# ==================== Worker (one size per process) ====================
+
+def configure_environment(workdir, environ=os.environ):
+    """Point Config at the scratch directory before the app is imported"""
+    environ.update({
+        'DATABASE_URI': f'sqlite:///{workdir}/bench.db',
+        'SECRET_KEY': 'benchmark',
+        'WG_BINARY': FAKE_WG,
+        'WG_QUICK_BINARY': FAKE_WG,
+        'WG_CONFIG_DIR': workdir,
+        'WG_SUBNET': '10.0.0.0/8',
+        'WG_SERVER_IP': '10.0.0.1',
+        'WG_SERVER_PUBLIC_IP': 'vpn.example.com',
+        'WG_NETWORK_INTERFACE': 'eth0',
+        'METRICS_PORT': '0',
+        'RATE_LIMIT_ENABLED': 'false',
+        'RATE_LIMIT_DB_PATH': f'{workdir}/ratelimit.db',
+    })
+
+
+def random_key():
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+def seed(size):
+    """Insert size devices spread over size/2 users with bulk inserts"""
+    import ipaddress
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    from fake_wg import public_key
+    from config import Config
+    from models import db, User, Device, WireGuardConfig
+    from wireguard_manager import WireGuardManager
+    
+    db.create_all()
+    server_private = random_key()
+    db.session.add(WireGuardConfig(server_private_key=server_private,
+                                   server_public_key=public_key(server_private),
+                                   last_ip_assigned=1))
+    db.session.commit()
+    interface = WireGuardManager.ensure_primary_interface()
+    
+    # Hashing once keeps seeding fast; every user shares the same password
+    password_hash = generate_password_hash('benchmark')
+    admin = User(username='admin', password_hash=password_hash, is_admin=True)
+    db.session.add(admin)
+    
+    user_count = max(size // 2, 1)
+    db.session.execute(insert(User), [
+        {'username': f'user{i}', 'password_hash': password_hash, 'email': f'user{i}@example.com',
+         'is_admin': False, 'is_active': True, 'max_connections': 10}
+        for i in range(user_count)
+    ])
+    db.session.commit()
+    user_ids = [row[0] for row in db.session.query(User.id).filter_by(is_admin=False).order_by(User.id)]
+    
+    network = ipaddress.ip_network(Config.WG_SUBNET)
+    devices = []
+    for i in range(size):
+        private_key = random_key()
+        devices.append({
+            'user_id': user_ids[i % user_count],
+            'interface_id': interface.id,
+            'device_name': f'device{i // user_count}',
+            'wg_public_key': public_key(private_key),
+            'wg_private_key': private_key,
+            'wg_preshared_key': random_key(),
+            'wg_ip_address': str(network.network_address + 2 + i),
+            'wg_allowed_ips': '0.0.0.0/0',
+            'is_active': True,
+        })
+    db.session.execute(insert(Device), devices)
+    interface.last_ip_assigned = size + 1
+    db.session.commit()
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+    
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def measure(name, fn, repeat, queries):
+    """Time fn repeat times, then run it once more under tracemalloc"""
+    durations = []
+    query_counts = []
+    for _ in range(repeat):
+        before = queries.count
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+        query_counts.append(queries.count - before)
+    
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {
+        'operation': name,
+        'runs': repeat,
+        'mean_s': statistics.mean(durations),
+        'median_s': statistics.median(durations),
+        'min_s': min(durations),
+        'max_s': max(durations),
+        'queries': max(query_counts),
+        'peak_bytes': peak,
+    }
+
+
+def run_worker(size, repeat):
+    workdir = tempfile.mkdtemp(prefix=f'wg-bench-{size}-')
+    configure_environment(workdir)
+    sys.path.insert(0, str(BASE_DIR))
+    
+    started = time.perf_counter()
+    from app import app
+    from models import db, User, Device
+    from wireguard_manager import WireGuardManager
+    import_seconds = time.perf_counter() - started
+    
+    results = []
+    with app.app_context():
+        started = time.perf_counter()
+        seed(size)
+        seed_seconds = time.perf_counter() - started
+        
+        queries = QueryCounter(db.engine)
+        created = iter(range(10 ** 9))
+        
+        # Writes the server config so fake_wg's dump reports every device
+        results.append(measure('apply_server_config_with_devices',
+                               WireGuardManager.apply_server_config_with_devices, 1, queries))
+        
+        bench_user = User.query.filter_by(username='user0').first()
+        device = Device.query.filter_by(user_id=bench_user.id).first()
+        device_config = WireGuardManager.get_device_config(device)
+        
+        def create_device():
+            # Stay under the user's limit no matter how many runs we do
+            bench_user.max_connections = 10 ** 6
+            WireGuardManager.create_device_config(bench_user, f'bench-{next(created)}')
+        
+        operations = [
+            ('update_server_config_with_devices', WireGuardManager.update_server_config_with_devices),
+            ('get_peer_statistics', WireGuardManager.get_peer_statistics),
+            ('update_device_connection_status', WireGuardManager.update_device_connection_status),
+            ('create_device_config', create_device),
+            ('generate_qr_code', lambda: WireGuardManager.generate_qr_code(device_config)),
+        ]
+        for name, fn in operations:
+            results.append(measure(name, fn, repeat, queries))
+            db.session.expire_all()
+        device_id = device.id
+    
+    # Requests must push their own app context, otherwise flask.g (and the
+    # logged in user cached on it) would be shared between both clients
+    admin_client = app.test_client()
+    admin_client.post('/login', data={'username': 'admin', 'password': 'benchmark'})
+    user_client = app.test_client()
+    user_client.post('/login', data={'username': 'user0', 'password': 'benchmark'})
+    
+    def get(client, url):
+        def request():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+        return request
+    
+    routes = [
+        ('GET /admin/dashboard', get(admin_client, '/admin/dashboard')),
+        ('GET /api/v1/peer-statistics', get(admin_client, '/api/v1/peer-statistics')),
+        ('GET /api/v1/peer-statistics?format=columns',
+         get(admin_client, '/api/v1/peer-statistics?format=columns')),
+        ('GET /devices', get(user_client, '/devices')),
+        ('GET /devices/<id>/qr-code', get(user_client, f'/devices/{device_id}/qr-code')),
+    ]
+    for name, fn in routes:
+        results.append(measure(name, fn, repeat, queries))
+    
+    results.extend(bench_peer_structures(size, repeat))
+    
+    return {
+        'size': size,
+        'import_s': import_seconds,
+        'seed_s': seed_seconds,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'results': results,
+    }
+
+
+# ==================== Monitor peer structures ====================
+
+def bench_peer_structures(size, repeat):
+    """Compare one monitor cycle with a fresh dict snapshot vs the persistent PeerTable
+    
+    Both parse the same dump text. The table is warmed with a previous
+    cycle first, as it would be in a running monitor. retained_bytes is the
+    memory still held after the cycle; the dict approach holds a whole new
+    snapshot each time while the table only replaces changed fields.
+    """
+    import gc
+    from collector import parse_dump
+    from fake_wg import random_key, render_dump
+    from peer_table import PeerTable
+    from collector import SourceResult
+    
+    peers = [(random_key(), random_key(), f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}/32') for i in range(size)]
+    server_key = random_key()
+    now = int(time.time())
+    previous = render_dump(server_key, 51820, peers, now - 30)
+    texts = [render_dump(server_key, 51820, peers, now + i * 30) for i in range(repeat + 1)]
+    result = SourceResult('wg0', None, 0.0, None)
+    
+    def dict_cycle(text):
+        return {p.public_key: p for p in parse_dump('wg0', text)}
+    
+    table = PeerTable()
+    table.update(now - 30, [('wg0', previous, result)])
+    
+    def table_cycle(text, taken_at):
+        return table.update(taken_at, [('wg0', text, result)])
+    
+    measurements = []
+    for name, cycle in (('monitor cycle: dict snapshot', lambda i: dict_cycle(texts[i])),
+                        ('monitor cycle: PeerTable', lambda i: table_cycle(texts[i], now + i * 30))):
+        durations = []
+        keep = None
+        for i in range(repeat):
+            started = time.perf_counter()
+            keep = cycle(i)
+            durations.append(time.perf_counter() - started)
+        
+        del keep
+        gc.collect()
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        objects_before = len(gc.get_objects())
+        keep = cycle(repeat)
+        current, peak = tracemalloc.get_traced_memory()
+        objects_after = len(gc.get_objects())
+        tracemalloc.stop()
+        
+        measurements.append({
+            'operation': name,
+            'runs': repeat,
+            'mean_s': statistics.mean(durations),
+            'median_s': statistics.median(durations),
+            'min_s': min(durations),
+            'max_s': max(durations),
+            'queries': 0,
+            'peak_bytes': peak - before,
+            'retained_bytes': current - before,
+            'tracked_objects': objects_after - objects_before,
+            'changes': len(keep) if name.endswith('PeerTable') else None,
+        })
+        del keep
+    return measurements
+
+
+# ==================== Process startup ====================
+
+# (name, statement timed in a fresh interpreter)
+STARTUP_TARGETS = [
+    ('startup: web app', 'import app'),
+    ('startup: connection monitor', 'import connection_monitor'),
+]
+
+STARTUP_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+{statement}
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'qrcode_loaded': 'qrcode' in sys.modules,
+    'flask_login_loaded': 'flask_login' in sys.modules,
+}}))
+"""
+
+
+def bench_startup(repeat):
+    """Import time and resident memory of the web app and the monitor, each in a fresh process"""
+    workdir = tempfile.mkdtemp(prefix='wg-bench-startup-')
+    env = dict(os.environ)
+    configure_environment(workdir, env)
+    
+    measurements = []
+    for name, statement in STARTUP_TARGETS:
+        samples = []
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', STARTUP_PROBE.format(statement=statement)],
+                                             cwd=BASE_DIR, env=env)
+            samples.append(json.loads(output.splitlines()[-1]))
+        durations = [s['seconds'] for s in samples]
+        measurements.append({
+            'operation': name,
+            'runs': repeat,
+            'mean_s': statistics.mean(durations),
+            'median_s': statistics.median(durations),
+            'min_s': min(durations),
+            'max_s': max(durations),
+            'queries': 0,
+            'peak_bytes': max(s['max_rss_kb'] for s in samples) * 1024,
+            'modules': samples[-1]['modules'],
+            'qrcode_loaded': samples[-1]['qrcode_loaded'],
+            'flask_login_loaded': samples[-1]['flask_login_loaded'],
+        })
+    return measurements
+
+
+# ==================== Rate limit load test ====================
+
+LOAD_SERVERS = 2  # Web worker processes sharing one rate limit store
+LOAD_VICTIMS = 4  # Well-behaved users, each browsing their dashboard
+LOAD_ABUSERS = 8  # Threads of one user requesting QR codes as fast as possible
+
+
+def serve(limited, ports):
+    """Web worker process: serve the app on a free port with the limiter on or off"""
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+    from config import Config
+    Config.RATE_LIMIT_ENABLED = limited
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def login(port, username):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor())
+    opener.open(f'http://127.0.0.1:{port}/login',
+                urllib.parse.urlencode({'username': username, 'password': 'benchmark'}).encode()).read()
+    return opener
+
+
+def abuse(ports, path, stop, results):
+    """Abuser process: LOAD_ABUSERS threads of user0 spread over every server
+
+    Runs at the lowest CPU priority: a real abuser's client runs on another
+    machine, only the requests it sends should cost the servers CPU.
+    """
+    os.nice(19)
+    counts = {}
+    lock = threading.Lock()
+    
+    def hammer(port):
+        opener = login(port, 'user0')
+        while not stop.is_set():
+            try:
+                status = opener.open(f'http://127.0.0.1:{port}{path}').status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            with lock:
+                counts[status] = counts.get(status, 0) + 1
+    
+    threads = [threading.Thread(target=hammer, args=(ports[i % len(ports)],)) for i in range(LOAD_ABUSERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(counts)
+
+
+def run_load_phase(name, limited, abused, duration):
+    context = multiprocessing.get_context('fork')
+    port_queue = context.Queue()
+    servers = [context.Process(target=serve, args=(limited, port_queue), daemon=True) for _ in range(LOAD_SERVERS)]
+    for server in servers:
+        server.start()
+    ports = [port_queue.get(timeout=30) for _ in servers]
+    
+    stop, results = context.Event(), context.Queue()
+    abuser = None
+    if abused:
+        abuser = context.Process(target=abuse, args=(ports, '/devices/1/qr-code', stop, results), daemon=True)
+        abuser.start()
+    
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    
+    def browse(index):
+        port = ports[index % len(ports)]
+        opener = login(port, f'user{index + 1}')
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            opener.open(f'http://127.0.0.1:{port}/dashboard').read()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+            time.sleep(0.05)
+    
+    victims = [threading.Thread(target=browse, args=(i,)) for i in range(LOAD_VICTIMS)]
+    for victim in victims:
+        victim.start()
+    for victim in victims:
+        victim.join()
+    
+    counts = {}
+    if abuser:
+        stop.set()
+        counts = results.get(timeout=30)
+        abuser.join()
+    for server in servers:
+        server.terminate()
+    
+    latencies.sort()
+    return {
+        'operation': f'load: GET /dashboard, {name}',
+        'runs': len(latencies),
+        'mean_s': statistics.mean(latencies),
+        'median_s': statistics.median(latencies),
+        'p95_s': latencies[int(len(latencies) * 0.95)],
+        'min_s': latencies[0],
+        'max_s': latencies[-1],
+        'queries': 0,
+        'peak_bytes': 0,
+        'abuser_requests': sum(counts.values()),
+        'abuser_allowed': counts.get(200, 0),
+        'abuser_rejected': counts.get(429, 0),
+    }
+
+
+def bench_load(duration):
+    """Other users' latency while one user hammers /devices/<id>/qr-code, with and without the limiter"""
+    workdir = tempfile.mkdtemp(prefix='wg-bench-load-')
+    configure_environment(workdir)
+    sys.path.insert(0, str(BASE_DIR))
+    from app import app
+    from models import db
+    
+    with app.app_context():
+        seed(20)
+        # Server processes are forked, they must not inherit pooled connections
+        db.engine.dispose()
+    
+    phases = [('no abuse', True, False), ('abuse, no limit', False, True), ('abuse, rate limited', True, True)]
+    results = []
+    for name, limited, abused in phases:
+        result = run_load_phase(name, limited, abused, duration)
+        results.append(result)
+        print_results([result])
+        if abused:
+            print(f"    abuser: {result['abuser_requests']} requests, {result['abuser_allowed']} allowed, "
+                  f"{result['abuser_rejected']} rejected; victim p95 {result['p95_s'] * 1000:.2f} ms", file=sys.stderr)
+    return results
+
+
+# ==================== Orchestration ====================
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def print_results(results):
+    for result in results:
+        print(f"  {result['operation']:<45} {result['mean_s'] * 1000:>10.2f} ms "
+              f"{result['queries']:>7} queries {result['peak_bytes'] / 1024:>10.0f} KiB",
+              file=sys.stderr)
+        if 'modules' in result:
+            # Startup rows: what the process had to import
+            loaded = [name for name in ('qrcode', 'flask_login') if result[f'{name}_loaded']]
+            print(f"  {'':<45} {result['modules']:>10} modules, loaded: {', '.join(loaded) or 'neither qrcode nor flask_login'}",
+                  file=sys.stderr)
+
+
+def run_sizes(sizes, repeat):
+    print('Benchmarking process startup...', file=sys.stderr)
+    startup = bench_startup(repeat)
+    print_results(startup)
+    
+    runs = []
+    for size in sizes:
+        print(f'Benchmarking {size} devices...', file=sys.stderr)
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--worker', str(size), '--repeat', str(repeat)],
+            cwd=BASE_DIR
+        )
+        run = json.loads(output)
+        runs.append(run)
+        print_results(run['results'])
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'startup': startup,
+        'runs': runs,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print mean-time ratios against a baseline; return True if nothing regressed"""
+    def index(report):
+        results = {(run['size'], r['operation']): r for run in report['runs'] for r in run['results']}
+        # Startup doesn't depend on the device count, listed as size 0
+        results.update({(0, r['operation']): r for r in report.get('startup', [])})
+        return results
+    
+    old, new = index(baseline), index(current)
+    ok = True
+    print(f"{'size':>7} {'operation':<45} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for key in sorted(new):
+        if key not in old:
+            continue
+        ratio = new[key]['mean_s'] / old[key]['mean_s'] if old[key]['mean_s'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{key[0]:>7} {key[1]:<45} {old[key]['mean_s'] * 1000:>9.2f} ms "
+              f"{new[key]['mean_s'] * 1000:>9.2f} ms {ratio:>6.2f}x{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'Comma separated device counts (default: {DEFAULT_SIZES})')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per operation')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--compare', help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Mean-time ratio above which --compare reports a regression')
+    parser.add_argument('--load-test', action='store_true',
+                        help='Measure rate limiting under abuse instead of the size benchmarks')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per --load-test phase')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker is not None:
+        json.dump(run_worker(args.worker, args.repeat), sys.stdout)
+        return 0
+    
+    if args.load_test:
+        report = {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'load_test': bench_load(args.duration),
+        }
+    else:
+        sizes = [int(s) for s in args.sizes.split(',') if s]
+        report = run_sizes(sizes, args.repeat)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}', file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 0 if compare(baseline, report, args.threshold) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
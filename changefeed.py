@@ -0,0 +1,104 @@
+"""
+Versioned peer change feed for multi-gateway deployments
+Whenever the server configs change, publish() diffs the peers the database
+wants against the last published state (peer_state) and appends one
+peer_changes row per added, changed or removed peer. Versions only grow, so
+gateway agents (gateway_agent.py) resume from the last version they applied
+and never need a full peer list unless they fall behind the retained log.
+"""
+from datetime import datetime
+from sqlalchemy import func, update, delete, insert, false
+from models import db, PeerChange, PeerState
+from config import Config
+
+CHANGE_FIELDS = ('version', 'interface', 'public_key', 'action', 'comment', 'preshared_key', 'allowed_ips')
+
+
+def publish(interfaces=None):
+    """Append the changes since the last publish for these interfaces (all if None), returns how many"""
+    from wireguard_manager import WireGuardManager
+    
+    # A no-op write takes SQLite's write lock before anything is read, so
+    # concurrent publishers serialize and versions commit in order
+    db.session.execute(update(PeerState).where(false()).values(comment=None))
+    
+    if interfaces is None:
+        interfaces = WireGuardManager.get_interfaces()
+        # Interfaces deleted since the last publish lose all their peers
+        names = {interface.name for interface in interfaces}
+        names.update(name for name, in db.session.query(PeerState.interface).distinct())
+    else:
+        names = {interface.name for interface in interfaces}
+    desired = WireGuardManager.get_peer_sets(interfaces)
+    
+    published = {name: {} for name in names}
+    rows = db.session.query(PeerState.interface, PeerState.public_key, PeerState.comment,
+                            PeerState.preshared_key, PeerState.allowed_ips).filter(PeerState.interface.in_(names))
+    for name, public_key, comment, preshared_key, allowed_ips in rows:
+        published[name][public_key] = (comment, preshared_key, allowed_ips)
+    
+    changes = []
+    for name in sorted(names):
+        old, new = published[name], desired.get(name, {})
+        # Removals first so an allowed IP moving to a new key is free when it's set
+        changes += [{'interface': name, 'public_key': key, 'action': 'remove',
+                     'comment': None, 'preshared_key': None, 'allowed_ips': None}
+                    for key in sorted(old.keys() - new.keys())]
+        changes += [{'interface': name, 'public_key': key, 'action': 'set',
+                     'comment': peer[0], 'preshared_key': peer[1], 'allowed_ips': peer[2]}
+                    for key, peer in sorted(new.items()) if old.get(key) != peer]
+    if not changes:
+        db.session.rollback()
+        return 0
+    
+    now = datetime.utcnow()
+    db.session.execute(insert(PeerChange), [dict(change, created_at=now) for change in changes])
+    for name in names:
+        stale = [change['public_key'] for change in changes if change['interface'] == name]
+        for index in range(0, len(stale), 500):
+            db.session.execute(delete(PeerState).where(PeerState.interface == name,
+                                                       PeerState.public_key.in_(stale[index:index + 500])))
+    state = [{key: change[key] for key in ('interface', 'public_key', 'comment', 'preshared_key', 'allowed_ips')}
+             for change in changes if change['action'] == 'set']
+    if state:
+        db.session.execute(insert(PeerState), state)
+    
+    latest = db.session.query(func.max(PeerChange.version)).scalar()
+    db.session.execute(delete(PeerChange).where(PeerChange.version <= latest - Config.CHANGEFEED_RETENTION))
+    db.session.commit()
+    return len(changes)
+
+
+def latest_version():
+    return db.session.query(func.max(PeerChange.version)).scalar() or 0
+
+
+def read_changes(after, limit):
+    """Up to limit change rows (dicts of CHANGE_FIELDS) with a version above after"""
+    rows = db.session.query(*[getattr(PeerChange, field) for field in CHANGE_FIELDS]) \
+        .filter(PeerChange.version > after).order_by(PeerChange.version).limit(limit)
+    return [dict(zip(CHANGE_FIELDS, row)) for row in rows]
+
+
+def is_retained(version):
+    """Whether every change after version is still in the log"""
+    oldest = db.session.query(func.min(PeerChange.version)).scalar()
+    return oldest is None or oldest <= version + 1
+
+
+def read_snapshot(interface_names=None):
+    """(version, {interface: {public key: (comment, psk, allowed ips)}}) to resume the feed from
+
+    The version is read before the peers: a change committed in between is
+    in the peers and gets replayed once more, which is harmless because
+    every change overwrites the whole peer.
+    """
+    version = latest_version()
+    query = db.session.query(PeerState.interface, PeerState.public_key, PeerState.comment,
+                             PeerState.preshared_key, PeerState.allowed_ips)
+    if interface_names is not None:
+        query = query.filter(PeerState.interface.in_(interface_names))
+    peers = {name: {} for name in interface_names or ()}
+    for name, public_key, comment, preshared_key, allowed_ips in query:
+        peers.setdefault(name, {})[public_key] = (comment, preshared_key, allowed_ips)
+    return version, peers
@@ -0,0 +1,186 @@
+"""
+Peer statistics collector
+Fans 'wg show <interface> dump' out over a bounded thread pool (or, for
+the asyncio monitor, bounded child processes) and merges the results into
+one snapshot with per-source timing
+"""
+import asyncio
+import contextvars
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import Config
+from metrics import DUMP_PARSE_SECONDS
+
+PeerSample = namedtuple('PeerSample', [
+    'source', 'public_key', 'endpoint', 'allowed_ips',
+    'latest_handshake', 'rx_bytes', 'tx_bytes'
+])
+
+SourceResult = namedtuple('SourceResult', ['name', 'peer_count', 'duration', 'error'])
+
+class Snapshot:
+    """Merged view of every source's peers at one point in time"""
+    
+    def __init__(self, taken_at, peers, sources):
+        self.taken_at = taken_at
+        self.peers = peers  # public key -> PeerSample
+        self.sources = sources  # list of SourceResult
+    
+    @property
+    def duration(self):
+        return max((s.duration for s in self.sources), default=0.0)
+    
+    @property
+    def failed_sources(self):
+        return [s for s in self.sources if s.error]
+    
+    def is_online(self, sample, window=180):
+        """A peer is online if it completed a handshake within the window"""
+        return sample.latest_handshake is not None and (self.taken_at - sample.latest_handshake) < window
+    
+    def __repr__(self):
+        return f'<Snapshot {len(self.peers)} peers from {len(self.sources)} sources>'
+
+
+def parse_dump(source, text):
+    """Parse 'wg show <interface> dump' output into PeerSamples"""
+    peers = []
+    if not text:
+        return peers
+    
+    # Skip header line (first line is interface info)
+    for line in text.split('\n')[1:]:
+        parts = line.split('\t')
+        if len(parts) >= 6:
+            peers.append(PeerSample(
+                source=source,
+                public_key=parts[0],
+                endpoint=parts[2] if parts[2] != '(none)' else None,
+                allowed_ips=parts[3],
+                latest_handshake=int(parts[4]) if parts[4] != '0' else None,
+                rx_bytes=int(parts[5]),
+                tx_bytes=int(parts[6]) if len(parts) > 6 else 0
+            ))
+    return peers
+
+
+def interface_sources(interface_names):
+    """Build (name, argv) sources for local interfaces"""
+    return [(name, [Config.WG_BINARY, 'show', name, 'dump']) for name in interface_names]
+
+
+class DumpCollector:
+    """Collects dumps from several sources in parallel
+
+    A source is a (name, argv) pair whose command prints 'wg show dump'
+    output, so a remote node can be reached through a local agent command
+    as well as a local interface.
+    """
+    
+    def __init__(self, max_workers=None, timeout=None):
+        self.max_workers = max_workers or Config.COLLECTOR_MAX_WORKERS
+        self.timeout = timeout or Config.COLLECTOR_TIMEOUT
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='wg-collector')
+    
+    def _collect_source(self, name, argv):
+        started = time.monotonic()
+        try:
+            result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    timeout=self.timeout, check=True)
+            return result.stdout.decode().strip(), SourceResult(name, None, time.monotonic() - started, None)
+        except subprocess.TimeoutExpired:
+            # subprocess.run() kills the child before raising
+            return None, SourceResult(name, 0, time.monotonic() - started, 'timeout')
+        except subprocess.CalledProcessError as e:
+            # Interface might not be up
+            return None, SourceResult(name, 0, time.monotonic() - started, f'exit status {e.returncode}')
+        except Exception as e:
+            return None, SourceResult(name, 0, time.monotonic() - started, str(e))
+    
+    def collect_raw(self, sources):
+        """Collect every source without parsing
+        
+        Returns (taken_at, [(name, dump text or None, SourceResult)]), for
+        callers such as PeerTable that parse into their own structures.
+        """
+        taken_at = time.time()
+        # Run each source in a copy of the caller's context so per-request
+        # instrumentation still sees the subprocesses started on its behalf
+        futures = {self._executor.submit(contextvars.copy_context().run, self._collect_source, name, argv): name
+                   for name, argv in sources}
+        
+        # Give stragglers a little slack over the per-source timeout
+        done, not_done = wait(futures, timeout=self.timeout + 1)
+        
+        results = []
+        for future in done:
+            text, result = future.result()
+            results.append((result.name, text, result))
+        for future in not_done:
+            future.cancel()
+            name = futures[future]
+            results.append((name, None, SourceResult(name, 0, self.timeout, 'timeout')))
+        
+        results.sort(key=lambda r: r[0])
+        return taken_at, results
+    
+    async def _collect_source_async(self, name, argv, semaphore):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(*argv, stdout=asyncio.subprocess.PIPE,
+                                                               stderr=asyncio.subprocess.DEVNULL)
+            except Exception as e:
+                return name, None, SourceResult(name, 0, time.monotonic() - started, str(e))
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return name, None, SourceResult(name, 0, time.monotonic() - started, 'timeout')
+            if process.returncode != 0:
+                # Interface might not be up
+                return name, None, SourceResult(name, 0, time.monotonic() - started,
+                                                f'exit status {process.returncode}')
+            return name, stdout.decode().strip(), SourceResult(name, None, time.monotonic() - started, None)
+    
+    async def collect_raw_async(self, sources):
+        """collect_raw() for asyncio callers: one child process per source, max_workers at a time"""
+        taken_at = time.time()
+        semaphore = asyncio.Semaphore(self.max_workers)
+        results = await asyncio.gather(*(self._collect_source_async(name, argv, semaphore)
+                                         for name, argv in sources))
+        return taken_at, sorted(results, key=lambda r: r[0])
+    
+    def collect(self, sources):
+        """Collect every source and merge the results into one Snapshot"""
+        taken_at, raw_results = self.collect_raw(sources)
+        
+        peers = {}
+        results = []
+        for name, text, result in raw_results:
+            if text is not None:
+                with DUMP_PARSE_SECONDS.time(source=name):
+                    samples = parse_dump(name, text)
+                for sample in samples:
+                    peers[sample.public_key] = sample
+                result = result._replace(peer_count=len(samples))
+            results.append(result)
+        
+        return Snapshot(taken_at, peers, results)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_collector = None
+
+def get_collector():
+    """Get the process-wide collector, creating it on first use"""
+    global _collector
+    if _collector is None:
+        _collector = DumpCollector()
+    return _collector
@@ -1,4 +1,5 @@
 import os
+import shlex
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,8 +15,123 @@ class Config:
     WG_SERVER_PUBLIC_IP = os.environ.get('WG_SERVER_PUBLIC_IP')
     WG_SERVER_PORT = int(os.environ.get('WG_SERVER_PORT', 51820))
     WG_DNS = os.environ.get('WG_DNS', '1.1.1.1,8.8.8.8')
-    WG_SUBNET = '10.8.0.0/24'
+    WG_SUBNET = os.environ.get('WG_SUBNET', '10.8.0.0/24')
     WG_NETWORK_INTERFACE = os.environ.get('WG_NETWORK_INTERFACE', 'eth0')
+    WG_BINARY = os.environ.get('WG_BINARY', '/usr/bin/wg')
+    WG_QUICK_BINARY = os.environ.get('WG_QUICK_BINARY', 'wg-quick')
+    WG_CONFIG_DIR = os.environ.get('WG_CONFIG_DIR', '/etc/wireguard')
+    WG_PLACEMENT = os.environ.get('WG_PLACEMENT', 'least_loaded')  # 'least_loaded' or 'hash'
+    WG_RECONCILE_WORKERS = int(os.environ.get('WG_RECONCILE_WORKERS', 4))
+    KEYGEN_WORKERS = int(os.environ.get('KEYGEN_WORKERS', 8))  # Parallel 'wg pubkey' calls for batch rekeys
+    EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', os.cpu_count() or 2))  # QR render processes for bulk exports
+    
+    # Extra dump sources, e.g. remote nodes reached through a local agent:
+    # WG_DUMP_SOURCES="node2=ssh node2 wg show wg0 dump;node3=/usr/local/bin/wg-agent dump"
+    WG_DUMP_SOURCES = [
+        (name.strip(), shlex.split(command))
+        for name, _, command in (
+            entry.partition('=') for entry in os.environ.get('WG_DUMP_SOURCES', '').split(';') if entry.strip()
+        )
+    ]
+    
+    # Stats collection
+    COLLECTOR_MAX_WORKERS = int(os.environ.get('COLLECTOR_MAX_WORKERS', 8))
+    COLLECTOR_TIMEOUT = float(os.environ.get('COLLECTOR_TIMEOUT', 5))
+    
+    # JSON API
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+    API_GZIP_MIN_SIZE = int(os.environ.get('API_GZIP_MIN_SIZE', 1024))
+    API_LOOKUP_MAX = int(os.environ.get('API_LOOKUP_MAX', 1000))  # Keys + IPs per bulk lookup
+    API_TOKEN_CACHE_SECONDS = int(os.environ.get('API_TOKEN_CACHE_SECONDS', 60))  # Revocation takes effect within this
+    
+    # Peer snapshot the monitor publishes each cycle for web workers (memory-mapped, best on
+    # tmpfs); older than PEER_SNAPSHOT_MAX_AGE seconds means the monitor is down and the web
+    # app runs 'wg show' itself again
+    PEER_SNAPSHOT_PATH = os.environ.get('PEER_SNAPSHOT_PATH', '/run/wireguard-gui/peers.snapshot')
+    PEER_SNAPSHOT_MAX_AGE = int(os.environ.get('PEER_SNAPSHOT_MAX_AGE', 90))
+    
+    # Multi-gateway change feed: the web app appends every peer change to peer_changes and
+    # gateway_agent.py applies them on each gateway. WG_LOCAL=false on a web host without WireGuard
+    CHANGEFEED_ENABLED = os.environ.get('CHANGEFEED_ENABLED', 'false').lower() == 'true'
+    CHANGEFEED_RETENTION = int(os.environ.get('CHANGEFEED_RETENTION', 10000))  # Log rows kept
+    WG_LOCAL = os.environ.get('WG_LOCAL', 'true').lower() == 'true'
+    GATEWAY_INTERFACES = [name for name in os.environ.get('GATEWAY_INTERFACES', '').split(',') if name]  # Empty = all
+    GATEWAY_POLL_INTERVAL = float(os.environ.get('GATEWAY_POLL_INTERVAL', 0.2))
+    GATEWAY_MAX_LAG = int(os.environ.get('GATEWAY_MAX_LAG', 2000))  # Pending changes beyond this: catch up from the snapshot
+    
+    # Per-device access control with nftables (replaces the iptables PostUp/PostDown rules).
+    # Users with allow rules may only reach those destinations; users without any rule
+    # get ACL_DEFAULT: 'allow' (no restriction) or 'deny' (no forwarding at all)
+    ACL_ENABLED = os.environ.get('ACL_ENABLED', 'false').lower() == 'true'
+    ACL_DEFAULT = os.environ.get('ACL_DEFAULT', 'allow')
+    NFT_BINARY = os.environ.get('NFT_BINARY', '/usr/sbin/nft')
+    
+    # Token bucket rate limit on expensive routes (QR codes, config downloads, adding
+    # devices, peer statistics), per user and route, shared by all workers through SQLite.
+    # Each route has a cost; a bucket holds RATE_LIMIT_CAPACITY and refills RATE_LIMIT_RATE per second
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_CAPACITY = float(os.environ.get('RATE_LIMIT_CAPACITY', 20))
+    RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 0.5))
+    RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH', '/run/wireguard-gui/ratelimit.db')
+    
+    # Rendered rows and tables of the admin dashboard and device pages, cached per worker
+    # and keyed by each row's updated_at, so only changed rows are rendered again
+    FRAGMENT_CACHE_ENABLED = os.environ.get('FRAGMENT_CACHE_ENABLED', 'true').lower() == 'true'
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    
+    # Key/IP lookup index written by the monitor each cycle; web workers fall back to
+    # the database when it is older than LOOKUP_INDEX_MAX_AGE seconds
+    LOOKUP_INDEX_PATH = os.environ.get('LOOKUP_INDEX_PATH', '/var/lib/wireguard-gui/lookup-index.json')
+    LOOKUP_INDEX_MAX_AGE = int(os.environ.get('LOOKUP_INDEX_MAX_AGE', 120))
+    
+    # Prometheus metrics: the monitor serves peer metrics on METRICS_PORT (0 disables),
+    # the web app serves its own internals on /metrics only when METRICS_TOKEN is set
+    METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 9586))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Connection monitor: seconds between collections, and cycles that may wait between its
+    # stages (collect -> diff -> database) before collection pauses for the slower one
+    MONITOR_INTERVAL = float(os.environ.get('MONITOR_INTERVAL', 30))
+    MONITOR_QUEUE_SIZE = int(os.environ.get('MONITOR_QUEUE_SIZE', 2))
+    
+    # Idle peers: active devices without a handshake for PARK_IDLE_DAYS are parked
+    # out of the live interface by the connection monitor (0 disables)
+    PARK_IDLE_DAYS = float(os.environ.get('PARK_IDLE_DAYS', 60))
+    PARK_INTERVAL = int(os.environ.get('PARK_INTERVAL', 3600))
+    
+    # Connection sessions recorded by the monitor, pruned by whole months
+    SESSION_RETENTION_DAYS = float(os.environ.get('SESSION_RETENTION_DAYS', 180))
+    
+    # Endpoint changes recorded by the monitor; a device is flagged as flapping when it
+    # changes endpoint ENDPOINT_FLAP_CHANGES times across 2+ IPs within ENDPOINT_FLAP_WINDOW seconds
+    ENDPOINT_RETENTION_DAYS = float(os.environ.get('ENDPOINT_RETENTION_DAYS', 90))
+    ENDPOINT_FLAP_WINDOW = int(os.environ.get('ENDPOINT_FLAP_WINDOW', 600))
+    ENDPOINT_FLAP_CHANGES = int(os.environ.get('ENDPOINT_FLAP_CHANGES', 4))
+    
+    # Key rotation (rotation.py): PSKs, and keypairs if enabled, of devices older than
+    # ROTATION_MAX_AGE_DAYS are staged, then switched over in batches once the client
+    # fetched the new config or ROTATION_GRACE_HOURS passed
+    ROTATION_MAX_AGE_DAYS = float(os.environ.get('ROTATION_MAX_AGE_DAYS', 90))
+    ROTATION_KEYPAIRS = os.environ.get('ROTATION_KEYPAIRS', 'false').lower() == 'true'
+    ROTATION_GRACE_HOURS = float(os.environ.get('ROTATION_GRACE_HOURS', 72))
+    ROTATION_BATCH_SIZE = int(os.environ.get('ROTATION_BATCH_SIZE', 25))
+    ROTATION_BATCH_PAUSE = float(os.environ.get('ROTATION_BATCH_PAUSE', 2))
+    ROTATION_INTERVAL = int(os.environ.get('ROTATION_INTERVAL', 300))
+    
+    # Online backups (backup.py): the database is copied with SQLite's backup API in steps of
+    # BACKUP_STEP_PAGES pages, pausing BACKUP_STEP_PAUSE seconds in between so writers get
+    # the lock, and archived with the server configs. The monitor makes one every
+    # BACKUP_INTERVAL seconds (0 disables) and keeps the newest BACKUP_KEEP
+    BACKUP_DIR = os.environ.get('BACKUP_DIR', '/var/backups/wireguard-gui')
+    BACKUP_INTERVAL = int(os.environ.get('BACKUP_INTERVAL', 0))
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+    BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 256))
+    BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 0.005))
+    
+    # Per-request cProfile capture for admins sending 'X-Profile: 1'
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILE_HISTORY = int(os.environ.get('PROFILE_HISTORY', 20))
     
     # Admin credentials
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
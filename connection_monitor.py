@@ -2,51 +2,281 @@
 """
 Connection Monitor Service
 Periodically updates device connection status based on WireGuard handshakes
+
+Runs on asyncio as three stages joined by bounded queues:
+
+    collect   'wg show dump' of every source as child processes, every MONITOR_INTERVAL
+    diff      merge into the PeerTable, publish the peer snapshot for web workers
+    persist   connection state, sessions, endpoints and usage, then quotas and the lookup index
+
+Collection of the next cycle overlaps the database work of the previous
+one. All database work, including housekeeping (pruning, parking idle
+devices, backups), runs on a single thread so SQLite sees one writer.
+SIGTERM stops collecting, lets queued cycles finish and exits.
 """
 import sys
 import time
+import signal
+import asyncio
 import logging
+import resource
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from pathlib import Path
 
+_import_started = time.perf_counter()
+
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from app import app
+from models import create_data_app
+from config import Config
+from metrics import REGISTRY, DB_UPDATE_SECONDS, MetricsExporter, render_peer_metrics
+from collector import get_collector
+from peer_table import PeerTable
+from peer_snapshot import SnapshotWriter
+from session_log import SessionLog, prune as prune_sessions
+from endpoint_tracker import EndpointTracker, prune as prune_endpoint_events
+from quota import QuotaTracker, record_usage
+from lookup_index import write_index
+from backup import create_backup, prune_backups, last_backup_time
 from wireguard_manager import WireGuardManager
+import timing
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/wireguard-monitor.log'),
-        logging.StreamHandler()
-    ]
-)
+# Database access only: the web app's routes, login manager and templates aren't loaded
+app = create_data_app()
+timing.instrument_class(WireGuardManager)
 
 logger = logging.getLogger('wireguard-monitor')
 
-def monitor_connections():
-    """Main monitoring loop"""
-    logger.info("WireGuard Connection Monitor started")
+# Peers persist between cycles; the metrics exporter thread reads the same table
+peer_table = PeerTable()
+session_log = SessionLog()
+endpoint_tracker = EndpointTracker(Config.ENDPOINT_FLAP_WINDOW, Config.ENDPOINT_FLAP_CHANGES)
+quota_tracker = QuotaTracker()
+snapshot_writer = SnapshotWriter(Config.PEER_SNAPSHOT_PATH)
+state = {'peer_index': {}, 'last_park': 0.0, 'last_prune': 0.0, 'last_backup': 0.0}
+
+def render_metrics():
+    """Render monitor metrics from the in-memory peer table"""
+    with peer_table.lock:
+        peers = render_peer_metrics(peer_table, state['peer_index'])
+    return REGISTRY.render() + peers
+
+class DatabaseThread:
+    """Runs database jobs one at a time on a dedicated thread, each in its own app context"""
     
-    update_interval = 30  # Update every 30 seconds
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='monitor-db')
     
-    while True:
+    def _call(self, fn, args):
+        with app.app_context():
+            return fn(*args)
+    
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn, args)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+# ==================== Database jobs (database thread) ====================
+
+def persist_cycle(taken_at, changes, full_sync):
+    """Write one cycle's changes, returns the keys whose endpoint is flapping"""
+    if full_sync:
+        resumed = session_log.resume()
+        if resumed:
+            logger.info(f"Resumed {resumed} open session(s)")
+    
+    logger.debug(f"Applying {len(changes)} peer changes...")
+    with DB_UPDATE_SECONDS.time():
+        WireGuardManager.apply_peer_changes(peer_table, changes, full_sync=full_sync)
+        session_log.observe(peer_table, changes, first_cycle=full_sync)
+        session_log.flush()
+        flapping = endpoint_tracker.observe(peer_table, changes, taken_at)
+        endpoint_tracker.flush()
+        record_usage(quota_tracker.observe(peer_table, changes, first_cycle=full_sync))
+        state['peer_index'] = WireGuardManager.get_peer_index()
+        quota_tracker.forget_unowned(state['peer_index'])
+    return flapping
+
+def reconcile_cycle():
+    """Per-cycle follow-up that doesn't read the peer table"""
+    # Key/IP index for the REST API's bulk lookups
+    try:
+        if write_index(Config.LOOKUP_INDEX_PATH):
+            logger.debug(f"Lookup index written to {Config.LOOKUP_INDEX_PATH}")
+    except OSError as e:
+        logger.warning(f"Could not write lookup index: {e}")
+    
+    blocked, restored = WireGuardManager.enforce_quotas()
+    for username in blocked:
+        logger.info(f"{username} is over quota, peers removed")
+    for username in restored:
+        logger.info(f"{username} is within quota again, peers restored")
+
+def housekeeping():
+    """Retention, idle parking and backups, each on its own schedule"""
+    # Drop history past retention once a day
+    if time.time() - state['last_prune'] >= 86400:
+        state['last_prune'] = time.time()
+        for name in prune_sessions(timedelta(days=Config.SESSION_RETENTION_DAYS)):
+            logger.info(f"Dropped session partition {name}")
+        pruned = prune_endpoint_events(timedelta(days=Config.ENDPOINT_RETENTION_DAYS))
+        if pruned:
+            logger.info(f"Deleted {pruned} old endpoint event(s)")
+    
+    # Park devices that have been idle for too long
+    if Config.PARK_IDLE_DAYS and time.time() - state['last_park'] >= Config.PARK_INTERVAL:
+        state['last_park'] = time.time()
+        parked = WireGuardManager.park_idle_devices(timedelta(days=Config.PARK_IDLE_DAYS))
+        if parked:
+            logger.info(f"Parked {parked} idle device(s)")
+    
+    # Online backup of the database and server configs
+    if Config.BACKUP_INTERVAL and time.time() - state['last_backup'] >= Config.BACKUP_INTERVAL:
+        state['last_backup'] = time.time()
         try:
-            with app.app_context():
-                logger.debug("Updating device connection status...")
-                WireGuardManager.update_device_connection_status()
-                logger.debug("Update completed successfully")
-                
+            logger.info(f"Backup written to {create_backup()}")
+            for path in prune_backups():
+                logger.info(f"Deleted old backup {path}")
         except Exception as e:
+            logger.error(f"Backup failed: {e}")
+
+# ==================== Stages ====================
+
+async def sleep_until(stop, deadline):
+    """Sleep until the loop time deadline, returns True if stop was set meanwhile"""
+    try:
+        await asyncio.wait_for(stop.wait(), max(deadline - asyncio.get_running_loop().time(), 0))
+    except asyncio.TimeoutError:
+        pass
+    return stop.is_set()
+
+async def collect_stage(database, collected, stop):
+    """Collect every source each interval; waits while the next stage is behind"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while not stop.is_set():
+        try:
+            logger.debug("Collecting peer statistics...")
+            sources = await database.run(WireGuardManager.get_dump_sources)
+            await collected.put(await get_collector().collect_raw_async(sources))
+        except Exception as e:
+            logger.error(f"Error collecting peer statistics: {e}")
+        
+        # Fixed rate; a collection that overran its slot is not made up for
+        deadline = max(deadline + Config.MONITOR_INTERVAL, loop.time())
+        if await sleep_until(stop, deadline):
+            break
+    await collected.put(None)
+
+async def diff_stage(collected, persisted, table_free):
+    """Merge collections into the peer table and publish it"""
+    while (item := await collected.get()) is not None:
+        taken_at, results = item
+        # The previous cycle's changes must be persisted before the table moves on
+        await table_free.acquire()
+        try:
+            changes = await asyncio.to_thread(peer_table.update, taken_at, results)
+            try:
+                await asyncio.to_thread(snapshot_writer.publish, peer_table)
+                if snapshot_writer.overflowed:
+                    logger.warning(f"{snapshot_writer.overflowed} peer(s) have allowed IPs or an endpoint "
+                                   f"too long for the peer snapshot, published as unknown")
+            except OSError as e:
+                logger.warning(f"Could not publish peer snapshot: {e}")
+        except Exception as e:
+            table_free.release()
+            logger.error(f"Error updating peer table: {e}")
+            continue
+        for source in peer_table.sources:
+            if source.error:
+                logger.warning(f"Source {source.name} failed after {source.duration:.3f}s: {source.error}")
+            else:
+                logger.debug(f"Source {source.name}: {source.peer_count} peers in {source.duration:.3f}s")
+        await persisted.put((taken_at, changes))
+    await persisted.put(None)
+
+async def persist_stage(database, persisted, table_free):
+    """Write each cycle to the database, then reconcile quotas"""
+    full_sync = True  # First cycle writes every device
+    while (item := await persisted.get()) is not None:
+        taken_at, changes = item
+        try:
+            flapping = await database.run(persist_cycle, taken_at, changes, full_sync)
+            full_sync = False
+            logger.debug("Update completed successfully")
+        except Exception as e:
+            flapping = []
             logger.error(f"Error updating connection status: {e}")
+        finally:
+            table_free.release()
         
-        time.sleep(update_interval)
+        for public_key in flapping:
+            username, device_name = state['peer_index'].get(public_key, ('unknown', public_key[:8]))
+            logger.warning(f"Endpoint of {username}/{device_name} is flapping between IPs, "
+                           f"the key may be in use on several devices")
+        try:
+            await database.run(reconcile_cycle)
+        except Exception as e:
+            logger.error(f"Error enforcing quotas: {e}")
+
+async def housekeeping_stage(database, stop):
+    """Run housekeeping() every interval until stopped"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await database.run(housekeeping)
+        except Exception as e:
+            logger.error(f"Error during housekeeping: {e}")
+        if await sleep_until(stop, loop.time() + Config.MONITOR_INTERVAL):
+            break
+
+async def monitor_connections():
+    """Run the monitor stages until SIGTERM or SIGINT"""
+    logger.info(f"WireGuard Connection Monitor started in {time.perf_counter() - _import_started:.2f}s, "
+                f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB RSS")
+    
+    if Config.METRICS_PORT:
+        MetricsExporter(render_metrics, Config.METRICS_HOST, Config.METRICS_PORT).start()
+        logger.info(f"Metrics exporter listening on {Config.METRICS_HOST}:{Config.METRICS_PORT}")
+    if Config.BACKUP_INTERVAL:
+        state['last_backup'] = last_backup_time()
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    
+    database = DatabaseThread()
+    collected = asyncio.Queue(Config.MONITOR_QUEUE_SIZE)
+    persisted = asyncio.Queue(Config.MONITOR_QUEUE_SIZE)
+    table_free = asyncio.Semaphore(1)
+    try:
+        await asyncio.gather(
+            collect_stage(database, collected, stop),
+            diff_stage(collected, persisted, table_free),
+            persist_stage(database, persisted, table_free),
+            housekeeping_stage(database, stop),
+        )
+    finally:
+        database.shutdown()
+    logger.info("Monitor stopped")
 
 if __name__ == '__main__':
+    # Configured here rather than on import so benchmark.py can import the monitor
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('/var/log/wireguard-monitor.log'),
+            logging.StreamHandler()
+        ]
+    )
+    
     try:
-        monitor_connections()
+        asyncio.run(monitor_connections())
     except KeyboardInterrupt:
         logger.info("Monitor stopped by user")
         sys.exit(0)
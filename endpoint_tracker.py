@@ -0,0 +1,136 @@
+"""
+Endpoint change tracker
+Records when a device's endpoint changes (roaming, NAT rebinding) as compact
+events and flags devices whose endpoint flips between IPs faster than
+expected, which usually means one key is used from several places at once
+"""
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy import func
+from models import db, Device, EndpointEvent
+
+
+def split_endpoint(endpoint):
+    """'1.2.3.4:51820' or '[2001:db8::1]:51820' -> (ip, port)"""
+    if not endpoint:
+        return None, None
+    host, _, port = endpoint.rpartition(':')
+    return host.strip('[]'), int(port) if port.isdigit() else None
+
+
+def get_endpoint_history(device_id, start, end, limit=1000):
+    """Endpoint changes of a device within [start, end), newest first"""
+    return EndpointEvent.query.filter(
+        EndpointEvent.device_id == device_id,
+        EndpointEvent.seen_at >= start,
+        EndpointEvent.seen_at < end
+    ).order_by(EndpointEvent.seen_at.desc()).limit(limit).all()
+
+
+def get_flapping_devices(since, min_changes):
+    """Devices with at least min_changes endpoint changes across 2+ IPs since a moment
+
+    Returns (device_id, changes, distinct ips) rows, most changes first.
+    """
+    changes = func.count(EndpointEvent.id)
+    ips = func.count(func.distinct(EndpointEvent.ip))
+    return db.session.query(EndpointEvent.device_id, changes, ips).filter(
+        EndpointEvent.seen_at >= since
+    ).group_by(EndpointEvent.device_id).having(changes >= min_changes, ips >= 2).order_by(changes.desc()).all()
+
+
+def prune(retention, now=None):
+    """Delete events older than retention, returns how many"""
+    count = EndpointEvent.query.filter(
+        EndpointEvent.seen_at < (now or datetime.now()) - retention
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+class EndpointTracker:
+    """Last endpoint per peer plus recent changes, kept between monitor cycles
+    
+    The last endpoint itself lives in the PeerTable, which reports every
+    change; this keeps a short window of change times per key for flap
+    detection and queues events for one batched insert per cycle.
+    """
+    
+    def __init__(self, flap_window, flap_changes):
+        self.flap_window = flap_window
+        self.flap_changes = flap_changes
+        self.recent = {}
+        self._previous = {}
+        self._device_ids = {}
+        self._events = []
+    
+    def observe(self, table, changes, now=None):
+        """Queue events for this cycle's endpoint changes, returns newly flapping public keys"""
+        now = now or time.time()
+        # Remember every endpoint so the first change has a previous one
+        changed = []
+        for change in changes:
+            if change.kind == 'removed':
+                self._previous.pop(change.public_key, None)
+                self.recent.pop(change.public_key, None)
+                continue
+            record = table.peers.get(change.public_key)
+            if record is None or not record.endpoint:
+                continue
+            if change.kind == 'endpoint':
+                changed.append(record)
+            elif change.public_key not in self._previous:
+                self._previous[change.public_key] = record.endpoint
+        
+        if not changed:
+            return []
+        self._resolve_devices([record.public_key for record in changed])
+        
+        flapping = []
+        seen_at = datetime.fromtimestamp(now)
+        for record in changed:
+            previous = self._previous.get(record.public_key)
+            self._previous[record.public_key] = record.endpoint
+            if previous == record.endpoint:
+                continue
+            
+            ip, port = split_endpoint(record.endpoint)
+            window = self.recent.setdefault(record.public_key, deque())
+            was_flapping = self._is_flapping(window)
+            window.append((now, ip))
+            while window and window[0][0] < now - self.flap_window:
+                window.popleft()
+            is_flapping = self._is_flapping(window)
+            if is_flapping and not was_flapping:
+                flapping.append(record.public_key)
+            
+            device_id = self._device_ids.get(record.public_key)
+            if device_id is None:
+                continue  # Legacy users and peers unknown to the database
+            previous_ip, previous_port = split_endpoint(previous)
+            self._events.append({
+                'device_id': device_id, 'ip': ip, 'port': port,
+                'previous_ip': previous_ip, 'previous_port': previous_port,
+                'seen_at': seen_at, 'is_flapping': is_flapping
+            })
+        return flapping
+    
+    def _is_flapping(self, window):
+        return len(window) >= self.flap_changes and len({ip for _, ip in window}) >= 2
+    
+    def _resolve_devices(self, public_keys):
+        missing = [key for key in public_keys if key not in self._device_ids]
+        for index in range(0, len(missing), 500):
+            self._device_ids.update(db.session.query(Device.wg_public_key, Device.id)
+                                    .filter(Device.wg_public_key.in_(missing[index:index + 500])))
+    
+    def flush(self):
+        """Insert queued events in one executemany"""
+        if not self._events:
+            return 0
+        db.session.execute(EndpointEvent.__table__.insert(), self._events)
+        db.session.commit()
+        count = len(self._events)
+        self._events = []
+        return count
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Bulk export of client configs and QR codes
+Streams a zip or tar.gz with <username>/<device>.conf (plus a QR image) for
+every active device. Archives are written entry by entry into a small
+buffer that is drained after each chunk of devices, so memory stays flat
+no matter how many devices are exported. QR codes are rendered in a
+process pool.
+
+    python export.py -o configs.zip --qr svg --user alice --interface wg1
+"""
+import argparse
+import multiprocessing
+import re
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from models import db, User, Device, WireGuardInterface, create_data_app
+from config import Config
+from wireguard_manager import WireGuardManager
+
+FORMATS = {
+    'zip': ('application/zip', 'zip'),
+    'tar': ('application/gzip', 'tar.gz')
+}
+QR_FORMATS = ('png', 'svg', 'none')
+
+
+def render_qr(config_text, image_format):
+    """Process pool entry point"""
+    return WireGuardManager.render_qr_image(config_text, image_format)
+
+
+def _safe_name(name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('._') or 'unnamed'
+
+
+class _Sink:
+    """Write-only stream that hands out what was written since the last drain"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_device_configs(usernames=None, interface_names=None, batch_size=500):
+    """Yield (archive path, config text) for active devices, optionally filtered"""
+    primary = WireGuardManager.get_primary_interface()
+    interfaces = {interface.id: interface for interface in WireGuardInterface.query.all()}
+    
+    query = db.session.query(
+        User.username, Device.device_name, Device.interface_id, Device.wg_ip_address, Device.wg_allowed_ips,
+        Device.wg_private_key, Device.wg_preshared_key, Device.pending_private_key, Device.pending_preshared_key
+    ).join(User, Device.user_id == User.id).filter(Device.is_active == True, User.is_active == True)
+    if usernames:
+        query = query.filter(User.username.in_(usernames))
+    if interface_names:
+        ids = [i.id for i in interfaces.values() if i.name in interface_names]
+        if primary.name in interface_names:
+            query = query.filter(Device.interface_id.in_(ids) | Device.interface_id.is_(None))
+        else:
+            query = query.filter(Device.interface_id.in_(ids))
+    
+    for row in query.order_by(User.username, Device.device_name).yield_per(batch_size):
+        interface = interfaces.get(row.interface_id, primary)
+        # Staged rotations export the new keys, like a download would
+        config = WireGuardManager.render_client_config(
+            row.pending_private_key or row.wg_private_key, row.wg_ip_address,
+            row.pending_preshared_key or row.wg_preshared_key, row.wg_allowed_ips, interface
+        )
+        yield f'{_safe_name(row.username)}/{_safe_name(row.device_name)}', config
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_export(usernames=None, interface_names=None, archive_format='zip', qr_format='png',
+                  workers=None, chunk_size=64):
+    """Generate the archive as a sequence of byte chunks"""
+    if archive_format not in FORMATS:
+        raise Exception(f"Unknown archive format '{archive_format}'")
+    if qr_format not in QR_FORMATS:
+        raise Exception(f"Unknown QR format '{qr_format}'")
+    
+    sink = _Sink()
+    if archive_format == 'zip':
+        archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+        def add(path, data, modified):
+            info = zipfile.ZipInfo(path, time.localtime(modified)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, data)
+    else:
+        archive = tarfile.open(fileobj=sink, mode='w|gz')
+        def add(path, data, modified):
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            info.mtime = modified
+            info.mode = 0o600
+            archive.addfile(info, BytesIO(data))
+    
+    pool = None
+    if qr_format != 'none':
+        # spawn: forking a threaded web server with open database connections isn't safe
+        pool = ProcessPoolExecutor(max_workers=workers or Config.EXPORT_WORKERS,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    try:
+        modified = time.time()
+        for batch in _batched(iter_device_configs(usernames, interface_names), chunk_size):
+            images = [None] * len(batch)
+            if pool:
+                images = pool.map(render_qr, [config for _, config in batch], [qr_format] * len(batch))
+            for (path, config), image in zip(batch, images):
+                add(f'{path}.conf', config.encode(), modified)
+                if image is not None:
+                    add(f'{path}.{qr_format}', image, modified)
+            yield sink.drain()
+        archive.close()
+        yield sink.drain()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export client configs and QR codes of all active devices')
+    parser.add_argument('-o', '--output', required=True, help="archive to write, '-' for stdout")
+    parser.add_argument('--format', choices=FORMATS, default='zip')
+    parser.add_argument('--qr', choices=QR_FORMATS, default='png', help='QR image format (default png)')
+    parser.add_argument('--user', action='append', help='only this username (repeatable)')
+    parser.add_argument('--interface', action='append', help='only devices on this interface (repeatable)')
+    parser.add_argument('--workers', type=int, help='QR render processes')
+    args = parser.parse_args()
+    
+    with create_data_app().app_context():
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            size = 0
+            for chunk in stream_export(args.user, args.interface, args.format, args.qr, args.workers):
+                output.write(chunk)
+                size += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+    if args.output != '-':
+        print(f"✓ Wrote {args.output} ({size / 1024:.1f} KiB)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the 'wg' and 'wg-quick' binaries
+Used by benchmarks and local development without a WireGuard kernel module:
+
+    WG_BINARY=./fake_wg.py WG_QUICK_BINARY=./fake_wg.py WG_CONFIG_DIR=/tmp/wg ...
+
+'show <interface> dump' emits synthetic, deterministic statistics for the
+peers in <WG_CONFIG_DIR>/<interface>.conf (or FAKE_WG_PEERS random peers if
+no config was written). Mutating commands succeed without doing anything.
+
+Environment:
+    FAKE_WG_PEERS         peers to invent when no config exists (default 0)
+    FAKE_WG_ONLINE_RATIO  fraction of peers with a recent handshake (default 0.5)
+    FAKE_WG_DELAY         seconds to sleep before answering (default 0)
+"""
+import base64
+import hashlib
+import os
+import sys
+import time
+
+CONFIG_DIR = os.environ.get('WG_CONFIG_DIR', '/etc/wireguard')
+ONLINE_RATIO = float(os.environ.get('FAKE_WG_ONLINE_RATIO', 0.5))
+
+
+def random_key():
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+def public_key(private_key):
+    return base64.b64encode(hashlib.sha256(private_key.encode()).digest()).decode()
+
+
+def read_config(interface):
+    """Parse the interface's config into (private key, port, [(public key, psk, allowed ips)])"""
+    path = os.path.join(CONFIG_DIR, f'{interface}.conf')
+    if not os.path.exists(path):
+        peers = [(random_key(), '(none)', f'10.0.{i // 250}.{i % 250 + 2}/32')
+                 for i in range(int(os.environ.get('FAKE_WG_PEERS', 0)))]
+        return random_key(), 51820, peers
+    
+    private_key, port, peers, current = '', 51820, [], None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == '[Peer]':
+                current = {}
+                peers.append(current)
+                continue
+            key, _, value = line.partition(' = ')
+            if current is None:
+                if key == 'PrivateKey':
+                    private_key = value
+                elif key == 'ListenPort':
+                    port = int(value)
+            elif key in ('PublicKey', 'PresharedKey', 'AllowedIPs'):
+                current[key] = value
+    return private_key, port, [(p.get('PublicKey', ''), p.get('PresharedKey', '(none)'), p.get('AllowedIPs', ''))
+                               for p in peers]
+
+
+def render_dump(private_key, port, peers, now=None):
+    """Render 'wg show dump' text for (public key, psk, allowed ips) peers"""
+    now = int(now or time.time())
+    lines = [f'{private_key}\t{public_key(private_key)}\t{port}\toff']
+    
+    for key, psk, allowed_ips in peers:
+        # Stable per-peer values so successive dumps look like one live interface
+        seed = int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+        if (seed % 1000) / 1000 < ONLINE_RATIO:
+            handshake = now - seed % 120
+            endpoint = f'198.51.{seed % 256}.{(seed >> 8) % 256}:{1024 + seed % 60000}'
+            rx = (seed % 10_000_000) + (now % 86400) * (seed % 997)
+            tx = (seed % 50_000_000) + (now % 86400) * (seed % 4999)
+        else:
+            # Offline peers either never connected or went quiet days ago
+            handshake = 0 if seed % 3 == 0 else now - 86400 * (1 + seed % 90)
+            endpoint = '(none)' if handshake == 0 else f'203.0.113.{seed % 256}:{1024 + seed % 60000}'
+            rx = 0 if handshake == 0 else seed % 1_000_000
+            tx = 0 if handshake == 0 else seed % 5_000_000
+        lines.append(f'{key}\t{psk}\t{endpoint}\t{allowed_ips}\t{handshake}\t{rx}\t{tx}\t25')
+    
+    return '\n'.join(lines) + '\n'
+
+
+def dump(interface):
+    sys.stdout.write(render_dump(*read_config(interface)))
+
+
+def main(argv):
+    delay = float(os.environ.get('FAKE_WG_DELAY', 0))
+    if delay:
+        time.sleep(delay)
+    
+    command = argv[1] if len(argv) > 1 else 'show'
+    if command in ('genkey', 'genpsk'):
+        print(random_key())
+    elif command == 'pubkey':
+        print(public_key(sys.stdin.read().strip()))
+    elif command == 'show':
+        if len(argv) > 3 and argv[3] == 'dump':
+            dump(argv[2])
+    elif command == 'strip':
+        # wg-quick strip: print the config without wg-quick specific keys
+        with open(os.path.join(CONFIG_DIR, f'{argv[2]}.conf')) as f:
+            sys.stdout.write(f.read())
+    elif command in ('set', 'setconf', 'addconf', 'syncconf', 'up', 'down'):
+        # Mutations and wg-quick up/down are accepted and ignored
+        pass
+    else:
+        print(f'fake_wg: unsupported command {command}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,96 @@
+"""
+Fragment cache for rendered template HTML
+Templates wrap a table row, or a whole table, in a call block:
+
+    {% call cached_fragment('user-row', user.id, user.updated_at, usage) %}
+        <tr>...</tr>
+    {% endcall %}
+
+The block is only rendered when nothing is cached under that key. Keys
+carry the row's updated_at, which every write bumps (ORM flushes and bulk
+updates alike), plus any live values the fragment shows. A change
+therefore produces a new key in every worker, and the stale entry is never
+read again; it just ages out of the LRU. Tables are keyed by version() of
+their row keys, so an unchanged table is one lookup.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from config import Config
+from metrics import FRAGMENT_CACHE_TOTAL
+
+
+class FragmentCache:
+    """LRU of rendered HTML, bounded by the total length of the fragments"""
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+    
+    def set(self, key, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = html
+            self.size += len(html)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+    
+    def invalidate(self, name=None):
+        """Drop the fragments called name, or everything"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            for key in [key for key in self._entries if key[0] == name]:
+                self.size -= len(self._entries.pop(key))
+    
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = FragmentCache(Config.FRAGMENT_CACHE_MAX_BYTES)
+
+
+def version(keys):
+    """Short digest of an iterable of row keys, for keying a whole table"""
+    digest = hashlib.sha1()
+    for key in keys:
+        digest.update(repr(key).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def cached_fragment(name, *key, caller):
+    """Jinja call block target: the cached HTML for (name, *key), rendering it on a miss"""
+    if not Config.FRAGMENT_CACHE_ENABLED:
+        return caller()
+    key = (name,) + key
+    html = cache.get(key)
+    if html is not None:
+        FRAGMENT_CACHE_TOTAL.inc(fragment=name, result='hit')
+        return html
+    FRAGMENT_CACHE_TOTAL.inc(fragment=name, result='miss')
+    html = Markup(caller())
+    cache.set(key, html)
+    return html
+
+
+def init_app(app):
+    """Make cached_fragment() available to templates"""
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
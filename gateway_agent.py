@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Gateway Agent
+Runs on every WireGuard gateway that shares the user database. It follows
+the change feed (changefeed.py) from the last version it applied and
+pushes only the changed peers to the local interfaces with 'wg set',
+rewriting their config files without a restart. When it starts, or falls
+more than GATEWAY_MAX_LAG changes behind, it catches up from the published
+peer snapshot instead.
+
+Several agents can run on one machine against fake_wg.py, each with its
+own config directory:
+
+    WG_BINARY=./fake_wg.py WG_QUICK_BINARY=./fake_wg.py WG_CONFIG_DIR=/tmp/gw1 \\
+        python gateway_agent.py --interfaces wg0
+"""
+import os
+import sys
+import subprocess
+import time
+import logging
+import argparse
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import Config
+from models import WireGuardInterface, create_data_app
+from collector import get_collector, interface_sources
+from wireguard_manager import WireGuardManager
+import changefeed
+
+app = create_data_app()
+
+logger = logging.getLogger('wireguard-gateway')
+
+class GatewayAgent:
+    """Applies the change feed to this gateway's interfaces"""
+    
+    def __init__(self, interface_names=None, config_dir=None, max_lag=None):
+        self.interface_names = set(interface_names) if interface_names else None  # None = all
+        self.config_dir = config_dir or Config.WG_CONFIG_DIR
+        self.max_lag = max_lag or Config.GATEWAY_MAX_LAG
+        self.version = None  # None until the first catch-up
+        self.peers = None  # interface -> {public key: (comment, psk, allowed ips)} as applied
+    
+    def _owns(self, name):
+        return self.interface_names is None or name in self.interface_names
+    
+    def read_live_peers(self):
+        """Peers on the running interfaces, so stale ones are removed on the first catch-up"""
+        interfaces = WireGuardManager.get_interfaces()
+        names = [interface.name for interface in interfaces if self._owns(interface.name)]
+        snapshot = get_collector().collect(interface_sources(names))
+        peers = {name: {} for name in names}
+        for sample in snapshot.peers.values():
+            # The preshared key isn't in the dump, so every live peer is re-sent once
+            peers.setdefault(sample.source, {})[sample.public_key] = (None, None, sample.allowed_ips)
+        return peers
+    
+    def catch_up(self):
+        """Replace the applied peers with the published snapshot"""
+        if self.peers is None:
+            self.peers = self.read_live_peers()
+        version, peers = changefeed.read_snapshot(
+            sorted(self.interface_names) if self.interface_names is not None else None)
+        for name in self.peers:
+            peers.setdefault(name, {})
+        changed = self.apply(peers, rewrite=True)
+        if changed is not None:
+            self.version = version
+            logger.info(f"Caught up to version {version}, {changed} peer(s) changed")
+        return changed or 0
+    
+    def poll(self):
+        """Apply pending changes, returns the number of peers changed"""
+        if self.version is None:
+            return self.catch_up()
+        
+        changes = changefeed.read_changes(self.version, self.max_lag + 1)
+        if not changes:
+            if changefeed.latest_version() < self.version:
+                logger.warning("Change feed went backwards, catching up")
+                return self.catch_up()
+            return 0
+        if len(changes) > self.max_lag or (changes[0]['version'] != self.version + 1
+                                           and not changefeed.is_retained(self.version)):
+            logger.info(f"{len(changes)}+ change(s) behind at version {self.version}, catching up")
+            return self.catch_up()
+        
+        peers = {name: dict(interface_peers) for name, interface_peers in self.peers.items()}
+        for change in changes:
+            if not self._owns(change['interface']):
+                continue
+            interface_peers = peers.setdefault(change['interface'], {})
+            if change['action'] == 'remove':
+                interface_peers.pop(change['public_key'], None)
+            else:
+                interface_peers[change['public_key']] = (change['comment'], change['preshared_key'],
+                                                         change['allowed_ips'])
+        changed = self.apply(peers)
+        if changed is not None:
+            self.version = changes[-1]['version']
+        return changed or 0
+    
+    def apply(self, peers, rewrite=False):
+        """Push the difference to peers to the interfaces, returns peers changed or None on failure
+
+        Config files are rewritten for changed interfaces, or all of them with
+        rewrite. An interface that can't be updated in place is restarted
+        from its config file. If that fails too the agent catches up on the
+        next poll.
+        """
+        diff = WireGuardManager.diff_peer_sets(self.peers, peers)
+        names = list(peers) if rewrite else list(diff)
+        if not names:
+            self.peers = peers
+            return 0
+        
+        interfaces = {interface.name: interface for interface in WireGuardInterface.query.filter(
+            WireGuardInterface.name.in_(names))}
+        failed = False
+        changed = 0
+        for name in names:
+            changes = diff.get(name)
+            interface = interfaces.get(name)
+            if interface is None:
+                # Deleted interface: nothing left to configure here
+                self.peers[name] = peers[name]
+                continue
+            config = WireGuardManager.render_server_config(
+                interface, [(comment, public_key, psk, allowed_ips)
+                            for public_key, (comment, psk, allowed_ips) in peers[name].items()])
+            try:
+                try:
+                    if changes:
+                        WireGuardManager.set_interface_peers(name, WireGuardManager.get_peer_updates(changes, peers[name]))
+                    self.write_config(name, config)
+                except Exception as e:
+                    logger.warning(f"{e}, restarting {name}")
+                    self.write_config(name, config)
+                    self.restart(name)
+            except Exception as e:
+                logger.error(f"Error applying peers on {name}: {e}")
+                failed = True
+                continue
+            self.peers[name] = peers[name]
+            changed += sum(len(entries) for entries in changes.values()) if changes else 0
+        
+        if failed:
+            self.version = None
+            return None
+        self.peers = peers
+        return changed
+    
+    def write_config(self, name, config):
+        path = os.path.join(self.config_dir, f'{name}.conf')
+        temp_path = f'{path}.tmp'
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(config)
+        os.replace(temp_path, path)
+    
+    def restart(self, name):
+        """Bring the interface up from the config file just written"""
+        path = os.path.join(self.config_dir, f'{name}.conf')
+        subprocess.run([Config.WG_QUICK_BINARY, 'down', path], stderr=subprocess.DEVNULL)
+        subprocess.run([Config.WG_QUICK_BINARY, 'up', path], check=True, capture_output=True)
+
+def run(agent, interval):
+    """Main agent loop"""
+    logger.info(f"Gateway agent started for {', '.join(sorted(agent.interface_names or ['all interfaces']))}")
+    
+    while True:
+        try:
+            with app.app_context():
+                agent.poll()
+        except Exception as e:
+            logger.error(f"Error following the change feed: {e}")
+            agent.version = None
+            time.sleep(max(interval, 5))
+        
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply the peer change feed to this gateway')
+    parser.add_argument('--interfaces', default=','.join(Config.GATEWAY_INTERFACES),
+                        help='comma separated interfaces served by this gateway (default: all)')
+    parser.add_argument('--config-dir', default=Config.WG_CONFIG_DIR, help='where interface configs are written')
+    parser.add_argument('--interval', type=float, default=Config.GATEWAY_POLL_INTERVAL, help='seconds between polls')
+    parser.add_argument('--once', action='store_true', help='catch up once and exit')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    agent = GatewayAgent([name for name in args.interfaces.split(',') if name], args.config_dir)
+    try:
+        if args.once:
+            with app.app_context():
+                agent.poll()
+        else:
+            run(agent, args.interval)
+    except KeyboardInterrupt:
+        logger.info("Gateway agent stopped by user")
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Gateway agent crashed: {e}")
+        sys.exit(1)
@@ -1,21 +1,18 @@
-from models import db, User, WireGuardConfig, Device
+from models import db, User, WireGuardConfig, Device, create_data_app
+from wireguard_manager import WireGuardManager
 from config import Config
-from flask import Flask
 import subprocess
 import os
 
 def init_database():
     """Initialize the database and create admin user"""
-    app = Flask(__name__)
-    app.config.from_object(Config)
-    
-    db.init_app(app)
+    app = create_data_app()
     
     with app.app_context():
         # Create all tables (including Device table)
         print("Creating database tables...")
         db.create_all()
-        print("✓ All tables created (User, WireGuardConfig, Device)")
+        print("✓ All tables created (User, WireGuardConfig, WireGuardInterface, Device)")
         
         # Check if admin exists
         admin = User.query.filter_by(username=Config.ADMIN_USERNAME).first()
@@ -36,7 +33,7 @@ def init_database():
         if not wg_config:
             # Generate server keys
             try:
-                wg_cmd = '/usr/bin/wg'
+                wg_cmd = Config.WG_BINARY
                 private_key = subprocess.check_output([wg_cmd, 'genkey']).decode().strip()
                 public_key = subprocess.check_output(
                     [wg_cmd, 'pubkey'], 
@@ -59,6 +56,11 @@ def init_database():
         
         db.session.commit()
         
+        # Register the primary interface so devices can be placed on it
+        if wg_config:
+            interface = WireGuardManager.ensure_primary_interface()
+            print(f"✓ Primary interface registered: {interface.name} ({interface.subnet})")
+        
         print("\n" + "="*60)
         print("DATABASE INITIALIZED SUCCESSFULLY!")
         print("="*60)
@@ -66,6 +68,7 @@ def init_database():
         print("   - User table: ✓")
         print("   - Device table: ✓")
         print("   - WireGuardConfig table: ✓")
+        print("   - WireGuardInterface table: ✓")
         print("\nYou can now:")
         print("   • Add users with max_connections limit")
         print("   • Users can manage multiple devices")
@@ -30,6 +30,10 @@ echo "Installing Python dependencies..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Build fingerprinted CSS/JS
+echo "Building static assets..."
+python assets.py
+
 echo ""
 echo "==================================="
 echo "Installation Complete!"
@@ -0,0 +1,141 @@
+"""
+Hot-path instrumentation
+Times WireGuardManager methods and route handlers, counts SQL queries and
+subprocesses per request, and captures opt-in cProfile runs for admins.
+The Flask-free timers and counters live in timing.py.
+"""
+import cProfile
+import io
+import itertools
+import pstats
+import time
+from collections import deque
+from datetime import datetime
+from flask import g, request
+from flask_login import current_user
+from config import Config
+from metrics import REGISTRY
+from timing import COUNT_BUCKETS, RequestCounters, current_counters, install_counters
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'wireguard_http_request_seconds', 'Route handler latency', ['endpoint'])
+HTTP_REQUEST_SQL_QUERIES = REGISTRY.histogram(
+    'wireguard_http_request_sql_queries', 'SQL queries executed per request', ['endpoint'], COUNT_BUCKETS)
+HTTP_REQUEST_SUBPROCESSES = REGISTRY.histogram(
+    'wireguard_http_request_subprocesses', 'Subprocesses started per request', ['endpoint'], COUNT_BUCKETS)
+
+
+# ==================== Profiling ====================
+
+_profiles = deque(maxlen=Config.PROFILE_HISTORY)
+_profile_ids = itertools.count(1)
+
+
+def get_profiles():
+    return list(reversed(_profiles))
+
+
+def get_profile(profile_id):
+    return next((p for p in _profiles if p['id'] == profile_id), None)
+
+
+def _wants_profile():
+    return (Config.PROFILING_ENABLED
+            and request.headers.get('X-Profile') == '1'
+            and current_user.is_authenticated
+            and current_user.is_admin)
+
+
+# ==================== Flask integration ====================
+
+def init_app(app):
+    """Time every route and count its SQL queries and subprocesses"""
+    install_counters()
+    
+    @app.before_request
+    def start_request_instrumentation():
+        g.instrumentation_started = time.perf_counter()
+        g.instrumentation_counters = RequestCounters()
+        g.instrumentation_token = current_counters.set(g.instrumentation_counters)
+        g.profiler = None
+        if _wants_profile():
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+    
+    @app.after_request
+    def record_request_instrumentation(response):
+        started = g.pop('instrumentation_started', None)
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        counters = g.instrumentation_counters
+        endpoint = request.endpoint or 'unknown'
+        
+        HTTP_REQUEST_SECONDS.observe(duration, endpoint=endpoint)
+        HTTP_REQUEST_SQL_QUERIES.observe(counters.sql_queries, endpoint=endpoint)
+        HTTP_REQUEST_SUBPROCESSES.observe(counters.subprocesses, endpoint=endpoint)
+        
+        response.headers['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, sql;desc="{counters.sql_queries} queries", '
+            f'proc;desc="{counters.subprocesses} subprocesses"'
+        )
+        
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+            profile_id = next(_profile_ids)
+            _profiles.append({
+                'id': profile_id,
+                'endpoint': endpoint,
+                'path': request.full_path,
+                'created_at': datetime.utcnow(),
+                'duration': duration,
+                'sql_queries': counters.sql_queries,
+                'subprocesses': counters.subprocesses,
+                'text': output.getvalue()
+            })
+            response.headers['X-Profile-Id'] = str(profile_id)
+        
+        return response
+    
+    @app.teardown_request
+    def reset_request_instrumentation(exc):
+        token = g.pop('instrumentation_token', None)
+        if token is not None:
+            current_counters.reset(token)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+
+# ==================== Diagnostics ====================
+
+def _quantile(buckets, counts, count, q):
+    """Upper bound of the bucket holding the q-th observation"""
+    if not count:
+        return None
+    target = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        if cumulative >= target:
+            return bound
+    return float('inf')
+
+
+def summarize(histogram):
+    """Rows of count/mean/p50/p95 per label set, slowest total first"""
+    rows = []
+    for key, (counts, total, count) in histogram.snapshot().items():
+        rows.append({
+            'labels': dict(key),
+            'count': count,
+            'total': total,
+            'mean': total / count if count else 0.0,
+            'p50': _quantile(histogram.buckets, counts, count, 0.5),
+            'p95': _quantile(histogram.buckets, counts, count, 0.95)
+        })
+    rows.sort(key=lambda r: r['total'], reverse=True)
+    return rows
@@ -0,0 +1,120 @@
+"""
+Public key / VPN IP lookup index for the REST API
+The connection monitor writes every device's key and IP with its owner to
+LOOKUP_INDEX_PATH once per cycle. Web workers keep the file in memory and
+reload it only when it changes, so bulk lookups never query the database.
+"""
+import json
+import os
+import threading
+import time
+from models import db, User, Device, WireGuardInterface
+
+FIELDS = ('device_id', 'device_name', 'user_id', 'username', 'public_key', 'ip_address', 'interface', 'is_active')
+
+_written = {}
+
+
+def build_index():
+    """Rows of FIELDS for every device, plus users with a legacy config"""
+    from wireguard_manager import WireGuardManager
+    primary = WireGuardManager.get_primary_interface().name
+    
+    rows = db.session.query(
+        Device.id, Device.device_name, Device.user_id, User.username, Device.wg_public_key,
+        Device.wg_ip_address, WireGuardInterface.name, Device.is_active & User.is_active
+    ).join(User, Device.user_id == User.id).outerjoin(WireGuardInterface, Device.interface_id == WireGuardInterface.id)
+    index = [[device_id, device_name, user_id, username, public_key, ip, interface or primary, bool(is_active)]
+             for device_id, device_name, user_id, username, public_key, ip, interface, is_active in rows]
+    
+    legacy = db.session.query(User.id, User.username, User.wg_public_key, User.wg_ip_address, User.is_active) \
+        .filter(User.wg_public_key.isnot(None))
+    index.extend([None, 'Legacy Config', user_id, username, public_key, ip, primary, bool(is_active)]
+                 for user_id, username, public_key, ip, is_active in legacy)
+    return index
+
+
+def write_index(path):
+    """Write the index atomically if it changed since the last write, returns True if written"""
+    rows = build_index()
+    body = json.dumps({'version': 1, 'fields': FIELDS, 'rows': rows}, separators=(',', ':'))
+    if _written.get(path) == body and os.path.exists(path):
+        # Touch so readers can tell the monitor is still refreshing it
+        os.utime(path)
+        return False
+    
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(body)
+    os.replace(temp_path, path)
+    _written[path] = body
+    return True
+
+
+class LookupIndex:
+    """In-memory public key and IP maps, reloaded when the index file changes
+
+    If the file is missing or hasn't been refreshed for max_age seconds
+    (monitor not running), the index is built from the database instead
+    and reused for max_age seconds.
+    """
+    
+    def __init__(self, path, max_age):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.by_key = {}
+        self.by_ip = {}
+        self.loaded_at = 0.0
+        self.source = None
+        self._file_id = None
+    
+    def _set_rows(self, rows):
+        by_key, by_ip = {}, {}
+        for row in rows:
+            entry = dict(zip(FIELDS, row))
+            by_key[entry['public_key']] = entry
+            if entry['ip_address']:
+                by_ip[entry['ip_address']] = entry
+        self.by_key, self.by_ip = by_key, by_ip
+    
+    def refresh(self):
+        now = time.time()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+        
+        with self.lock:
+            if stat is not None and now - stat.st_mtime < self.max_age:
+                # Every write replaces the file, unchanged cycles only touch it
+                file_id = (stat.st_ino, stat.st_size)
+                if file_id != self._file_id:
+                    try:
+                        with open(self.path) as f:
+                            data = json.load(f)
+                    except (OSError, ValueError):
+                        data = None  # Replaced while reading, keep what we have
+                    if data is not None:
+                        self._set_rows(data['rows'])
+                        self._file_id = file_id
+                        self.loaded_at = now
+                        self.source = 'file'
+                return
+            
+            # No fresh file: fall back to the database, at most once per max_age
+            if self.source != 'database' or now - self.loaded_at >= self.max_age:
+                self._set_rows(build_index())
+                self._file_id = None
+                self.loaded_at = now
+                self.source = 'database'
+    
+    def lookup(self, public_keys=(), ips=()):
+        """Resolve keys and IPs, unknown ones map to None"""
+        self.refresh()
+        by_key, by_ip = self.by_key, self.by_ip
+        return (
+            {key: by_key.get(key) for key in public_keys},
+            {ip: by_ip.get(ip.split('/')[0]) for ip in ips}
+        )
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Manage per-device access control (ACL_ENABLED=true)
+Allow rules belong to a user or to a group of users. Devices of a user with
+rules may only reach those destinations; users without any rule get
+ACL_DEFAULT. Changes are pushed to nftables as set element updates.
+
+    python manage_acl.py group-add engineering
+    python manage_acl.py member-add engineering alice
+    python manage_acl.py rule-add 10.20.0.0/16 --group engineering
+    python manage_acl.py rule-add 10.30.0.5 --user bob
+    python manage_acl.py render            # full ruleset, nothing applied
+    python manage_acl.py sync --dry-run    # element changes that sync would apply
+"""
+import argparse
+import sys
+from models import db, User, AccessGroup, AccessRule, create_data_app
+from config import Config
+import acl
+
+def find_group(name):
+    group = AccessGroup.query.filter_by(name=name).first()
+    if not group:
+        raise SystemExit(f"Group '{name}' not found")
+    return group
+
+def find_user(username):
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise SystemExit(f"User '{username}' not found")
+    return user
+
+def push_changes():
+    """Apply the changed set elements if ACLs are enabled"""
+    if not Config.ACL_ENABLED:
+        print("  ACL_ENABLED is false, nothing applied")
+        return
+    script = acl.sync()
+    print(f"✓ Applied {script.count(chr(10))} nft statement(s)" if script else "✓ nftables already in sync")
+
+def list_acl():
+    print("Groups:")
+    for group in AccessGroup.query.order_by(AccessGroup.name).all():
+        members = ', '.join(sorted(u.username for u in group.users)) or '-'
+        print(f"  {group.name:<20} {members}")
+    print("Rules:")
+    print(f"  {'ID':<5} {'Owner':<26} {'Destination':<20} Comment")
+    for rule in AccessRule.query.order_by(AccessRule.id).all():
+        owner = f'group {rule.group.name}' if rule.group else f'user {rule.user.username}'
+        print(f"  {rule.id:<5} {owner:<26} {rule.destination:<20} {rule.comment or ''}")
+
+def add_group(args):
+    if AccessGroup.query.filter_by(name=args.name).first():
+        raise SystemExit(f"Group '{args.name}' already exists")
+    db.session.add(AccessGroup(name=args.name, description=args.description))
+    db.session.commit()
+    print(f"✓ Group {args.name} created")
+
+def delete_group(args):
+    db.session.delete(find_group(args.name))
+    db.session.commit()
+    print(f"✓ Group {args.name} deleted")
+    push_changes()
+
+def change_member(args):
+    group = find_group(args.group)
+    user = find_user(args.username)
+    if args.command == 'member-add' and user not in group.users:
+        group.users.append(user)
+    elif args.command == 'member-remove' and user in group.users:
+        group.users.remove(user)
+    db.session.commit()
+    print(f"✓ {group.name}: {', '.join(sorted(u.username for u in group.users)) or 'no members'}")
+    push_changes()
+
+def add_rule(args):
+    try:
+        destination = acl.normalize_destination(args.destination)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    rule = AccessRule(destination=destination, comment=args.comment)
+    if args.group:
+        rule.group = find_group(args.group)
+    else:
+        rule.user = find_user(args.user)
+    db.session.add(rule)
+    db.session.commit()
+    print(f"✓ Rule {rule.id} allows {destination}")
+    push_changes()
+
+def delete_rule(args):
+    rule = AccessRule.query.get(args.id)
+    if not rule:
+        raise SystemExit(f"Rule {args.id} not found")
+    db.session.delete(rule)
+    db.session.commit()
+    print(f"✓ Rule {args.id} deleted")
+    push_changes()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    subparsers.add_parser('list', help='List groups and rules')
+    
+    group_add = subparsers.add_parser('group-add', help='Create a group')
+    group_add.add_argument('name')
+    group_add.add_argument('--description')
+    group_delete = subparsers.add_parser('group-delete', help='Delete a group and its rules')
+    group_delete.add_argument('name')
+    
+    for command in ('member-add', 'member-remove'):
+        member = subparsers.add_parser(command, help=f"{command.split('-')[1].capitalize()} a group member")
+        member.add_argument('group')
+        member.add_argument('username')
+    
+    rule_add = subparsers.add_parser('rule-add', help='Allow a destination network')
+    rule_add.add_argument('destination', help='IPv4 address or network, e.g. 10.20.0.0/16')
+    owner = rule_add.add_mutually_exclusive_group(required=True)
+    owner.add_argument('--user')
+    owner.add_argument('--group')
+    rule_add.add_argument('--comment')
+    rule_delete = subparsers.add_parser('rule-delete', help='Delete a rule')
+    rule_delete.add_argument('id', type=int)
+    
+    subparsers.add_parser('render', help='Print the full nftables ruleset')
+    apply_parser = subparsers.add_parser('apply', help='Recreate the nftables table from the database')
+    apply_parser.add_argument('--dry-run', action='store_true', help='Print the script instead of applying it')
+    sync_parser = subparsers.add_parser('sync', help='Apply only the set elements that changed')
+    sync_parser.add_argument('--dry-run', action='store_true', help='Print the script instead of applying it')
+    
+    args = parser.parse_args()
+    
+    with create_data_app().app_context():
+        if args.command == 'list':
+            list_acl()
+        elif args.command == 'group-add':
+            add_group(args)
+        elif args.command == 'group-delete':
+            delete_group(args)
+        elif args.command in ('member-add', 'member-remove'):
+            change_member(args)
+        elif args.command == 'rule-add':
+            add_rule(args)
+        elif args.command == 'rule-delete':
+            delete_rule(args)
+        elif args.command == 'render':
+            sys.stdout.write(acl.render_full())
+        elif args.command == 'apply':
+            sys.stdout.write(acl.apply_ruleset(dry_run=args.dry_run))
+        elif args.command == 'sync':
+            sys.stdout.write(acl.sync(dry_run=args.dry_run) or '# nftables already in sync\n')
+
+if __name__ == '__main__':
+    main()
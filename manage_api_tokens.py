@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Manage REST API tokens
+Tokens give read-only access to /api/v1 with 'Authorization: Bearer <token>'.
+A token is shown once when it is created; only its hash is stored.
+"""
+import argparse
+from app import app
+from models import db, ApiToken
+
+def list_tokens():
+    print(f"{'ID':<5} {'Name':<20} {'Active':<7} {'Created':<20} Last Used")
+    for token in ApiToken.query.order_by(ApiToken.id).all():
+        created = token.created_at.strftime('%Y-%m-%d %H:%M') if token.created_at else '-'
+        last_used = token.last_used_at.strftime('%Y-%m-%d %H:%M') if token.last_used_at else 'never'
+        print(f"{token.id:<5} {token.name:<20} {'yes' if token.is_active else 'no':<7} {created:<20} {last_used}")
+
+def create_token(args):
+    token, plaintext = ApiToken.generate()
+    token.name = args.name
+    db.session.add(token)
+    db.session.commit()
+    print(f"✓ Token {token.id} ({token.name}) created:")
+    print(f"  {plaintext}")
+    print("  Store it now, it cannot be shown again.")
+
+def revoke_token(args):
+    token = ApiToken.query.get(args.id)
+    if not token:
+        raise SystemExit(f"Token {args.id} not found")
+    token.is_active = False
+    db.session.commit()
+    print(f"✓ Token {token.id} ({token.name}) revoked")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    subparsers.add_parser('list', help='List API tokens')
+    
+    create = subparsers.add_parser('create', help='Create a new token')
+    create.add_argument('name', help='What the token is for, e.g. nac')
+    
+    revoke = subparsers.add_parser('revoke', help='Revoke a token')
+    revoke.add_argument('id', type=int)
+    
+    args = parser.parse_args()
+    
+    with app.app_context():
+        if args.command == 'list':
+            list_tokens()
+        elif args.command == 'create':
+            create_token(args)
+        elif args.command == 'revoke':
+            revoke_token(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Manage WireGuard interfaces
+Each interface has its own keys, subnet and listen port; new devices are
+spread across active interfaces according to WG_PLACEMENT
+"""
+import argparse
+from app import app
+from models import db
+from wireguard_manager import WireGuardManager
+
+def list_interfaces():
+    loads = WireGuardManager.get_interface_loads()
+    print(f"{'Name':<10} {'Subnet':<18} {'Port':<6} {'Devices':<8} {'Free':<8} Public Key")
+    for interface in WireGuardManager.get_interfaces():
+        print(f"{interface.name:<10} {interface.subnet:<18} {interface.listen_port:<6} "
+              f"{loads.get(interface.id, 0):<8} {WireGuardManager.get_interface_capacity(interface):<8} "
+              f"{interface.server_public_key}")
+
+def add_interface(args):
+    interface = WireGuardManager.create_interface(
+        args.name, args.subnet, args.port,
+        address=args.address, public_endpoint=args.endpoint
+    )
+    print(f"✓ Interface {interface.name} created ({interface.subnet}, port {interface.listen_port})")
+    print(f"  Server public key: {interface.server_public_key}")
+    
+    if args.apply:
+        WireGuardManager.apply_server_config_with_devices([interface], ruleset=True)
+        print(f"✓ {interface.name} is up")
+
+def disable_interface(args):
+    interface = next((i for i in WireGuardManager.get_interfaces() if i.name == args.name), None)
+    if not interface:
+        raise SystemExit(f"Interface '{args.name}' not found")
+    if interface.id == WireGuardManager.get_primary_interface().id:
+        raise SystemExit("The primary interface cannot be disabled")
+    if interface.devices:
+        raise SystemExit(f"Interface '{args.name}' still has {len(interface.devices)} device(s)")
+    
+    interface.is_active = False
+    db.session.commit()
+    print(f"✓ Interface {interface.name} disabled")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    subparsers.add_parser('list', help='List active interfaces')
+    
+    add = subparsers.add_parser('add', help='Create a new interface')
+    add.add_argument('name', help='Interface name, e.g. wg1')
+    add.add_argument('subnet', help='Client subnet, e.g. 10.9.0.0/24')
+    add.add_argument('port', type=int, help='UDP listen port')
+    add.add_argument('--address', help='Server address inside the subnet (default: first host)')
+    add.add_argument('--endpoint', help='Public host clients connect to (default: WG_SERVER_PUBLIC_IP)')
+    add.add_argument('--apply', action='store_true', help='Write the config and bring the interface up')
+    
+    disable = subparsers.add_parser('disable', help='Stop placing devices on an empty interface')
+    disable.add_argument('name')
+    
+    args = parser.parse_args()
+    
+    with app.app_context():
+        if args.command == 'list':
+            list_interfaces()
+        elif args.command == 'add':
+            add_interface(args)
+        elif args.command == 'disable':
+            disable_interface(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Prometheus metrics
+Minimal in-process registry rendered in the Prometheus text exposition
+format, plus a small HTTP exporter the monitor runs next to its loop
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def format_sample(name, labels, value):
+    return f'{name}{format_labels(labels)} {value}'
+
+
+class Metric:
+    """Base class for labelled metrics"""
+    
+    kind = 'untyped'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+    
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+    
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+    
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [format_sample(self.name, key, value) for key, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts, sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+    
+    def snapshot(self):
+        """Copy of {labels: (bucket counts, sum, count)}"""
+        with self._lock:
+            return {key: (list(state[0]), state[1], state[2]) for key, state in self._values.items()}
+    
+    def collect(self):
+        lines = self.header()
+        for key, (counts, total, count) in self.snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(format_sample(f'{self.name}_bucket', key + (('le', repr(bound)),), cumulative))
+            lines.append(format_sample(f'{self.name}_bucket', key + (('le', '+Inf'),), count))
+            lines.append(format_sample(f'{self.name}_sum', key, total))
+            lines.append(format_sample(f'{self.name}_count', key, count))
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        self.histogram.observe(self.duration, **self.labels)
+        return False
+
+
+class Registry:
+    """Holds metrics and renders them in registration order"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            # Module reloads re-register the same name; keep the first instance
+            return self._metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# App internals, observed in whichever process does the work
+DUMP_PARSE_SECONDS = REGISTRY.histogram(
+    'wireguard_dump_parse_seconds', 'Time spent parsing wg dump output', ['source'])
+DB_UPDATE_SECONDS = REGISTRY.histogram(
+    'wireguard_db_update_seconds', 'Time spent writing connection status to the database')
+CONFIG_APPLY_SECONDS = REGISTRY.histogram(
+    'wireguard_config_apply_seconds', 'Time spent rendering and applying server configs')
+QR_RENDER_SECONDS = REGISTRY.histogram(
+    'wireguard_qr_render_seconds', 'Time spent rendering QR codes')
+RATE_LIMITED_TOTAL = REGISTRY.counter(
+    'wireguard_rate_limited_requests_total', 'Requests rejected by the rate limiter', ['endpoint'])
+RATE_LIMIT_ERRORS_TOTAL = REGISTRY.counter(
+    'wireguard_rate_limit_errors_total', 'Rate limiter store failures (requests were let through)')
+FRAGMENT_CACHE_TOTAL = REGISTRY.counter(
+    'wireguard_fragment_cache_requests_total', 'Cached template fragment lookups', ['fragment', 'result'])
+
+
+def render_peer_metrics(snapshot, peer_index):
+    """Render per-peer and per-user metrics from a collector Snapshot
+
+    peer_index maps public key -> (username, device name). Works purely on
+    in-memory data so a scrape never forks 'wg'.
+    """
+    if snapshot is None:
+        return ''
+    
+    rx = ['# HELP wireguard_peer_receive_bytes_total Bytes received from the peer',
+          '# TYPE wireguard_peer_receive_bytes_total counter']
+    tx = ['# HELP wireguard_peer_transmit_bytes_total Bytes sent to the peer',
+          '# TYPE wireguard_peer_transmit_bytes_total counter']
+    age = ['# HELP wireguard_peer_last_handshake_age_seconds Seconds since the last handshake',
+           '# TYPE wireguard_peer_last_handshake_age_seconds gauge']
+    online = ['# HELP wireguard_peer_online Whether the peer had a handshake in the last 3 minutes',
+              '# TYPE wireguard_peer_online gauge']
+    user_devices = {}
+    
+    for sample in snapshot.peers.values():
+        username, device_name = peer_index.get(sample.public_key, ('', ''))
+        labels = (('interface', sample.source), ('public_key', sample.public_key),
+                  ('user', username), ('device', device_name))
+        is_online = snapshot.is_online(sample)
+        
+        rx.append(format_sample('wireguard_peer_receive_bytes_total', labels, sample.rx_bytes))
+        tx.append(format_sample('wireguard_peer_transmit_bytes_total', labels, sample.tx_bytes))
+        if sample.latest_handshake is not None:
+            age.append(format_sample('wireguard_peer_last_handshake_age_seconds', labels,
+                                     round(snapshot.taken_at - sample.latest_handshake, 3)))
+        online.append(format_sample('wireguard_peer_online', labels, int(is_online)))
+        
+        if username:
+            user_devices[username] = user_devices.get(username, 0) + int(is_online)
+    
+    users = ['# HELP wireguard_user_connected_devices Connected devices per user',
+             '# TYPE wireguard_user_connected_devices gauge']
+    users.extend(format_sample('wireguard_user_connected_devices', (('user', name),), count)
+                 for name, count in sorted(user_devices.items()))
+    
+    sources = ['# HELP wireguard_collector_source_up Whether the last collection from the source succeeded',
+               '# TYPE wireguard_collector_source_up gauge']
+    durations = ['# HELP wireguard_collector_source_seconds Duration of the last collection from the source',
+                 '# TYPE wireguard_collector_source_seconds gauge']
+    for source in snapshot.sources:
+        sources.append(format_sample('wireguard_collector_source_up', (('source', source.name),), int(not source.error)))
+        durations.append(format_sample('wireguard_collector_source_seconds', (('source', source.name),),
+                                       round(source.duration, 6)))
+    
+    return '\n'.join(rx + tx + age + online + users + sources + durations) + '\n'
+
+
+class MetricsExporter:
+    """Serves /metrics from a render callback on a background thread"""
+    
+    def __init__(self, render, host='0.0.0.0', port=9586):
+        self.render = render
+        self.host = host
+        self.port = port
+        self._server = None
+    
+    def start(self):
+        render = self.render
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the monitor log
+                pass
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-exporter', daemon=True)
+        thread.start()
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
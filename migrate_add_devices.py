@@ -40,7 +40,7 @@ def migrate():
         print("\nUpdating WireGuard server configuration...")
         
         try:
-            WireGuardManager.apply_server_config_with_devices()
+            WireGuardManager.apply_server_config_with_devices(ruleset=True)
             print("Server configuration updated successfully!")
         except Exception as e:
             print(f"Warning: Could not update server config: {e}")
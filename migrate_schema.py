@@ -0,0 +1,119 @@
+"""
+Migration script to bring an existing database up to the current models
+Creates missing tables, adds missing columns, stops device ids from being
+reused and places devices on interfaces
+"""
+from sqlalchemy import inspect, text
+from app import app
+from models import db, Device, EndpointEvent
+from wireguard_manager import WireGuardManager
+import session_log
+
+def add_missing_columns():
+    """Add columns defined on the models but missing from existing tables"""
+    inspector = inspect(db.engine)
+    added = []
+    
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            
+            # Only scalar defaults can be expressed in DDL
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if isinstance(default, bool):
+                ddl += f' DEFAULT {int(default)}'
+            elif isinstance(default, (int, float)):
+                ddl += f' DEFAULT {default}'
+            elif isinstance(default, str):
+                ddl += " DEFAULT '{}'".format(default.replace("'", "''"))
+            
+            with db.engine.begin() as connection:
+                connection.execute(text(ddl))
+            added.append(f'{table.name}.{column.name}')
+    
+    return added
+
+def enable_autoincrement(model, history_ids=()):
+    """Rebuild an SQLite table with AUTOINCREMENT so ids of deleted rows are never handed out again
+
+    history_ids are (table, column) pairs that may still hold ids of deleted
+    rows; new ids start past all of them. Returns True if the table was rebuilt.
+    """
+    table = model.__table__
+    if db.engine.url.get_backend_name() != 'sqlite':
+        return False
+    with db.engine.begin() as connection:
+        sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                 {'name': table.name}).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return False
+        inspector = inspect(connection)
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        columns = ', '.join(column.name for column in table.columns if column.name in existing)
+        
+        # Legacy mode leaves references to the old name in other tables alone
+        connection.execute(text('PRAGMA legacy_alter_table = ON'))
+        connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+        connection.execute(text('PRAGMA legacy_alter_table = OFF'))
+        for index in inspector.get_indexes(f'{table.name}_old'):
+            connection.execute(text(f'DROP INDEX {index["name"]}'))
+        table.create(connection)
+        connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old'))
+        connection.execute(text(f'DROP TABLE {table.name}_old'))
+        
+        last_id = connection.execute(text(f'SELECT MAX(id) FROM {table.name}')).scalar() or 0
+        for history_table, column in history_ids:
+            if inspector.has_table(history_table):
+                last_id = max(last_id, connection.execute(
+                    text(f'SELECT MAX({column}) FROM {history_table}')).scalar() or 0)
+        connection.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+        connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                           {'name': table.name, 'seq': last_id})
+    return True
+
+def device_history_ids():
+    """Tables keeping device ids after the device is deleted"""
+    return [(EndpointEvent.__tablename__, 'device_id')] + \
+        [(name, 'device_id') for name in session_log.list_partitions()]
+
+def migrate():
+    with app.app_context():
+        print("Creating missing tables...")
+        db.create_all()
+        
+        print("\nAdding missing columns...")
+        added = add_missing_columns()
+        for name in added:
+            print(f"  Added column {name}")
+        if not added:
+            print("  Schema already up to date")
+        
+        if enable_autoincrement(Device, device_history_ids()):
+            print("  Device ids are no longer reused")
+        
+        print("\nPlacing existing devices on the primary interface...")
+        try:
+            primary = WireGuardManager.ensure_primary_interface()
+        except Exception as e:
+            print(f"Warning: Could not create primary interface: {e}")
+            print("Run 'python init_db.py' first")
+            return
+        
+        count = Device.query.filter(Device.interface_id.is_(None)).update(
+            {Device.interface_id: primary.id}, synchronize_session=False
+        )
+        db.session.commit()
+        print(f"  {count} device(s) placed on {primary.name}")
+        
+        print("\nMigration completed!")
+
+if __name__ == '__main__':
+    migrate()
@@ -1,11 +1,51 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import hashlib
+import secrets
 
 db = SQLAlchemy()
 
-class User(UserMixin, db.Model):
+
+def create_data_app(config=None):
+    """Flask app with only the database configured, for background services
+    
+    No routes, login manager or templates are loaded, which keeps the
+    monitor and other daemons small. Relative SQLite paths resolve to the
+    same instance folder as the web app's.
+    """
+    from flask import Flask
+    from config import Config
+    app = Flask(__name__)
+    app.config.from_object(config or Config)
+    db.init_app(app)
+    return app
+
+class LoginMixin:
+    """What flask_login.UserMixin provides, so data-only processes never import flask_login"""
+    __hash__ = object.__hash__
+    
+    @property
+    def is_authenticated(self):
+        return self.is_active
+    
+    @property
+    def is_anonymous(self):
+        return False
+    
+    def get_id(self):
+        return str(self.id)
+    
+    def __eq__(self, other):
+        if isinstance(other, LoginMixin):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+    
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+class User(LoginMixin, db.Model):
     __tablename__ = 'users'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -15,6 +55,7 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Any write, keys cached fragments
     
     # WireGuard specific fields (legacy - kept for backward compatibility)
     wg_public_key = db.Column(db.String(255))
@@ -24,6 +65,15 @@ class User(UserMixin, db.Model):
     wg_allowed_ips = db.Column(db.String(255), default='0.0.0.0/0')
     max_connections = db.Column(db.Integer, default=1)  # Maximum simultaneous connections allowed
     
+    # Traffic quotas in bytes (None = unlimited) and usage in the current day/month
+    quota_daily_bytes = db.Column(db.BigInteger, nullable=True)
+    quota_monthly_bytes = db.Column(db.BigInteger, nullable=True)
+    usage_day = db.Column(db.String(10))  # YYYY-MM-DD usage_day_bytes belongs to
+    usage_day_bytes = db.Column(db.BigInteger, default=0)
+    usage_month = db.Column(db.String(7))  # YYYY-MM usage_month_bytes belongs to
+    usage_month_bytes = db.Column(db.BigInteger, default=0)
+    is_over_quota = db.Column(db.Boolean, default=False)  # Peers removed from the live interface
+    
     # Relationship to devices
     devices = db.relationship('Device', backref='user', lazy=True, cascade='all, delete-orphan')
     
@@ -33,6 +83,13 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def get_usage(self, now=None):
+        """(bytes today, bytes this month), treating usage from past periods as zero"""
+        now = now or datetime.now()
+        day = (self.usage_day_bytes or 0) if self.usage_day == now.strftime('%Y-%m-%d') else 0
+        month = (self.usage_month_bytes or 0) if self.usage_month == now.strftime('%Y-%m') else 0
+        return day, month
+    
     def __repr__(self):
         return f'<User {self.username}>'
 
@@ -49,11 +106,34 @@ class WireGuardConfig(db.Model):
         return f'<WireGuardConfig>'
 
 
+class WireGuardInterface(db.Model):
+    __tablename__ = 'wireguard_interfaces'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(15), unique=True, nullable=False)  # e.g., wg0
+    server_private_key = db.Column(db.String(255), nullable=False)
+    server_public_key = db.Column(db.String(255), nullable=False)
+    address = db.Column(db.String(45), nullable=False)  # Server address inside the subnet, e.g., 10.8.0.1
+    subnet = db.Column(db.String(49), nullable=False)  # e.g., 10.8.0.0/24
+    listen_port = db.Column(db.Integer, nullable=False)
+    public_endpoint = db.Column(db.String(255))  # Host clients connect to, defaults to WG_SERVER_PUBLIC_IP
+    last_ip_assigned = db.Column(db.Integer, default=1)  # Last host offset assigned within the subnet
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    devices = db.relationship('Device', backref='interface', lazy=True)
+    
+    def __repr__(self):
+        return f'<WireGuardInterface {self.name}>'
+
+
 class Device(db.Model):
     __tablename__ = 'devices'
+    __table_args__ = {'sqlite_autoincrement': True}  # Ids are never reused, history tables keep them
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    interface_id = db.Column(db.Integer, db.ForeignKey('wireguard_interfaces.id'), nullable=True)  # None = default interface
     device_name = db.Column(db.String(100), nullable=False)  # e.g., "iPhone", "Laptop"
     wg_public_key = db.Column(db.String(255), unique=True, nullable=False)
     wg_private_key = db.Column(db.String(255), nullable=False)
@@ -63,9 +143,142 @@ class Device(db.Model):
     
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Any write, keys cached fragments
     last_handshake = db.Column(db.DateTime, nullable=True)  # Last successful connection
     is_connected = db.Column(db.Boolean, default=False)  # Currently connected
+    is_parked = db.Column(db.Boolean, default=False)  # Idle: left out of the live interface, still active
+    parked_at = db.Column(db.DateTime, nullable=True)
+    unparked_at = db.Column(db.DateTime, nullable=True)  # Last re-activation, restarts the idle clock
+    
+    # Key rotation: new keys are staged as pending and served to the client
+    # before the server switches over to them
+    keys_rotated_at = db.Column(db.DateTime, nullable=True)  # None = keys from created_at
+    pending_private_key = db.Column(db.String(255))
+    pending_public_key = db.Column(db.String(255))
+    pending_preshared_key = db.Column(db.String(255))
+    rotation_started_at = db.Column(db.DateTime, nullable=True)
+    rotation_fetched_at = db.Column(db.DateTime, nullable=True)  # Client downloaded the pending config
     
     def __repr__(self):
         return f'<Device {self.device_name} - {self.user.username}>'
 
+
+# Many-to-many: users and the access groups whose rules apply to them
+user_access_groups = db.Table(
+    'user_access_groups',
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('group_id', db.Integer, db.ForeignKey('access_groups.id'), primary_key=True)
+)
+
+
+class AccessGroup(db.Model):
+    __tablename__ = 'access_groups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)  # e.g., "engineering"
+    description = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    users = db.relationship('User', secondary=user_access_groups, lazy=True,
+                            backref=db.backref('access_groups', lazy=True))
+    rules = db.relationship('AccessRule', backref='group', lazy=True, cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<AccessGroup {self.name}>'
+
+
+class AccessRule(db.Model):
+    """One allowed destination for a user's or a group's devices
+    
+    Devices of users with no rule at all fall back to ACL_DEFAULT.
+    """
+    __tablename__ = 'access_rules'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)  # Either a user
+    group_id = db.Column(db.Integer, db.ForeignKey('access_groups.id'), nullable=True, index=True)  # or a group
+    destination = db.Column(db.String(49), nullable=False)  # IPv4 network, e.g., 10.20.0.0/16
+    comment = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref=db.backref('access_rules', lazy=True, cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<AccessRule {self.destination}>'
+
+
+class EndpointEvent(db.Model):
+    __tablename__ = 'endpoint_events'
+    __table_args__ = (
+        db.Index('ix_endpoint_events_device_seen', 'device_id', 'seen_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, nullable=False)  # No FK: history outlives deleted devices
+    ip = db.Column(db.String(45), nullable=False)  # New endpoint
+    port = db.Column(db.Integer)
+    previous_ip = db.Column(db.String(45))
+    previous_port = db.Column(db.Integer)
+    seen_at = db.Column(db.DateTime, nullable=False, index=True)
+    is_flapping = db.Column(db.Boolean, default=False)  # Part of a burst of changes across IPs
+    
+    def __repr__(self):
+        return f'<EndpointEvent {self.device_id} {self.previous_ip} -> {self.ip}>'
+
+
+class ApiToken(db.Model):
+    """Read-only REST API credential; only a hash of the token is stored"""
+    __tablename__ = 'api_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)  # e.g., "nac", "siem"
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=True)
+    is_active = db.Column(db.Boolean, default=True)
+    
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    @staticmethod
+    def generate():
+        """Create a new token, returns (ApiToken, plaintext token shown once)"""
+        token = 'wgt_' + secrets.token_urlsafe(32)
+        return ApiToken(token_hash=ApiToken.hash_token(token)), token
+    
+    def __repr__(self):
+        return f'<ApiToken {self.name}>'
+
+
+class PeerChange(db.Model):
+    """One versioned peer change, consumed by gateway agents in version order"""
+    __tablename__ = 'peer_changes'
+    __table_args__ = {'sqlite_autoincrement': True}  # Versions are never reused after pruning
+    
+    version = db.Column(db.Integer, primary_key=True)
+    interface = db.Column(db.String(15), nullable=False)
+    public_key = db.Column(db.String(44), nullable=False)
+    action = db.Column(db.String(6), nullable=False)  # 'set' or 'remove'
+    comment = db.Column(db.String(200))
+    preshared_key = db.Column(db.String(44))
+    allowed_ips = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<PeerChange {self.version} {self.action} {self.interface}>'
+
+
+class PeerState(db.Model):
+    """Peers as of the latest change feed version, the snapshot lagging agents catch up from"""
+    __tablename__ = 'peer_state'
+    
+    interface = db.Column(db.String(15), primary_key=True)
+    public_key = db.Column(db.String(44), primary_key=True)
+    comment = db.Column(db.String(200))
+    preshared_key = db.Column(db.String(44))
+    allowed_ips = db.Column(db.String(64))
+    
+    def __repr__(self):
+        return f'<PeerState {self.interface} {self.public_key}>'
@@ -0,0 +1,210 @@
+"""
+Peer snapshot shared between the connection monitor and web workers
+The monitor publishes every parsed cycle into a memory-mapped file with a
+fixed binary layout; web workers map the same file and read it without
+running 'wg' or touching the database.
+
+Layout (little endian):
+    header   magic, layout version, sequence, taken_at, peer count, source count
+    sources  MAX_SOURCES x (name, peer count, duration, failed)
+    peers    capacity x (public key, source, allowed ips, endpoint, handshake, rx, tx, flags)
+
+The sequence works as a seqlock: the writer makes it odd before changing
+anything, header fields included, and stores the even sequence last. A
+reader that sees an odd sequence, or a different one after reading,
+retries. When the file has to grow it is replaced as a whole and readers
+remap it. Allowed IPs or endpoints too long for their field are written
+empty with a flag set, and read back as None rather than cut off.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from collector import PeerSample, SourceResult, Snapshot
+
+MAGIC = b'WGPS'
+LAYOUT_VERSION = 2
+HEADER = struct.Struct('<4sIQdII')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+SOURCE = struct.Struct('<32sIdB7x')
+RECORD = struct.Struct('<44s32s64s48sqQQB7x')
+MAX_SOURCES = 64
+RECORDS_OFFSET = HEADER.size + MAX_SOURCES * SOURCE.size
+MIN_CAPACITY = 1024
+ALLOWED_IPS_OVERFLOW = 1
+ENDPOINT_OVERFLOW = 2
+
+_readers = {}
+
+
+def _text(value):
+    return value.rstrip(b'\0').decode('ascii', 'replace')
+
+
+def _field(value, size, flag):
+    """(bytes, flag) for a fixed-width field, empty with the flag set if value doesn't fit"""
+    data = value.encode()
+    return (b'', flag) if len(data) > size else (data, 0)
+
+
+class SnapshotWriter:
+    """Publishes PeerTable cycles; only one writer (the monitor) per file"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.sequence = 0
+        self.overflowed = 0  # Peers with a flagged field in the last publish
+        self._file = None
+        self._map = None
+        self.capacity = 0
+    
+    def _create(self, capacity):
+        """Replace the file with an empty one of the given capacity"""
+        self.close()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.truncate(RECORDS_OFFSET + capacity * RECORD.size)
+            f.write(HEADER.pack(MAGIC, LAYOUT_VERSION, self.sequence, 0.0, 0, 0))
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.capacity = capacity
+    
+    def publish(self, table):
+        """Write the table's peers and sources as one consistent snapshot"""
+        records = list(table.peers.values())
+        sources = table.sources[:MAX_SOURCES]
+        if self._map is None or len(records) > self.capacity:
+            self._create(max(MIN_CAPACITY, int(len(records) * 1.25)))
+        
+        peer_data = bytearray(len(records) * RECORD.size)
+        pack = RECORD.pack_into
+        overflowed = 0
+        for index, record in enumerate(records):
+            allowed_ips, allowed_ips_flag = _field(record.allowed_ips, 64, ALLOWED_IPS_OVERFLOW)
+            endpoint, endpoint_flag = _field(record.endpoint or '', 48, ENDPOINT_OVERFLOW)
+            flags = allowed_ips_flag | endpoint_flag
+            overflowed += bool(flags)
+            pack(peer_data, index * RECORD.size,
+                 record.public_key.encode(), record.source.encode()[:32], allowed_ips, endpoint,
+                 record.latest_handshake or 0, record.rx_bytes, record.tx_bytes, flags)
+        self.overflowed = overflowed
+        source_data = b''.join(
+            SOURCE.pack(source.name.encode()[:32], source.peer_count or 0, source.duration, bool(source.error))
+            for source in sources
+        )
+        
+        mapped = self._map
+        self.sequence += 1  # Odd: readers back off
+        SEQUENCE.pack_into(mapped, SEQUENCE_OFFSET, self.sequence)
+        mapped[HEADER.size:HEADER.size + len(source_data)] = source_data
+        mapped[RECORDS_OFFSET:RECORDS_OFFSET + len(peer_data)] = peer_data
+        mapped[:HEADER.size] = HEADER.pack(MAGIC, LAYOUT_VERSION, self.sequence, table.taken_at,
+                                           len(records), len(sources))
+        self.sequence += 1  # Even, stored last: the header above is complete
+        SEQUENCE.pack_into(mapped, SEQUENCE_OFFSET, self.sequence)
+        return len(records)
+    
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+
+class SnapshotReader:
+    """Maps the published file and turns it into a collector.Snapshot
+
+    The parsed snapshot is cached per sequence number, so repeated reads
+    between two monitor cycles cost one stat() and one 8 byte compare.
+    """
+    
+    def __init__(self, path, retries=100):
+        self.path = path
+        self.retries = retries
+        self.lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._inode = None
+        self._cached = (None, None)  # (sequence, Snapshot)
+    
+    def _remap(self):
+        """(Re)open the file if it was created or replaced, returns False if it doesn't exist"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return False
+        if inode == self._inode:
+            return True
+        self.close()
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._inode = inode
+        self._cached = (None, None)
+        return True
+    
+    def read(self, max_age=None):
+        """Latest consistent Snapshot, or None if there is none or it is older than max_age seconds"""
+        with self.lock:
+            snapshot = self._read()
+        if snapshot is None or (max_age is not None and time.time() - snapshot.taken_at > max_age):
+            return None
+        return snapshot
+    
+    def _read(self):
+        if not self._remap() or len(self._map) < RECORDS_OFFSET:
+            return None
+        mapped = self._map
+        
+        for _ in range(self.retries):
+            magic, layout, sequence, taken_at, peer_count, source_count = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or layout != LAYOUT_VERSION:
+                return None
+            if sequence & 1:
+                time.sleep(0.001)  # Writer in progress
+                continue
+            if sequence == self._cached[0]:
+                return self._cached[1]
+            
+            view = memoryview(mapped)
+            try:
+                sources = [SourceResult(_text(name), count, duration, 'failed' if failed else None)
+                           for name, count, duration, failed in SOURCE.iter_unpack(
+                               view[HEADER.size:HEADER.size + source_count * SOURCE.size])]
+                peers = {}
+                for key, source, allowed_ips, endpoint, handshake, rx, tx, flags in RECORD.iter_unpack(
+                        view[RECORDS_OFFSET:RECORDS_OFFSET + peer_count * RECORD.size]):
+                    public_key = _text(key)
+                    peers[public_key] = PeerSample(
+                        _text(source), public_key,
+                        None if flags & ENDPOINT_OVERFLOW else _text(endpoint) or None,
+                        None if flags & ALLOWED_IPS_OVERFLOW else _text(allowed_ips),
+                        handshake or None, rx, tx)
+            except (ValueError, struct.error):
+                continue  # Header changed under us, counts didn't match the data
+            finally:
+                view.release()
+            
+            if SEQUENCE.unpack_from(mapped, SEQUENCE_OFFSET)[0] != sequence:
+                continue  # Overwritten while reading
+            snapshot = Snapshot(taken_at, peers, sources)
+            self._cached = (sequence, snapshot)
+            return snapshot
+        return None
+    
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = self._inode = None
+
+
+def get_reader(path):
+    """Process-wide reader for path, so the mapping and parsed cache are shared"""
+    reader = _readers.get(path)
+    if reader is None:
+        reader = _readers.setdefault(path, SnapshotReader(path))
+    return reader
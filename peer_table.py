@@ -0,0 +1,196 @@
+"""
+Persistent peer table for the connection monitor
+Keeps one __slots__ record per peer in a list indexed by a stable
+public key -> slot map. Each dump is parsed into the existing records in
+place: unchanged fields are compared as raw strings and never converted,
+and only differences are reported as a change list.
+"""
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+from metrics import DUMP_PARSE_SECONDS
+
+ONLINE_WINDOW = 180  # Handshake within 3 minutes = connected
+
+# kind is one of: added, removed, online, offline, handshake, endpoint
+PeerChange = namedtuple('PeerChange', ['kind', 'public_key', 'slot'])
+
+
+class PeerRecord:
+    __slots__ = (
+        'slot', 'source', 'public_key', 'endpoint', 'allowed_ips',
+        'latest_handshake', 'rx_bytes', 'tx_bytes', 'is_online',
+        '_raw_handshake', '_raw_rx', '_raw_tx', '_generation'
+    )
+    
+    def __init__(self, slot, source, public_key):
+        self.slot = slot
+        self.source = source
+        self.public_key = public_key
+        self.endpoint = None
+        self.allowed_ips = ''
+        self.latest_handshake = None
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.is_online = False
+        self._raw_handshake = None
+        self._raw_rx = None
+        self._raw_tx = None
+        self._generation = 0
+    
+    def __repr__(self):
+        return f'<PeerRecord {self.slot} {self.public_key[:8]}... {self.source}>'
+
+
+class _PeerView(Mapping):
+    """Read-only public key -> PeerRecord mapping over the table's slots"""
+    
+    __slots__ = ('_table',)
+    
+    def __init__(self, table):
+        self._table = table
+    
+    def __getitem__(self, public_key):
+        return self._table._records[self._table._slots[public_key]]
+    
+    def __iter__(self):
+        return iter(self._table._slots)
+    
+    def __len__(self):
+        return len(self._table._slots)
+    
+    def values(self):
+        records = self._table._records
+        return (records[slot] for slot in self._table._slots.values())
+
+
+class PeerTable:
+    """Peer state that survives between monitor cycles
+
+    Exposes the same read interface as collector.Snapshot (peers, sources,
+    taken_at, is_online) so statistics and metrics code accept either.
+    Hold `lock` while reading from another thread.
+    """
+    
+    def __init__(self, online_window=ONLINE_WINDOW):
+        self.online_window = online_window
+        self.lock = threading.Lock()
+        self.taken_at = 0.0
+        self.sources = []
+        self._records = []
+        self._slots = {}
+        self._free = []
+        self._generation = 0
+        self.peers = _PeerView(self)
+    
+    def __len__(self):
+        return len(self._slots)
+    
+    def is_online(self, record, window=None):
+        return record.is_online if window is None else (
+            record.latest_handshake is not None and (self.taken_at - record.latest_handshake) < window)
+    
+    def _allocate(self, source, public_key):
+        if self._free:
+            slot = self._free.pop()
+            record = PeerRecord(slot, source, public_key)
+            self._records[slot] = record
+        else:
+            slot = len(self._records)
+            record = PeerRecord(slot, source, public_key)
+            self._records.append(record)
+        self._slots[public_key] = slot
+        return record
+    
+    def update(self, taken_at, results):
+        """Merge one collection cycle into the table
+
+        results is a list of (source name, dump text or None, SourceResult).
+        Sources that failed keep their previous peers so a flaky interface
+        doesn't look like every peer disconnected. Returns a list of
+        PeerChange for everything that differs from the previous cycle.
+        """
+        with self.lock:
+            self._generation += 1
+            generation = self._generation
+            self.taken_at = taken_at
+            self.sources = [result for _, _, result in results]
+            changes = []
+            failed = set()
+            
+            for index, (source, text, result) in enumerate(results):
+                if text is None:
+                    failed.add(source)
+                    continue
+                with DUMP_PARSE_SECONDS.time(source=source):
+                    count = self._parse_into(source, text, generation, taken_at, changes)
+                self.sources[index] = result._replace(peer_count=count)
+            
+            # Peers that vanished from a source that answered were removed
+            for public_key, slot in list(self._slots.items()):
+                record = self._records[slot]
+                if record._generation != generation and record.source not in failed:
+                    del self._slots[public_key]
+                    self._records[slot] = None
+                    self._free.append(slot)
+                    changes.append(PeerChange('removed', public_key, slot))
+            
+            return changes
+    
+    def _parse_into(self, source, text, generation, now, changes):
+        slots = self._slots
+        records = self._records
+        window = self.online_window
+        append = changes.append
+        
+        count = 0
+        lines = text.split('\n')
+        # Skip header line (first line is interface info)
+        for index in range(1, len(lines)):
+            parts = lines[index].split('\t')
+            if len(parts) < 6:
+                continue
+            count += 1
+            public_key = parts[0]
+            slot = slots.get(public_key)
+            if slot is None:
+                record = self._allocate(source, public_key)
+                append(PeerChange('added', public_key, record.slot))
+            else:
+                record = records[slot]
+                record.source = source
+            record._generation = generation
+            
+            endpoint = parts[2]
+            if endpoint == '(none)':
+                endpoint = None
+            if endpoint != record.endpoint:
+                if record._raw_handshake is not None:
+                    append(PeerChange('endpoint', public_key, record.slot))
+                record.endpoint = endpoint
+            if parts[3] != record.allowed_ips:
+                record.allowed_ips = parts[3]
+            
+            raw = parts[4]
+            if raw != record._raw_handshake:
+                if record._raw_handshake is not None:
+                    append(PeerChange('handshake', public_key, record.slot))
+                record._raw_handshake = raw
+                record.latest_handshake = int(raw) if raw != '0' else None
+            
+            raw = parts[5]
+            if raw != record._raw_rx:
+                record._raw_rx = raw
+                record.rx_bytes = int(raw)
+            raw = parts[6] if len(parts) > 6 else '0'
+            if raw != record._raw_tx:
+                record._raw_tx = raw
+                record.tx_bytes = int(raw)
+            
+            # Online state also flips as time passes without a new handshake
+            is_online = record.latest_handshake is not None and (now - record.latest_handshake) < window
+            if is_online != record.is_online:
+                record.is_online = is_online
+                append(PeerChange('online' if is_online else 'offline', public_key, record.slot))
+        
+        return count
@@ -0,0 +1,95 @@
+"""
+Traffic quota accounting
+Accumulates per-user traffic from the monitor's rx/tx counters. Only the
+delta since the previous cycle is added, so interface restarts (counters
+going back to zero) and monitor restarts never double count.
+"""
+from datetime import datetime
+from sqlalchemy import update, bindparam, case, func
+from models import db, User, Device
+
+
+def record_usage(deltas, now=None):
+    """Add {user_id: bytes} to today's and this month's usage in one executemany"""
+    if not deltas:
+        return 0
+    now = now or datetime.now()
+    users = User.__table__
+    db.session.execute(
+        update(users).where(users.c.id == bindparam('user_id')).values(
+            # A new day or month starts over from this cycle's delta
+            usage_day_bytes=case((users.c.usage_day == bindparam('day'), func.coalesce(users.c.usage_day_bytes, 0) + bindparam('delta')),
+                                 else_=bindparam('delta')),
+            usage_day=bindparam('day'),
+            usage_month_bytes=case((users.c.usage_month == bindparam('month'), func.coalesce(users.c.usage_month_bytes, 0) + bindparam('delta')),
+                                   else_=bindparam('delta')),
+            usage_month=bindparam('month')
+        ),
+        [{'user_id': user_id, 'delta': delta, 'day': now.strftime('%Y-%m-%d'), 'month': now.strftime('%Y-%m')}
+         for user_id, delta in deltas.items()]
+    )
+    db.session.commit()
+    return len(deltas)
+
+
+class QuotaTracker:
+    """Counter values per peer from the previous cycle, turned into per-user deltas"""
+    
+    def __init__(self):
+        self.counters = {}
+        self._owners = {}
+    
+    def observe(self, table, changes, first_cycle=False):
+        """Per-user byte deltas since the previous cycle, O(peers)"""
+        for change in changes:
+            if change.kind == 'removed':
+                self.counters.pop(change.public_key, None)
+        
+        per_key = {}
+        counters = self.counters
+        for record in table.peers.values():
+            total = record.rx_bytes + record.tx_bytes
+            last = counters.get(record.public_key)
+            counters[record.public_key] = total
+            if last is None:
+                # After a restart we can't know what was already counted;
+                # peers that appear later are new on the interface and start from zero
+                if first_cycle:
+                    continue
+                last = 0
+            # Counters that went backwards were reset by an interface restart
+            delta = total - last if total >= last else total
+            if delta:
+                per_key[record.public_key] = delta
+        
+        if not per_key:
+            return {}
+        self._resolve_owners(list(per_key))
+        deltas = {}
+        for public_key, delta in per_key.items():
+            user_id = self._owners.get(public_key)
+            if user_id is not None:
+                deltas[user_id] = deltas.get(user_id, 0) + delta
+        return deltas
+    
+    def _resolve_owners(self, public_keys):
+        missing = [key for key in public_keys if key not in self._owners]
+        for index in range(0, len(missing), 500):
+            chunk = missing[index:index + 500]
+            self._owners.update(db.session.query(Device.wg_public_key, Device.user_id)
+                                .filter(Device.wg_public_key.in_(chunk)))
+            # Legacy users are peers with their own keys
+            self._owners.update(db.session.query(User.wg_public_key, User.id)
+                                .filter(User.wg_public_key.in_(chunk)))
+            # Remember peers nobody owns (e.g. remote sources) so they aren't looked up every cycle
+            for key in chunk:
+                self._owners.setdefault(key, None)
+    
+    def forget_unowned(self, known_keys):
+        """Look up peers cached as unowned again once known_keys (e.g. the peer index) has them
+
+        A key can be live before its device row is committed, e.g. a rotated
+        key or a device added while the monitor runs.
+        """
+        for key in [key for key, owner in self._owners.items() if owner is None and key in known_keys]:
+            del self._owners[key]
@@ -0,0 +1,78 @@
+"""
+Token bucket rate limiter shared by all web workers
+Buckets live in a small SQLite file (RATE_LIMIT_DB_PATH, on tmpfs by
+default) so every worker process draws from the same budget. Each check is
+a single upsert: the bucket is refilled for the time since its last use
+and the request's cost is taken only if enough tokens are left.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    allowed INTEGER NOT NULL  -- Outcome of the last acquire
+) WITHOUT ROWID
+"""
+
+# SET expressions all see the old row, so each one refills from the stored values
+ACQUIRE = """
+INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :capacity - :cost, :now, 1)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = CASE WHEN min(:capacity, tokens + (:now - updated) * :rate) >= :cost
+                  THEN min(:capacity, tokens + (:now - updated) * :rate) - :cost
+                  ELSE min(:capacity, tokens + (:now - updated) * :rate) END,
+    updated = :now,
+    allowed = min(:capacity, tokens + (:now - updated) * :rate) >= :cost
+RETURNING tokens, allowed
+"""
+
+PRUNE_INTERVAL = 300  # Seconds between removing full (idle) buckets
+
+
+class TokenBucketLimiter:
+    """capacity tokens per key, refilled at rate tokens per second"""
+    
+    def __init__(self, path, capacity, rate):
+        self.path = path
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self._local = threading.local()
+        self._pruned_at = time.time()
+    
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')  # Buckets don't need to survive a crash
+            connection.execute(SCHEMA)
+            self._local.connection = connection
+        return connection
+    
+    def acquire(self, key, cost=1):
+        """Take cost tokens from key's bucket, returns (allowed, seconds until it would be allowed)"""
+        cost = min(float(cost), self.capacity)
+        now = time.time()
+        connection = self._connection()
+        tokens, allowed = connection.execute(ACQUIRE, {'key': key, 'capacity': self.capacity, 'cost': cost,
+                                                       'rate': self.rate, 'now': now}).fetchone()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self._pruned_at = now
+            self.prune(now)
+        
+        if not allowed:
+            return False, max(math.ceil((cost - tokens) / self.rate), 1)
+        return True, 0
+    
+    def prune(self, now=None):
+        """Drop buckets that have refilled completely, they behave like missing ones"""
+        now = now or time.time()
+        self._connection().execute('DELETE FROM buckets WHERE tokens + (? - updated) * ? >= ?',
+                                   (now, self.rate, self.capacity))
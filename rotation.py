@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Key Rotation Service
+Rotates device preshared keys (and keypairs with ROTATION_KEYPAIRS=true)
+once they are older than ROTATION_MAX_AGE_DAYS. New keys are staged first
+and served to clients; the server switches each device over in small
+batches once its client fetched the new config or the grace period passed.
+"""
+import sys
+import time
+import logging
+import argparse
+from datetime import timedelta
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import Config
+from models import Device, create_data_app
+from wireguard_manager import WireGuardManager
+
+app = create_data_app()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('/var/log/wireguard-rotation.log'),
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger('wireguard-rotation')
+
+def run_once():
+    """Stage due rotations and promote ready ones, one throttled batch at a time"""
+    max_age = timedelta(days=Config.ROTATION_MAX_AGE_DAYS)
+    grace = timedelta(hours=Config.ROTATION_GRACE_HOURS)
+    batch_size = Config.ROTATION_BATCH_SIZE
+    
+    with app.app_context():
+        staged = 0
+        while True:
+            count = WireGuardManager.start_key_rotations(max_age, batch_size, keypairs=Config.ROTATION_KEYPAIRS)
+            staged += count
+            if count < batch_size:
+                break
+        if staged:
+            logger.info(f"Staged key rotation for {staged} device(s)")
+        
+        promoted = 0
+        while True:
+            count = WireGuardManager.promote_key_rotations(grace, batch_size)
+            promoted += count
+            if count < batch_size:
+                break
+            # Give the interface a moment between batches
+            time.sleep(Config.ROTATION_BATCH_PAUSE)
+        if promoted:
+            logger.info(f"Switched {promoted} device(s) to their new keys")
+    
+    return staged, promoted
+
+def show_status():
+    """Print pending rotations"""
+    with app.app_context():
+        pending = Device.query.filter(Device.rotation_started_at.isnot(None)).order_by(Device.rotation_started_at).all()
+        print(f"{len(pending)} pending rotation(s)")
+        for device in pending:
+            fetched = device.rotation_fetched_at.strftime('%Y-%m-%d %H:%M') if device.rotation_fetched_at else 'not fetched'
+            kind = 'keypair' if device.pending_public_key else 'psk'
+            print(f"  {device.user.username:<20} {device.device_name:<20} {kind:<8} "
+                  f"staged {device.rotation_started_at.strftime('%Y-%m-%d %H:%M')}, {fetched}")
+
+def rotate_keys():
+    """Main rotation loop"""
+    logger.info("WireGuard Key Rotation started")
+    
+    while True:
+        try:
+            run_once()
+        except Exception as e:
+            logger.error(f"Error rotating keys: {e}")
+        
+        time.sleep(Config.ROTATION_INTERVAL)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rotate WireGuard device keys')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    parser.add_argument('--status', action='store_true', help='list pending rotations and exit')
+    args = parser.parse_args()
+    
+    try:
+        if args.status:
+            show_status()
+        elif args.once:
+            run_once()
+        else:
+            rotate_keys()
+    except KeyboardInterrupt:
+        logger.info("Rotation stopped by user")
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Rotation crashed: {e}")
+        sys.exit(1)
@@ -0,0 +1,233 @@
+"""
+Connection session log
+Turns the monitor's peer changes into session records (start, end, endpoint,
+bytes). Sessions live in one table per calendar month, named after the
+month they started in, so retention drops whole tables and history never
+touches the devices table.
+"""
+from datetime import datetime
+from sqlalchemy import (MetaData, Table, Column, Integer, BigInteger, String, DateTime, Index,
+                        inspect, select, update, bindparam)
+from models import db, Device
+
+PARTITION_PREFIX = 'connection_sessions_'
+
+_metadata = MetaData()
+
+
+def partition_name(moment):
+    return f'{PARTITION_PREFIX}{moment:%Y%m}'
+
+
+def get_partition(name):
+    """Table object of one monthly partition (not necessarily created yet)"""
+    table = _metadata.tables.get(name)
+    if table is None:
+        table = Table(
+            name, _metadata,
+            Column('id', Integer, primary_key=True),
+            Column('device_id', Integer, nullable=False),  # No FK: history outlives deleted devices
+            Column('public_key', String(255), nullable=False),
+            Column('endpoint', String(64)),
+            Column('started_at', DateTime, nullable=False),
+            Column('ended_at', DateTime),  # None = still connected
+            Column('rx_bytes', BigInteger, default=0),
+            Column('tx_bytes', BigInteger, default=0),
+            Index(f'ix_{name}_device_started', 'device_id', 'started_at'),
+            Index(f'ix_{name}_started', 'started_at')
+        )
+    return table
+
+
+def list_partitions():
+    """Names of existing partitions, oldest first"""
+    return sorted(name for name in inspect(db.session.connection()).get_table_names()
+                  if name.startswith(PARTITION_PREFIX))
+
+
+def _month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _partition_month(name):
+    return datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m')
+
+
+def get_device_sessions(device_id, start, end, limit=1000):
+    """Sessions of a device overlapping [start, end), newest first
+
+    Partitions from before start are still searched because a session that
+    started there may have lasted into the range.
+    """
+    sessions = []
+    for name in list_partitions():
+        if _partition_month(name) > end:
+            continue
+        table = get_partition(name)
+        query = select(table).where(
+            table.c.device_id == device_id,
+            table.c.started_at < end,
+            (table.c.ended_at.is_(None)) | (table.c.ended_at >= start)
+        ).order_by(table.c.started_at.desc()).limit(limit)
+        sessions.extend(dict(row._mapping) for row in db.session.execute(query))
+    sessions.sort(key=lambda s: s['started_at'], reverse=True)
+    return sessions[:limit]
+
+
+def prune(retention, now=None):
+    """Drop partitions whose whole month is older than retention, returns their names"""
+    cutoff = _month_start((now or datetime.now()) - retention)
+    dropped = [name for name in list_partitions() if _partition_month(name) < cutoff]
+    connection = db.session.connection()
+    for name in dropped:
+        get_partition(name).drop(connection)
+    db.session.commit()
+    return dropped
+
+
+class OpenSession:
+    __slots__ = ('device_id', 'partition', 'started_at', 'endpoint', 'rx_start', 'tx_start',
+                 'rx_bytes', 'tx_bytes', 'last_seen')
+    
+    def __init__(self, device_id, partition, started_at, endpoint, rx_start, tx_start):
+        self.device_id = device_id
+        self.partition = partition
+        self.started_at = started_at
+        self.endpoint = endpoint
+        self.rx_start = rx_start
+        self.tx_start = tx_start
+        self.rx_bytes = rx_start
+        self.tx_bytes = tx_start
+        self.last_seen = started_at
+
+
+class SessionLog:
+    """Open sessions kept between monitor cycles, written in one batch per cycle
+
+    A session opens when a peer comes online and closes when it goes
+    offline or disappears. Its row is inserted with ended_at unset on open,
+    so a restarted monitor can resume it, and completed on close.
+    """
+    
+    def __init__(self):
+        self.open = {}
+        self._inserts = {}
+        self._closes = {}
+    
+    def resume(self):
+        """Load sessions a previous monitor run left open"""
+        self.open.clear()
+        for name in list_partitions():
+            table = get_partition(name)
+            for row in db.session.execute(select(table).where(table.c.ended_at.is_(None))):
+                session = OpenSession(row.device_id, name, row.started_at, row.endpoint, 0, 0)
+                # The byte baseline is taken when the peer is seen again;
+                # traffic while the monitor was down isn't counted
+                session.rx_start = session.tx_start = None
+                session.rx_bytes, session.tx_bytes = row.rx_bytes or 0, row.tx_bytes or 0
+                self.open[row.public_key] = session
+        return len(self.open)
+    
+    def observe(self, table, changes, first_cycle=False):
+        """Queue session opens and closes for one cycle of PeerTable changes"""
+        to_open = []
+        for change in changes:
+            if change.kind == 'online':
+                if change.public_key not in self.open:
+                    to_open.append(change.public_key)
+            elif change.kind in ('offline', 'removed'):
+                self._close(change.public_key, table.peers.get(change.public_key))
+        
+        if first_cycle:
+            # Resumed sessions whose peer isn't online anymore ended while we were down
+            for public_key in list(self.open):
+                record = table.peers.get(public_key)
+                if record is None or not record.is_online:
+                    self._close(public_key, record)
+        
+        # Keep byte counters and last proof of life of open sessions current
+        for public_key, session in self.open.items():
+            record = table.peers.get(public_key)
+            if record is None:
+                continue
+            if session.rx_start is None:
+                session.rx_start = record.rx_bytes - session.rx_bytes
+                session.tx_start = record.tx_bytes - session.tx_bytes
+            session.rx_bytes = record.rx_bytes
+            session.tx_bytes = record.tx_bytes
+            if record.latest_handshake:
+                session.last_seen = max(session.last_seen, datetime.fromtimestamp(record.latest_handshake))
+        
+        if to_open:
+            device_ids = {}
+            # Chunked to stay below SQLite's bound parameter limit on the first cycle
+            for index in range(0, len(to_open), 500):
+                device_ids.update(db.session.query(Device.wg_public_key, Device.id)
+                                  .filter(Device.wg_public_key.in_(to_open[index:index + 500])))
+            for public_key in to_open:
+                device_id = device_ids.get(public_key)
+                if device_id is None:
+                    continue  # Legacy users and peers unknown to the database
+                record = table.peers[public_key]
+                started_at = datetime.fromtimestamp(record.latest_handshake)
+                session = OpenSession(device_id, partition_name(started_at), started_at, record.endpoint,
+                                      record.rx_bytes, record.tx_bytes)
+                self.open[public_key] = session
+                self._inserts.setdefault(session.partition, []).append({
+                    'device_id': device_id, 'public_key': public_key, 'endpoint': record.endpoint,
+                    'started_at': started_at, 'ended_at': None, 'rx_bytes': 0, 'tx_bytes': 0
+                })
+    
+    def _close(self, public_key, record):
+        session = self.open.pop(public_key, None)
+        if session is None:
+            return
+        if record is not None and record.latest_handshake:
+            session.last_seen = max(session.last_seen, datetime.fromtimestamp(record.latest_handshake))
+        if session.rx_start is None:
+            # Resumed and closed before it was seen again: keep what the row has
+            rx, tx = session.rx_bytes, session.tx_bytes
+        else:
+            rx_bytes, tx_bytes = session.rx_bytes, session.tx_bytes
+            if record is not None:
+                rx_bytes, tx_bytes = record.rx_bytes, record.tx_bytes
+            # Counters that went backwards were reset by an interface restart
+            rx = rx_bytes - session.rx_start if rx_bytes >= session.rx_start else rx_bytes
+            tx = tx_bytes - session.tx_start if tx_bytes >= session.tx_start else tx_bytes
+        self._closes.setdefault(session.partition, []).append({
+            'key_device': session.device_id,
+            'key_started': session.started_at,
+            'ended': session.last_seen,
+            'rx': rx,
+            'tx': tx
+        })
+    
+    def flush(self):
+        """Write queued opens and closes, one executemany per partition"""
+        if not self._inserts and not self._closes:
+            return 0
+        connection = db.session.connection()
+        written = 0
+        
+        for name, rows in self._inserts.items():
+            table = get_partition(name)
+            table.create(connection, checkfirst=True)
+            db.session.execute(table.insert(), rows)
+            written += len(rows)
+        
+        for name, rows in self._closes.items():
+            table = get_partition(name)
+            table.create(connection, checkfirst=True)
+            db.session.execute(
+                update(table).where(table.c.device_id == bindparam('key_device'),
+                                    table.c.started_at == bindparam('key_started'),
+                                    table.c.ended_at.is_(None))
+                .values(ended_at=bindparam('ended'), rx_bytes=bindparam('rx'), tx_bytes=bindparam('tx')),
+                rows
+            )
+            written += len(rows)
+        
+        db.session.commit()
+        self._inserts.clear()
+        self._closes.clear()
+        return written
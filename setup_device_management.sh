@@ -75,6 +75,7 @@ Environment="PYTHONPATH=$SCRIPT_DIR"
 ExecStart=/usr/bin/python3 $SCRIPT_DIR/connection_monitor.py
 Restart=always
 RestartSec=10
+TimeoutStopSec=30
 StandardOutput=journal
 StandardError=journal
 
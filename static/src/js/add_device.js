@@ -0,0 +1,4 @@
+function setDeviceName(name) {
+    document.getElementById('device_name').value = name;
+    document.getElementById('device_name').focus();
+}
@@ -0,0 +1,219 @@
+// URLs rendered by the template, see the data- attributes of the script tag
+const PAGE = document.currentScript.dataset;
+
+const PEER_FIELDS = ['username', 'ip_address', 'endpoint', 'is_online', 'rx_bytes', 'tx_bytes', 'interface'];
+
+function formatBytes(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+    for (const unit of units) {
+        if (bytes < 1024) {
+            return `${bytes.toFixed(2)} ${unit}`;
+        }
+        bytes /= 1024;
+    }
+    return `${bytes.toFixed(2)} PB`;
+}
+
+function refreshPeerStats() {
+    fetch(`${PAGE.peerStatisticsUrl}?format=columns&fields=${PEER_FIELDS.join(',')}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                // Rebuild peer objects from the columnar payload
+                const peers = data.peers.map(row => Object.fromEntries(data.fields.map((f, i) => [f, row[i]])));
+                updatePeerTable(peers);
+                document.getElementById('onlineCount').textContent = data.online_count;
+            } else {
+                showPeerError('Failed to load connection data');
+            }
+        })
+        .catch(error => {
+            showPeerError('Error loading connection data');
+            console.error('Error:', error);
+        });
+}
+
+function updatePeerTable(peers) {
+    const container = document.getElementById('connectedDevices');
+
+    if (peers.length === 0) {
+        container.innerHTML = `
+            <div style="text-align: center; padding: 2rem; color: var(--gray-400);">
+                <svg width="48" height="48" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.5" style="margin: 0 auto 1rem;">
+                    <circle cx="12" cy="12" r="10"></circle>
+                    <line x1="4.93" y1="4.93" x2="19.07" y2="19.07"></line>
+                </svg>
+                <p style="font-size: 1rem;">No devices connected</p>
+            </div>
+        `;
+        return;
+    }
+
+    let tableHTML = `
+        <table>
+            <thead>
+                <tr>
+                    <th>User</th>
+                    <th>Status</th>
+                    <th>IP Address</th>
+                    <th>Endpoint</th>
+                    <th>Downloaded</th>
+                    <th>Uploaded</th>
+                    <th>Total Traffic</th>
+                </tr>
+            </thead>
+            <tbody>
+    `;
+
+    peers.forEach(peer => {
+        const statusBadge = peer.is_online 
+            ? '<span class="badge badge-success">● Online</span>'
+            : '<span class="badge badge-danger">○ Offline</span>';
+
+        const endpoint = peer.endpoint || '—';
+
+        tableHTML += `
+            <tr>
+                <td><strong>${peer.username}</strong></td>
+                <td>${statusBadge}</td>
+                <td><span class="info-value">${peer.ip_address}</span> <span style="font-size: 0.75rem; color: var(--gray-500);">${peer.interface}</span></td>
+                <td style="font-size: 0.813rem;">${endpoint}</td>
+                <td><strong>${formatBytes(peer.rx_bytes)}</strong></td>
+                <td><strong>${formatBytes(peer.tx_bytes)}</strong></td>
+                <td><strong style="color: var(--primary);">${formatBytes(peer.rx_bytes + peer.tx_bytes)}</strong></td>
+            </tr>
+        `;
+    });
+
+    tableHTML += `
+            </tbody>
+        </table>
+    `;
+
+    container.innerHTML = tableHTML;
+}
+
+function showPeerError(message) {
+    const container = document.getElementById('connectedDevices');
+    container.innerHTML = `
+        <div style="text-align: center; padding: 2rem; color: var(--danger);">
+            <svg width="48" height="48" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.5" style="margin: 0 auto 1rem;">
+                <circle cx="12" cy="12" r="10"></circle>
+                <line x1="12" y1="8" x2="12" y2="12"></line>
+                <line x1="12" y1="16" x2="12.01" y2="16"></line>
+            </svg>
+            <p>${message}</p>
+        </div>
+    `;
+}
+
+// Load peer stats on page load
+document.addEventListener('DOMContentLoaded', function() {
+    refreshPeerStats();
+    // Auto-refresh every 10 seconds
+    setInterval(refreshPeerStats, 10000);
+});
+
+function toggleUser(userId) {
+    if (!confirm('Toggle user status?')) {
+        return;
+    }
+
+    fetch(`/admin/toggle-user/${userId}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            location.reload();
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        alert('Error: ' + error);
+    });
+}
+
+function deleteUser(userId, username) {
+    if (!confirm(`Delete user "${username}"? This action cannot be undone.`)) {
+        return;
+    }
+
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = `/admin/delete-user/${userId}`;
+    document.body.appendChild(form);
+    form.submit();
+}
+
+function postBatch(action, userIds, dryRun) {
+    return fetch(PAGE.batchUrl, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({action: action, user_ids: userIds, dry_run: dryRun})
+    }).then(response => response.json());
+}
+
+function runBatch() {
+    const action = document.getElementById('batchAction').value;
+    const userIds = Array.from(document.querySelectorAll('.batch-user:checked')).map(box => parseInt(box.value));
+    if (userIds.length === 0) {
+        alert('Select at least one user');
+        return;
+    }
+
+    // Preview the peer changes first, then apply them in one go
+    postBatch(action, userIds, true)
+    .then(data => {
+        if (!data.success) {
+            alert('Error: ' + data.error);
+            return;
+        }
+        const lines = Object.entries(data.diff).map(([name, diff]) =>
+            `${name}: +${diff.added.length} / -${diff.removed.length} / ~${diff.changed.length} peers`);
+        const summary = lines.length ? lines.join('\n') : 'No peer changes';
+        if (!confirm(`${action} ${data.user_ids.length} user(s)?\n\n${summary}`)) {
+            return;
+        }
+        return postBatch(action, userIds, false).then(result => {
+            if (result.success) {
+                location.reload();
+            } else {
+                alert('Error: ' + result.error);
+            }
+        });
+    })
+    .catch(error => {
+        alert('Error: ' + error);
+    });
+}
+
+function regenerateConfig(userId) {
+    if (!confirm('Regenerate configuration? The old config will stop working.')) {
+        return;
+    }
+
+    fetch(`/admin/regenerate-config/${userId}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            location.reload();
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        alert('Error: ' + error);
+    });
+}
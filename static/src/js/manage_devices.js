@@ -0,0 +1,105 @@
+function downloadConfig(deviceId) {
+    window.location.href = `/devices/${deviceId}/download`;
+}
+
+function showQRCode(deviceId, deviceName) {
+    document.getElementById('qrDeviceName').textContent = deviceName + ' - QR Code';
+    document.getElementById('qrCodeContainer').innerHTML = '<p>Loading...</p>';
+    document.getElementById('qrModal').style.display = 'block';
+
+    fetch(`/devices/${deviceId}/qr-code`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                document.getElementById('qrCodeContainer').innerHTML = 
+                    `<p style="color: red;">Error: ${data.error}</p>`;
+            } else {
+                document.getElementById('qrCodeContainer').innerHTML = 
+                    `<img src="${data.qr_code}" alt="QR Code">`;
+            }
+        })
+        .catch(error => {
+            document.getElementById('qrCodeContainer').innerHTML = 
+                `<p style="color: red;">Error loading QR code</p>`;
+        });
+}
+
+function closeQRModal() {
+    document.getElementById('qrModal').style.display = 'none';
+}
+
+function toggleDevice(deviceId) {
+    if (!confirm('Are you sure you want to toggle this device?')) {
+        return;
+    }
+
+    fetch(`/devices/${deviceId}/toggle`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            location.reload();
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        alert('Error toggling device');
+    });
+}
+
+function activateDevice(deviceId) {
+    fetch(`/devices/${deviceId}/activate`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            location.reload();
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        alert('Error reactivating device');
+    });
+}
+
+function deleteDevice(deviceId, deviceName) {
+    if (!confirm(`Are you sure you want to delete "${deviceName}"? This action cannot be undone.`)) {
+        return;
+    }
+
+    fetch(`/devices/${deviceId}/delete`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            location.reload();
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        alert('Error deleting device');
+    });
+}
+
+// Close modal when clicking outside
+window.onclick = function(event) {
+    const modal = document.getElementById('qrModal');
+    if (event.target == modal) {
+        closeQRModal();
+    }
+}
@@ -0,0 +1,29 @@
+// URLs rendered by the template, see the data- attributes of the script tag
+const PAGE = document.currentScript.dataset;
+
+function showQRCode() {
+    const modal = document.getElementById('qrModal');
+    const qrImage = document.getElementById('qrCodeImage');
+
+    modal.classList.add('active');
+    qrImage.innerHTML = '<p style="color: var(--gray-400);">Generating...</p>';
+
+    fetch(PAGE.qrCodeUrl)
+        .then(response => response.json())
+        .then(data => {
+            if (data.qr_code) {
+                qrImage.innerHTML = `<img src="${data.qr_code}" alt="QR Code" style="max-width: 100%; height: auto; border-radius: 8px;">`;
+            } else {
+                qrImage.innerHTML = '<p style="color: var(--danger);">Error generating QR code</p>';
+            }
+        })
+        .catch(error => {
+            qrImage.innerHTML = '<p style="color: var(--danger);">Error: ' + error + '</p>';
+        });
+}
+
+function closeQRCode(event) {
+    if (!event || event.target.id === 'qrModal') {
+        document.getElementById('qrModal').classList.remove('active');
+    }
+}
@@ -0,0 +1,61 @@
+"""
+Shared fixtures: a data app on a temporary SQLite file, with fake_wg.py
+standing in for wg and wg-quick and every runtime path under tmp_path
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from config import Config
+from models import db, create_data_app, User, WireGuardConfig
+from wireguard_manager import WireGuardManager
+
+
+@pytest.fixture
+def wg_app(tmp_path, monkeypatch):
+    config_dir = tmp_path / 'wireguard'
+    config_dir.mkdir()
+    monkeypatch.setenv('WG_CONFIG_DIR', str(config_dir))  # Read by fake_wg.py
+    settings = {
+        'WG_BINARY': str(ROOT / 'fake_wg.py'),
+        'WG_QUICK_BINARY': str(ROOT / 'fake_wg.py'),
+        'WG_CONFIG_DIR': str(config_dir),
+        'WG_SERVER_PUBLIC_IP': '203.0.113.1',
+        'WG_LOCAL': True,
+        'ACL_ENABLED': False,
+        'CHANGEFEED_ENABLED': False,
+        'PEER_SNAPSHOT_PATH': str(tmp_path / 'peers.snapshot'),
+        'LOOKUP_INDEX_PATH': str(tmp_path / 'lookup-index.json'),
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value)
+    
+    class TempConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "wireguard.db"}'
+    
+    app = create_data_app(TempConfig)
+    with app.app_context():
+        db.create_all()
+        private_key, public_key = WireGuardManager.generate_keypair()
+        db.session.add(WireGuardConfig(server_private_key=private_key, server_public_key=public_key))
+        db.session.commit()
+        WireGuardManager.ensure_primary_interface()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def add_user(username, devices=0, **fields):
+    """A user with devices created the way the web app creates them"""
+    fields.setdefault('max_connections', max(devices, 1))
+    user = User(username=username, password_hash='x', **fields)
+    db.session.add(user)
+    db.session.commit()
+    for number in range(devices):
+        WireGuardManager.create_device_config(user, f'device{number}')
+    return user
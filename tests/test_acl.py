@@ -0,0 +1,125 @@
+"""
+nftables set elements compiled from access rules
+"""
+import json
+
+import acl
+from config import Config
+from conftest import add_user
+from models import db, AccessGroup, AccessRule
+from wireguard_manager import WireGuardManager
+
+
+def live_addresses():
+    """VPN IPs of every peer in the rendered server configs"""
+    return {ip for interface in WireGuardManager.get_interfaces()
+            for _, _, _, ip in WireGuardManager.get_interface_peers(interface)}
+
+
+def elements_addresses(elements):
+    unrestricted, allowed = elements
+    return unrestricted | {address for address, _ in allowed}
+
+
+def add_legacy_user(username, ip, **fields):
+    user = add_user(username, **fields)
+    user.wg_public_key = f'{username}-legacy-key'
+    user.wg_private_key = 'private'
+    user.wg_ip_address = ip
+    db.session.commit()
+    return user
+
+
+def test_elements_cover_exactly_the_config_peers(wg_app):
+    alice = add_user('alice', devices=2)
+    parked = add_user('parked', devices=1)
+    parked.devices[0].is_parked = True
+    add_user('disabled', devices=1).is_active = False
+    add_legacy_user('legacy', '10.8.0.200')
+    add_legacy_user('root', '10.8.0.201', is_admin=True)
+    # A legacy key next to an active device: only the device is a peer
+    migrated = add_user('migrated', devices=1)
+    migrated.wg_public_key = 'migrated-legacy-key'
+    migrated.wg_ip_address = '10.8.0.202'
+    db.session.commit()
+    
+    elements = acl.get_elements()
+    
+    assert elements_addresses(elements) == live_addresses()
+    assert {device.wg_ip_address for device in alice.devices} <= elements[0]
+    assert '10.8.0.200' in elements[0]
+    assert not {'10.8.0.201', '10.8.0.202'} & elements_addresses(elements)
+
+
+def test_user_and_group_rules_restrict_devices(wg_app):
+    alice = add_user('alice', devices=1)
+    bob = add_user('bob', devices=1)
+    group = AccessGroup(name='eng')
+    group.users.append(bob)
+    db.session.add_all([group,
+                        AccessRule(user=alice, destination='10.20.0.0/16'),
+                        AccessRule(user=alice, destination='10.20.5.0/24'),  # Inside the /16, merged
+                        AccessRule(group=group, destination='10.30.0.5')])
+    db.session.commit()
+    
+    unrestricted, allowed = acl.get_elements()
+    
+    alice_ip, bob_ip = alice.devices[0].wg_ip_address, bob.devices[0].wg_ip_address
+    assert unrestricted == set()
+    assert allowed == {(alice_ip, '10.20.0.0/16'), (bob_ip, '10.30.0.5')}
+
+
+def test_default_deny_leaves_users_without_rules_out(wg_app, monkeypatch):
+    monkeypatch.setattr(Config, 'ACL_DEFAULT', 'deny')
+    add_user('alice', devices=1)
+    
+    assert acl.get_elements() == (set(), set())
+
+
+def test_element_diff_deletes_before_adding():
+    current = ({'10.8.0.2', '10.8.0.3'}, {('10.8.0.4', '10.20.0.0/16')})
+    desired = ({'10.8.0.3'}, {('10.8.0.4', '10.20.0.0/24')})
+    
+    script = acl.render_element_diff(current, desired).splitlines()
+    
+    assert script == [
+        'delete element inet wireguard_gui unrestricted { 10.8.0.2 }',
+        'delete element inet wireguard_gui allowed { 10.8.0.4 . 10.20.0.0/16 }',
+        'add element inet wireguard_gui allowed { 10.8.0.4 . 10.20.0.0/24 }',
+    ]
+    assert acl.render_element_diff(desired, desired) == ''
+
+
+def test_parse_elements_reads_nft_json():
+    listing = json.dumps({'nftables': [
+        {'metainfo': {'json_schema_version': 1}},
+        {'set': {'family': 'inet', 'table': acl.TABLE, 'name': 'unrestricted', 'elem': ['10.8.0.2']}},
+        {'set': {'family': 'inet', 'table': acl.TABLE, 'name': 'allowed', 'elem': [
+            {'concat': ['10.8.0.4', {'prefix': {'addr': '10.20.0.0', 'len': 16}}]},
+            {'concat': ['10.8.0.4', '10.30.0.5']},
+        ]}},
+        {'set': {'family': 'inet', 'table': 'other', 'name': 'unrestricted', 'elem': ['192.0.2.1']}},
+    ]})
+    
+    assert acl.parse_elements(listing) == (
+        {'10.8.0.2'}, {('10.8.0.4', '10.20.0.0/16'), ('10.8.0.4', '10.30.0.5')})
+
+
+def test_sync_applies_only_the_difference(wg_app, tmp_path, monkeypatch):
+    alice = add_user('alice', devices=1)
+    script_path = tmp_path / 'nft-input'
+    nft = tmp_path / 'nft'
+    # Pretends the table holds one stale element
+    listing = json.dumps({'nftables': [
+        {'set': {'table': acl.TABLE, 'name': 'unrestricted', 'elem': ['10.8.0.99']}},
+        {'set': {'table': acl.TABLE, 'name': 'allowed'}},
+    ]})
+    nft.write_text(f"#!/bin/sh\nif [ \"$1\" = -j ]; then echo '{listing}'; else cat > {script_path}; fi\n")
+    nft.chmod(0o755)
+    monkeypatch.setattr(Config, 'NFT_BINARY', str(nft))
+    
+    script = acl.sync()
+    
+    assert script_path.read_text() == script == (
+        'delete element inet wireguard_gui unrestricted { 10.8.0.99 }\n'
+        f'add element inet wireguard_gui unrestricted {{ {alice.devices[0].wg_ip_address} }}\n')
@@ -0,0 +1,86 @@
+"""
+Backup archives carry checksums that catch damage, and a restore brings
+back the database and only the peers that differ
+"""
+import io
+import json
+import os
+import tarfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import backup
+from conftest import add_user
+from models import db, User, Device
+
+
+def rewrite_member(path, name, change):
+    """Rewrite one archive member with change(bytes), keeping the manifest as it was"""
+    with tarfile.open(path, 'r:gz') as tar:
+        members = [(member, tar.extractfile(member).read()) for member in tar]
+    with tarfile.open(path, 'w:gz') as tar:
+        for member, data in members:
+            if member.name == name:
+                data = change(data)
+                member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+
+
+def test_archive_holds_database_configs_and_checksums(wg_app, tmp_path):
+    add_user('alice', devices=1)
+    
+    path = backup.create_backup()
+    
+    assert os.path.dirname(path) == str(tmp_path / 'backups')
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    manifest = backup.verify_backup(path)
+    assert manifest['interfaces'] == ['wg0']
+    assert set(manifest['files']) == {backup.DATABASE_NAME, 'configs/wg0.conf'}
+    with tarfile.open(path, 'r:gz') as tar:
+        assert json.load(tar.extractfile(backup.MANIFEST_NAME)) == manifest
+
+
+@pytest.mark.parametrize('member', [backup.DATABASE_NAME, 'configs/wg0.conf'])
+def test_verify_detects_changed_files(wg_app, member):
+    path = backup.create_backup()
+    rewrite_member(path, member, lambda data: data[:-1] + bytes([data[-1] ^ 1]))
+    
+    with pytest.raises(Exception, match=f'Checksum mismatch.*{member}'):
+        backup.verify_backup(path)
+
+
+def test_verify_detects_truncated_archives(wg_app):
+    path = backup.create_backup()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    
+    with pytest.raises(Exception, match='damaged'):
+        backup.verify_backup(path)
+
+
+def test_restore_brings_back_the_database_and_changed_peers(wg_app, tmp_path):
+    alice = add_user('alice', devices=1)
+    alice_key = alice.devices[0].wg_public_key
+    path = backup.create_backup()
+    
+    db.session.delete(alice)
+    db.session.commit()
+    bob_key = add_user('bob', devices=1).devices[0].wg_public_key
+    
+    manifest, summary = backup.restore_backup(path)
+    
+    assert manifest == backup.verify_backup(path)
+    assert [user.username for user in User.query] == ['alice']
+    assert [device.wg_public_key for device in Device.query] == [alice_key]
+    assert summary == '2 peer(s) updated in place'  # bob removed, alice added
+    config = (tmp_path / 'wireguard' / 'wg0.conf').read_text()
+    assert alice_key in config and bob_key not in config
+
+
+def test_prune_keeps_the_newest(wg_app):
+    started = datetime(2026, 1, 1)
+    paths = [backup.create_backup(now=started + timedelta(days=day)) for day in range(3)]
+    
+    assert backup.prune_backups(keep=2) == paths[:1]
+    assert backup.list_backups() == paths[1:]
@@ -0,0 +1,101 @@
+"""
+Bulk user and device operations
+"""
+from sqlalchemy import func, select
+
+from conftest import add_user
+from models import db, User, Device, AccessGroup, AccessRule, user_access_groups
+from wireguard_manager import WireGuardManager
+
+
+def test_delete_removes_devices_rules_and_memberships(wg_app):
+    user = add_user('alice', devices=2)
+    other = add_user('bob', devices=1)
+    group = AccessGroup(name='eng')
+    group.users.append(user)
+    group.users.append(other)
+    db.session.add_all([group, AccessRule(user=user, destination='10.20.0.0/16'),
+                        AccessRule(user=other, destination='10.30.0.0/16')])
+    db.session.commit()
+    user_id = user.id
+    
+    result = WireGuardManager.batch_update('delete', user_ids=[user_id])
+    
+    assert result['user_ids'] == [user_id]
+    assert db.session.get(User, user_id) is None
+    assert Device.query.filter_by(user_id=user_id).count() == 0
+    assert AccessRule.query.filter_by(user_id=user_id).count() == 0
+    assert db.session.scalar(select(func.count()).select_from(user_access_groups)
+                             .where(user_access_groups.c.user_id == user_id)) == 0
+    # Other users keep theirs
+    assert AccessRule.query.filter_by(user_id=other.id).count() == 1
+    assert [member.id for member in db.session.get(AccessGroup, group.id).users] == [other.id]
+
+
+def test_deleted_user_id_is_not_inherited(wg_app):
+    user = add_user('alice')
+    db.session.add(AccessRule(user=user, destination='10.20.0.0/16'))
+    group = AccessGroup(name='eng')
+    group.users.append(user)
+    db.session.add(group)
+    db.session.commit()
+    user_id, group_id = user.id, group.id
+    
+    WireGuardManager.batch_update('delete', user_ids=[user_id])
+    db.session.remove()  # As at the end of the request
+    successor = add_user('mallory')
+    
+    assert successor.id == user_id  # users reuses ids, which is what made leftovers dangerous
+    assert successor.access_rules == []
+    assert db.session.get(AccessGroup, group_id).users == []
+
+
+def test_disable_removes_peers(wg_app):
+    user = add_user('alice', devices=2)
+    keys = {device.wg_public_key for device in user.devices}
+    
+    result = WireGuardManager.batch_update('disable', user_ids=[user.id])
+    
+    removed = {entry['public_key'] for entry in result['diff']['wg0']['removed']}
+    assert removed == keys
+    assert result['applied']
+    assert not db.session.get(User, user.id).is_active
+
+
+def test_admins_are_skipped(wg_app):
+    admin = add_user('root', is_admin=True)
+    
+    result = WireGuardManager.batch_update('disable', user_ids=[admin.id, 999])
+    
+    assert result['user_ids'] == []
+    assert {(entry.get('user_id'), entry['reason']) for entry in result['skipped']} == {
+        (admin.id, 'admin users cannot be changed in bulk'), (999, 'not found')}
+
+
+def test_rekey_replaces_keys(wg_app):
+    user = add_user('alice', devices=2)
+    before = {device.id: device.wg_public_key for device in user.devices}
+    
+    result = WireGuardManager.batch_update('rekey', user_ids=[user.id])
+    
+    after = {device.id: device.wg_public_key for device in Device.query.filter_by(user_id=user.id)}
+    assert result['rekeyed'] == 2
+    assert all(after[device_id] != key for device_id, key in before.items())
+    assert {entry['public_key'] for entry in result['diff']['wg0']['removed']} == set(before.values())
+
+
+def test_dry_run_rekey_generates_no_keys_and_changes_nothing(wg_app, monkeypatch):
+    user = add_user('alice', devices=2)
+    before = {device.id: device.wg_public_key for device in user.devices}
+    
+    def forbidden(count):
+        raise AssertionError('a dry run must not generate keys')
+    monkeypatch.setattr(WireGuardManager, 'generate_keys_bulk', staticmethod(forbidden))
+    
+    result = WireGuardManager.batch_update('rekey', user_ids=[user.id], dry_run=True)
+    
+    assert result['rekeyed'] == 2 and not result['applied']
+    changes = result['diff']['wg0']
+    assert {entry['public_key'] for entry in changes['removed']} == set(before.values())
+    assert len(changes['added']) == 2
+    assert {device.id: device.wg_public_key for device in Device.query.filter_by(user_id=user.id)} == before
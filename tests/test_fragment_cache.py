@@ -0,0 +1,48 @@
+"""
+Rendered fragments are reused until their row changes, within a byte budget
+"""
+from jinja2 import Environment
+
+import fragment_cache
+from config import Config
+from conftest import add_user
+from fragment_cache import FragmentCache
+from models import db
+
+
+def test_lru_evicts_the_least_recently_used_bytes():
+    cache = FragmentCache(max_bytes=10)
+    cache.set(('row', 1), 'aaaa')
+    cache.set(('row', 2), 'bbbb')
+    assert cache.get(('row', 1)) == 'aaaa'  # Now the most recent
+    
+    cache.set(('row', 3), 'cccc')
+    cache.set(('row', 4), 'x' * 11)  # Larger than the whole cache, not stored
+    
+    assert cache.get(('row', 2)) is None
+    assert len(cache) == 2 and cache.size == 8
+    cache.invalidate('row')
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_call_block_renders_once_per_key(monkeypatch):
+    monkeypatch.setattr(Config, 'FRAGMENT_CACHE_ENABLED', True)
+    monkeypatch.setattr(fragment_cache, 'cache', FragmentCache(1024))
+    rendered = []
+    env = Environment()
+    env.globals.update(cached_fragment=fragment_cache.cached_fragment, render=lambda: rendered.append(1) or '')
+    template = env.from_string("{% call cached_fragment('row', id) %}<tr>{{ render() }}{{ id }}</tr>{% endcall %}")
+    
+    assert [template.render(id=1), template.render(id=1), template.render(id=2)] == \
+        ['<tr>1</tr>', '<tr>1</tr>', '<tr>2</tr>']
+    assert len(rendered) == 2
+
+
+def test_any_write_changes_the_row_key(wg_app):
+    device = add_user('alice', devices=1).devices[0]
+    before = device.updated_at
+    
+    device.device_name = 'laptop'
+    db.session.commit()
+    
+    assert device.updated_at > before
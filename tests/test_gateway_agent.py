@@ -0,0 +1,112 @@
+"""
+Gateway agents follow the change feed, and catch up from the snapshot
+when they start or fall behind the retained log
+"""
+import pytest
+
+import changefeed
+from config import Config
+from conftest import add_user
+from gateway_agent import GatewayAgent
+from models import db
+from wireguard_manager import WireGuardManager
+
+
+@pytest.fixture
+def feed(wg_app, monkeypatch):
+    monkeypatch.setattr(Config, 'CHANGEFEED_ENABLED', True)
+    changefeed.publish()
+    return wg_app
+
+
+@pytest.fixture
+def wg_set_calls(monkeypatch):
+    """Peers sent with 'wg set', per call"""
+    calls = []
+    monkeypatch.setattr(WireGuardManager, 'set_interface_peers',
+                        staticmethod(lambda name, peers: calls.append((name, peers))))
+    return calls
+
+
+def make_agent(tmp_path, **kwargs):
+    config_dir = tmp_path / 'gateway'
+    config_dir.mkdir(exist_ok=True)
+    return GatewayAgent(config_dir=str(config_dir), **kwargs)
+
+
+def config_keys(tmp_path, name='wg0'):
+    """Peer public keys in the config file the agent wrote"""
+    lines = (tmp_path / 'gateway' / f'{name}.conf').read_text().splitlines()
+    return {line.split(' = ', 1)[1] for line in lines if line.startswith('PublicKey = ')}
+
+
+def test_first_poll_catches_up_from_the_snapshot(feed, tmp_path, wg_set_calls):
+    alice = add_user('alice', devices=2)
+    changefeed.publish()
+    keys = {device.wg_public_key for device in alice.devices}
+    agent = make_agent(tmp_path)
+    
+    agent.poll()
+    
+    assert agent.version == changefeed.latest_version() > 0
+    assert set(agent.peers['wg0']) == keys
+    assert config_keys(tmp_path) == keys
+
+
+def test_poll_applies_only_the_new_changes(feed, tmp_path, wg_set_calls):
+    alice = add_user('alice', devices=2)
+    changefeed.publish()
+    agent = make_agent(tmp_path)
+    agent.poll()
+    wg_set_calls.clear()
+    
+    removed = alice.devices[0]
+    removed.is_active = False
+    db.session.commit()
+    bob = add_user('bob', devices=1)
+    changefeed.publish()
+    
+    assert agent.poll() == 2
+    
+    added = bob.devices[0]
+    assert wg_set_calls == [('wg0', [
+        {'remove': removed.wg_public_key},
+        {'public_key': added.wg_public_key, 'preshared_key': added.wg_preshared_key,
+         'allowed_ips': f'{added.wg_ip_address}/32'},
+    ])]
+    assert config_keys(tmp_path) == {alice.devices[1].wg_public_key, added.wg_public_key}
+    assert agent.version == changefeed.latest_version()
+    assert agent.poll() == 0
+
+
+@pytest.mark.parametrize('fall_behind', ['lag', 'pruned'])
+def test_falling_behind_catches_up_from_the_snapshot(feed, tmp_path, wg_set_calls, monkeypatch, fall_behind):
+    agent = make_agent(tmp_path, max_lag=2 if fall_behind == 'lag' else None)
+    agent.poll()
+    if fall_behind == 'pruned':
+        monkeypatch.setattr(Config, 'CHANGEFEED_RETENTION', 1)
+    keys = set()
+    for number in range(3):
+        keys.add(add_user(f'user{number}', devices=1).devices[0].wg_public_key)
+        changefeed.publish()
+    catch_ups = []
+    catch_up = agent.catch_up
+    monkeypatch.setattr(agent, 'catch_up', lambda: catch_ups.append(1) or catch_up())
+    
+    agent.poll()
+    
+    assert catch_ups == [1]
+    assert agent.version == changefeed.latest_version()
+    assert config_keys(tmp_path) == keys
+
+
+def test_agent_ignores_other_interfaces(feed, tmp_path, wg_set_calls):
+    add_user('alice', devices=1)
+    changefeed.publish()
+    agent = make_agent(tmp_path, interface_names=['wg9'])
+    
+    agent.poll()
+    
+    assert agent.version == changefeed.latest_version()
+    assert agent.peers == {'wg9': {}}
+    assert not (tmp_path / 'gateway' / 'wg0.conf').exists()
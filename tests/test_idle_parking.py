@@ -0,0 +1,77 @@
+"""
+Idle parking compares handshakes (local time, written by the monitor) and
+creation or re-activation times (UTC) each against their own clock
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import Config
+from models import db, create_data_app, User, Device
+from wireguard_manager import WireGuardManager
+
+MAX_IDLE = timedelta(hours=3)
+
+
+class MemoryConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+@pytest.fixture(params=['Etc/GMT+5', 'Etc/GMT-5'])  # UTC-5 and UTC+5
+def local_timezone(request, monkeypatch):
+    monkeypatch.setenv('TZ', request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def app(local_timezone, monkeypatch):
+    # No live interface to update
+    monkeypatch.setattr(WireGuardManager, '_sync_parked_peers', staticmethod(lambda devices, parked: None))
+    app = create_data_app(MemoryConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def add_device(number, last_handshake=None, created_at=None):
+    user = User(username=f'user{number}', password_hash='x')
+    device = Device(user=user, device_name='phone', wg_public_key=f'key{number}', wg_private_key='private',
+                    wg_ip_address=f'10.8.0.{number}', last_handshake=last_handshake,
+                    created_at=created_at or datetime.utcnow() - timedelta(days=30))
+    db.session.add(device)
+    db.session.commit()
+    return device
+
+
+def handshake_ago(delta):
+    """A handshake as the monitor stores it: datetime.fromtimestamp() of the wg timestamp"""
+    return datetime.fromtimestamp(time.time() - delta.total_seconds())
+
+
+def test_recent_handshake_is_not_parked(app):
+    device = add_device(2, last_handshake=handshake_ago(timedelta(hours=2)))
+    assert WireGuardManager.park_idle_devices(MAX_IDLE) == 0
+    assert not device.is_parked
+
+
+def test_old_handshake_is_parked(app):
+    device = add_device(2, last_handshake=handshake_ago(timedelta(hours=4)))
+    assert WireGuardManager.park_idle_devices(MAX_IDLE) == 1
+    assert device.is_parked
+
+
+def test_never_connected_counts_from_creation(app):
+    recent = add_device(2, created_at=datetime.utcnow() - timedelta(hours=2))
+    old = add_device(3, created_at=datetime.utcnow() - timedelta(hours=4))
+    assert WireGuardManager.park_idle_devices(MAX_IDLE) == 1
+    assert old.is_parked and not recent.is_parked
@@ -0,0 +1,55 @@
+"""
+Device ids are never reused, so history tables can't leak to a new device
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+
+from conftest import add_user
+from models import db, Device, EndpointEvent
+from migrate_schema import enable_autoincrement, device_history_ids
+from wireguard_manager import WireGuardManager
+
+
+def devices_sql():
+    return db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'devices'")).scalar()
+
+
+def use_pre_autoincrement_schema():
+    """Recreate the devices table the way databases created before the fix have it"""
+    sql = devices_sql().replace(' AUTOINCREMENT', '')
+    db.session.execute(text('DROP TABLE devices'))
+    db.session.execute(text(sql))
+    db.session.commit()
+
+
+def test_new_databases_never_reuse_device_ids(wg_app):
+    user = add_user('alice', devices=2)
+    last = max(device.id for device in user.devices)
+    db.session.delete(db.session.get(Device, last))
+    db.session.commit()
+    
+    device, _ = WireGuardManager.create_device_config(user, 'replacement')
+    
+    assert 'AUTOINCREMENT' in devices_sql()
+    assert device.id == last + 1
+
+
+def test_migration_starts_past_ids_in_history(wg_app):
+    use_pre_autoincrement_schema()
+    user = add_user('alice', devices=3)
+    kept = sorted((device.id, device.wg_public_key) for device in user.devices)
+    deleted_id = kept.pop()[0]
+    db.session.add(EndpointEvent(device_id=deleted_id, ip='198.51.100.7', seen_at=datetime.utcnow()))
+    db.session.delete(db.session.get(Device, deleted_id))
+    db.session.commit()
+    db.session.remove()
+    
+    assert enable_autoincrement(Device, device_history_ids())
+    assert not enable_autoincrement(Device, device_history_ids())  # Already done
+    
+    assert 'AUTOINCREMENT' in devices_sql()
+    assert sorted((device.id, device.wg_public_key) for device in Device.query) == kept
+    user = db.session.merge(user)
+    device, _ = WireGuardManager.create_device_config(user, 'replacement')
+    assert device.id > deleted_id
@@ -0,0 +1,93 @@
+"""
+Latency timers and SQL/subprocess counters without Flask
+Used directly by background services such as the connection monitor;
+instrumentation.py builds the per-request Flask integration on top.
+"""
+import contextvars
+import functools
+import sys
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from metrics import REGISTRY
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+MANAGER_CALL_SECONDS = REGISTRY.histogram(
+    'wireguard_manager_call_seconds', 'WireGuardManager method latency', ['method'])
+SQL_QUERIES_TOTAL = REGISTRY.counter(
+    'wireguard_sql_queries_total', 'SQL queries executed by this process')
+SUBPROCESSES_TOTAL = REGISTRY.counter(
+    'wireguard_subprocesses_total', 'Subprocesses started by this process')
+
+
+class RequestCounters:
+    __slots__ = ('sql_queries', 'subprocesses')
+    
+    def __init__(self):
+        self.sql_queries = 0
+        self.subprocesses = 0
+
+
+# Counters of the request running in the current context, if any
+current_counters = contextvars.ContextVar('request_counters', default=None)
+
+
+def _on_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    SQL_QUERIES_TOTAL.inc()
+    counters = current_counters.get()
+    if counters is not None:
+        counters.sql_queries += 1
+
+
+def _audit_hook(name, args):
+    # Every subprocess.run/check_output goes through Popen, which raises this event
+    if name == 'subprocess.Popen':
+        SUBPROCESSES_TOTAL.inc()
+        counters = current_counters.get()
+        if counters is not None:
+            counters.subprocesses += 1
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+def install_counters():
+    """Hook SQLAlchemy and subprocess creation once per process"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _on_cursor_execute)
+        # Audit hooks cannot be removed, so this is only ever added once
+        sys.addaudithook(_audit_hook)
+        _installed = True
+
+
+def timed(histogram, **labels):
+    """Decorator recording the wrapped function's latency"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def instrument_class(cls, histogram=MANAGER_CALL_SECONDS):
+    """Wrap every public static method of cls with a latency timer"""
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('_') or not isinstance(attribute, staticmethod):
+            continue
+        function = attribute.__func__
+        if getattr(function, '__instrumented__', False):
+            continue
+        wrapper = timed(histogram, method=name)(function)
+        wrapper.__instrumented__ = True
+        setattr(cls, name, staticmethod(wrapper))
+    return cls
@@ -1,13 +1,24 @@
+import os
 import subprocess
+import contextvars
 import ipaddress
 import re
-from models import db, User, WireGuardConfig, Device
+import secrets
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, update, delete, bindparam, or_, and_
+from sqlalchemy.orm import joinedload
+from models import db, User, WireGuardConfig, WireGuardInterface, Device, AccessRule, user_access_groups
 from config import Config
-import qrcode
+from collector import get_collector, interface_sources
+import peer_snapshot
+import acl
+import changefeed
+from metrics import QR_RENDER_SECONDS, CONFIG_APPLY_SECONDS
 import io
 import base64
-from datetime import datetime
-import time
+from datetime import datetime, timezone
 
 class WireGuardManager:
     """Manages WireGuard configuration and user setup"""
@@ -28,7 +39,7 @@ class WireGuardManager:
     def generate_keypair():
         """Generate a WireGuard key pair"""
         try:
-            wg_cmd = '/usr/bin/wg'
+            wg_cmd = Config.WG_BINARY
             private_key = subprocess.check_output([wg_cmd, 'genkey']).decode().strip()
             public_key = subprocess.check_output(
                 [wg_cmd, 'pubkey'],
@@ -42,46 +53,226 @@ class WireGuardManager:
     def generate_preshared_key():
         """Generate a preshared key for additional security"""
         try:
-            wg_cmd = '/usr/bin/wg'
+            wg_cmd = Config.WG_BINARY
             psk = subprocess.check_output([wg_cmd, 'genpsk']).decode().strip()
             return psk
         except Exception as e:
             raise Exception(f"Failed to generate preshared key: {e}")
     
     @staticmethod
-    def get_next_ip():
-        """Get the next available IP address"""
+    def derive_public_key(private_key):
+        """Derive the public key of a private key with 'wg pubkey'"""
+        try:
+            return subprocess.check_output(
+                [Config.WG_BINARY, 'pubkey'],
+                input=private_key.encode()
+            ).decode().strip()
+        except Exception as e:
+            raise Exception(f"Failed to derive public key: {e}")
+    
+    @staticmethod
+    def generate_preshared_keys_bulk(count):
+        """Generate count preshared keys, the same 32 random bytes wg genpsk outputs"""
+        return [base64.b64encode(secrets.token_bytes(32)).decode() for _ in range(count)]
+    
+    @staticmethod
+    def generate_keys_bulk(count):
+        """Generate count (private key, public key, preshared key) triples
+
+        wg genkey and genpsk only encode 32 random bytes (the private key
+        clamped for Curve25519), so those are made in-process and only the
+        public keys need the wg binary, derived in parallel.
+        """
+        private_keys = []
+        for _ in range(count):
+            raw = bytearray(secrets.token_bytes(32))
+            raw[0] &= 248
+            raw[31] = (raw[31] & 127) | 64
+            private_keys.append(base64.b64encode(bytes(raw)).decode())
+        preshared_keys = WireGuardManager.generate_preshared_keys_bulk(count)
+        
+        if not count:
+            return []
+        workers = max(min(Config.KEYGEN_WORKERS, count), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            public_keys = list(executor.map(
+                lambda key: contextvars.copy_context().run(WireGuardManager.derive_public_key, key),
+                private_keys
+            ))
+        return list(zip(private_keys, public_keys, preshared_keys))
+    
+    # ==================== Interfaces ====================
+    
+    @staticmethod
+    def ensure_primary_interface():
+        """Create the interface row for Config.WG_INTERFACE from the legacy WireGuardConfig"""
+        interface = WireGuardInterface.query.filter_by(name=Config.WG_INTERFACE).first()
+        if interface:
+            return interface
+        
         wg_config = WireGuardConfig.query.first()
         if not wg_config:
-            raise Exception("WireGuard configuration not initialized")
+            raise Exception("WireGuard server not configured")
         
-        # Increment last IP
-        wg_config.last_ip_assigned += 1
-        next_octet = wg_config.last_ip_assigned
+        interface = WireGuardInterface(
+            name=Config.WG_INTERFACE,
+            server_private_key=wg_config.server_private_key,
+            server_public_key=wg_config.server_public_key,
+            address=Config.WG_SERVER_IP,
+            subnet=Config.WG_SUBNET,
+            listen_port=Config.WG_SERVER_PORT,
+            last_ip_assigned=wg_config.last_ip_assigned,
+            is_active=True
+        )
+        db.session.add(interface)
+        db.session.commit()
+        return interface
+    
+    @staticmethod
+    def get_primary_interface():
+        """Get the interface legacy users and unplaced devices live on"""
+        interface = WireGuardInterface.query.filter_by(name=Config.WG_INTERFACE).first()
+        if interface:
+            return interface
+        return WireGuardManager.ensure_primary_interface()
+    
+    @staticmethod
+    def get_interfaces():
+        """Get all active interfaces, primary interface first"""
+        primary = WireGuardManager.get_primary_interface()
+        others = WireGuardInterface.query.filter(
+            WireGuardInterface.is_active == True,
+            WireGuardInterface.id != primary.id
+        ).order_by(WireGuardInterface.name).all()
+        return [primary] + others
+    
+    @staticmethod
+    def get_device_interface(device):
+        """Get the interface a device is placed on"""
+        if device.interface_id:
+            return device.interface
+        return WireGuardManager.get_primary_interface()
+    
+    @staticmethod
+    def create_interface(name, subnet, listen_port, address=None, public_endpoint=None):
+        """Create a new WireGuard interface with its own keys, subnet and port"""
+        if WireGuardInterface.query.filter_by(name=name).first():
+            raise Exception(f"Interface '{name}' already exists")
         
-        # Server IP is .1, so clients start from .2
-        if next_octet <= 1:
-            next_octet = 2
-            wg_config.last_ip_assigned = 2
+        network = ipaddress.ip_network(subnet)
+        for existing in WireGuardInterface.query.all():
+            if network.overlaps(ipaddress.ip_network(existing.subnet)):
+                raise Exception(f"Subnet {subnet} overlaps {existing.subnet} ({existing.name})")
+            if existing.listen_port == listen_port:
+                raise Exception(f"Port {listen_port} is already used by {existing.name}")
         
-        # Check if we're running out of IPs (assuming /24 subnet)
-        if next_octet > 254:
-            raise Exception("No more IP addresses available in subnet")
+        # Server takes the first host address unless told otherwise
+        address = address or str(network.network_address + 1)
+        if ipaddress.ip_address(address) not in network:
+            raise Exception(f"Address {address} is not inside {subnet}")
         
+        private_key, public_key = WireGuardManager.generate_keypair()
+        interface = WireGuardInterface(
+            name=name,
+            server_private_key=private_key,
+            server_public_key=public_key,
+            address=address,
+            subnet=str(network),
+            listen_port=listen_port,
+            public_endpoint=public_endpoint,
+            last_ip_assigned=int(ipaddress.ip_address(address)) - int(network.network_address),
+            is_active=True
+        )
+        db.session.add(interface)
         db.session.commit()
+        return interface
+    
+    @staticmethod
+    def get_interface_capacity(interface):
+        """Number of addresses still assignable on an interface"""
+        network = ipaddress.ip_network(interface.subnet)
+        # Exclude network and broadcast addresses
+        last_host = network.num_addresses - 2
+        return max(last_host - (interface.last_ip_assigned or 1), 0)
+    
+    @staticmethod
+    def get_interface_loads():
+        """Count active devices per interface id"""
+        primary = WireGuardManager.get_primary_interface()
+        loads = {interface.id: 0 for interface in WireGuardManager.get_interfaces()}
+        rows = db.session.query(Device.interface_id, func.count(Device.id)).filter(
+            Device.is_active == True
+        ).group_by(Device.interface_id).all()
+        for interface_id, count in rows:
+            key = interface_id or primary.id
+            loads[key] = loads.get(key, 0) + count
+        return loads
+    
+    @staticmethod
+    def select_interface_for_device(user):
+        """Pick the interface for a new device according to Config.WG_PLACEMENT
+
+        'hash' keeps all devices of a user on the same interface, 'least_loaded'
+        balances active devices. Full interfaces are always skipped.
+        """
+        interfaces = [i for i in WireGuardManager.get_interfaces()
+                      if WireGuardManager.get_interface_capacity(i) > 0]
+        if not interfaces:
+            raise Exception("No more IP addresses available on any interface")
+        
+        if Config.WG_PLACEMENT == 'hash':
+            index = zlib.crc32(str(user.id).encode()) % len(interfaces)
+            return interfaces[index]
+        
+        loads = WireGuardManager.get_interface_loads()
+        return min(interfaces, key=lambda i: (loads.get(i.id, 0), i.id))
+    
+    @staticmethod
+    def get_next_ip(interface=None):
+        """Get the next available IP address on an interface"""
+        if interface is None:
+            interface = WireGuardManager.get_primary_interface()
+        
+        network = ipaddress.ip_network(interface.subnet)
+        server_ip = ipaddress.ip_address(interface.address)
+        
+        # Server is usually .1, so clients start from .2
+        next_offset = max(interface.last_ip_assigned or 1, 1) + 1
+        if network.network_address + next_offset == server_ip:
+            next_offset += 1
         
-        # Construct IP from subnet
-        network = ipaddress.ip_network(Config.WG_SUBNET)
-        ip_address = str(network.network_address + next_octet)
+        # Check if we're running out of IPs (network and broadcast are reserved)
+        if next_offset > network.num_addresses - 2:
+            raise Exception(f"No more IP addresses available in subnet {interface.subnet}")
         
-        return ip_address
+        interface.last_ip_assigned = next_offset
+        db.session.commit()
+        
+        return str(network.network_address + next_offset)
+    
+    @staticmethod
+    def render_client_config(private_key, ip_address, preshared_key, allowed_ips, interface):
+        """Render a client config pointing at the given interface"""
+        endpoint = interface.public_endpoint or Config.WG_SERVER_PUBLIC_IP
+        return f"""[Interface]
+PrivateKey = {private_key}
+Address = {ip_address}/32
+DNS = {Config.WG_DNS}
+
+[Peer]
+PublicKey = {interface.server_public_key}
+PresharedKey = {preshared_key}
+Endpoint = {endpoint}:{interface.listen_port}
+AllowedIPs = {allowed_ips}
+PersistentKeepalive = 25
+"""
+    
+    # ==================== Client Configs ====================
     
     @staticmethod
     def create_user_config(user):
         """Create WireGuard configuration for a user"""
-        wg_config = WireGuardConfig.query.first()
-        if not wg_config:
-            raise Exception("WireGuard server not configured")
+        interface = WireGuardManager.get_primary_interface()
         
         # Generate keys for user if not exist
         if not user.wg_private_key or not user.wg_public_key:
@@ -95,185 +286,639 @@ class WireGuardManager:
         
         # Assign IP if not exist
         if not user.wg_ip_address:
-            user.wg_ip_address = WireGuardManager.get_next_ip()
+            user.wg_ip_address = WireGuardManager.get_next_ip(interface)
         
         db.session.commit()
         
         # Create client config
-        config = f"""[Interface]
-PrivateKey = {user.wg_private_key}
-Address = {user.wg_ip_address}/32
-DNS = {Config.WG_DNS}
-
-[Peer]
-PublicKey = {wg_config.server_public_key}
-PresharedKey = {user.wg_preshared_key}
-Endpoint = {Config.WG_SERVER_PUBLIC_IP}:{Config.WG_SERVER_PORT}
-AllowedIPs = {user.wg_allowed_ips}
-PersistentKeepalive = 25
-"""
-        return config
+        return WireGuardManager.render_client_config(
+            user.wg_private_key, user.wg_ip_address, user.wg_preshared_key,
+            user.wg_allowed_ips, interface
+        )
     
     @staticmethod
     def generate_qr_code(config_text):
         """Generate QR code for config"""
+        with QR_RENDER_SECONDS.time():
+            return WireGuardManager._render_qr_code(config_text)
+    
+    @staticmethod
+    def _render_qr_code(config_text):
+        # Convert to base64
+        return base64.b64encode(WireGuardManager.render_qr_image(config_text)).decode()
+    
+    @staticmethod
+    def render_qr_image(config_text, image_format='png'):
+        """Render a config as a QR code image, 'png' or 'svg', and return its bytes"""
+        # qrcode pulls in Pillow; only processes that render QR codes pay for it
+        import qrcode
+        import qrcode.image.svg
         qr = qrcode.QRCode(
             version=1,
             error_correction=qrcode.constants.ERROR_CORRECT_L,
             box_size=10,
             border=4,
+            image_factory=qrcode.image.svg.SvgPathImage if image_format == 'svg' else None
         )
         qr.add_data(config_text)
         qr.make(fit=True)
         
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64
         buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        return img_str
+        if image_format == 'svg':
+            qr.make_image().save(buffer)
+        else:
+            img = qr.make_image(fill_color="black", back_color="white")
+            img.save(buffer, format='PNG')
+        return buffer.getvalue()
     
     @staticmethod
     def update_server_config():
-        """Update WireGuard server configuration with all active users"""
-        wg_config = WireGuardConfig.query.first()
-        if not wg_config:
-            raise Exception("WireGuard server not configured")
+        """Update WireGuard server configuration with all active users
+
+        Kept for backward compatibility; renders the primary interface
+        including devices so legacy callers don't drop device peers.
+        """
+        return WireGuardManager.update_server_config_with_devices()
+    
+    @staticmethod
+    def apply_server_config():
+        """Apply the server configuration to WireGuard on every interface"""
+        return WireGuardManager.apply_server_config_with_devices()
+    
+    # ==================== Batch Operations ====================
+    
+    BATCH_ACTIONS = ('disable', 'enable', 'delete', 'rekey')
+    
+    @staticmethod
+    def get_peer_sets(interfaces):
+        """Map interface name -> {public key: (comment, psk, allowed ips)} of its server config"""
+        primary = WireGuardManager.get_primary_interface()
+        return {
+            interface.name: {public_key: (comment, psk, f'{ip}/32')
+                             for comment, public_key, psk, ip in WireGuardManager.get_interface_peers(interface, primary)}
+            for interface in interfaces
+        }
+    
+    @staticmethod
+    def diff_peer_sets(before, after):
+        """Added, removed and changed peers per interface, leaving out interfaces without changes"""
+        diff = {}
+        for name in before.keys() | after.keys():
+            old, new = before.get(name, {}), after.get(name, {})
+            changes = {
+                'added': [{'public_key': key, 'peer': new[key][0], 'allowed_ips': new[key][2]}
+                          for key in new.keys() - old.keys()],
+                'removed': [{'public_key': key, 'peer': old[key][0], 'allowed_ips': old[key][2]}
+                            for key in old.keys() - new.keys()],
+                'changed': [{'public_key': key, 'peer': new[key][0], 'allowed_ips': new[key][2]}
+                            for key in old.keys() & new.keys() if old[key][1:] != new[key][1:]]
+            }
+            if any(changes.values()):
+                for entries in changes.values():
+                    entries.sort(key=lambda entry: entry['peer'])
+                diff[name] = changes
+        return diff
+    
+    @staticmethod
+    def batch_update(action, user_ids=(), device_ids=(), dry_run=False):
+        """Disable, enable, delete or rekey a selection of users and devices at once
+
+        Everything is written in one transaction and the server is reconciled
+        once at the end, only on interfaces whose peers changed. Selecting a
+        user applies the action to all of their devices. With dry_run the
+        transaction is rolled back and nothing is applied; the returned peer
+        diff shows what would change.
+        """
+        if action not in WireGuardManager.BATCH_ACTIONS:
+            raise Exception(f"Unknown batch action '{action}'")
         
-        # Get all active users
-        users = User.query.filter_by(is_active=True, is_admin=False).all()
+        user_ids, device_ids = set(user_ids), set(device_ids)
+        skipped = []
+        users = User.query.filter(User.id.in_(user_ids)).all() if user_ids else []
+        for user_id in user_ids - {user.id for user in users}:
+            skipped.append({'user_id': user_id, 'reason': 'not found'})
+        for user in users:
+            if user.is_admin:
+                skipped.append({'user_id': user.id, 'reason': 'admin users cannot be changed in bulk'})
+        target_users = [user.id for user in users if not user.is_admin]
         
-        # Get default network interface
-        net_interface = WireGuardManager.get_default_interface()
+        target_devices = [device_id for device_id, in db.session.query(Device.id).filter(Device.id.in_(device_ids))] if device_ids else []
+        for device_id in device_ids - set(target_devices):
+            skipped.append({'device_id': device_id, 'reason': 'not found'})
         
-        # Build server config
-        config = f"""[Interface]
-Address = {Config.WG_SERVER_IP}/24
-ListenPort = {Config.WG_SERVER_PORT}
-PrivateKey = {wg_config.server_private_key}
-PostUp = iptables -A FORWARD -i {Config.WG_INTERFACE} -j ACCEPT; iptables -t nat -A POSTROUTING -o {net_interface} -j MASQUERADE
-PostDown = iptables -D FORWARD -i {Config.WG_INTERFACE} -j ACCEPT; iptables -t nat -D POSTROUTING -o {net_interface} -j MASQUERADE
-
-"""
+        # Devices reached directly or through a selected user
+        selected = or_(Device.id.in_(target_devices), Device.user_id.in_(target_users))
         
-        # Add each user as a peer
-        for user in users:
-            if user.wg_public_key and user.wg_ip_address:
-                config += f"""# {user.username}
-[Peer]
-PublicKey = {user.wg_public_key}
-PresharedKey = {user.wg_preshared_key}
-AllowedIPs = {user.wg_ip_address}/32
-
-"""
+        # Keys are generated before the transaction writes anything so the
+        # database isn't locked while wg runs. A dry run only needs a
+        # placeholder per selected peer to show in the diff.
+        rekey_devices, rekey_users, keys = [], [], []
+        if action == 'rekey':
+            rekey_devices = [device_id for device_id, in db.session.query(Device.id).filter(selected)]
+            rekey_users = [user.id for user in users if not user.is_admin and user.wg_public_key]
+            if dry_run:
+                keys = [('', f'(new key for device {device_id})', '') for device_id in rekey_devices]
+                keys += [('', f'(new key for user {user_id})', '') for user_id in rekey_users]
+            else:
+                keys = WireGuardManager.generate_keys_bulk(len(rekey_devices) + len(rekey_users))
         
-        return config
-    
-    @staticmethod
-    def apply_server_config():
-        """Apply the server configuration to WireGuard"""
+        interfaces = WireGuardManager.get_interfaces()
         try:
-            config = WireGuardManager.update_server_config()
+            before = WireGuardManager.get_peer_sets(interfaces)
             
-            # Write to temp file
-            config_path = f'/etc/wireguard/{Config.WG_INTERFACE}.conf'
-            with open(config_path, 'w') as f:
-                f.write(config)
+            if action in ('disable', 'enable'):
+                is_active = action == 'enable'
+                if target_users:
+                    db.session.execute(update(User).where(User.id.in_(target_users)).values(is_active=is_active),
+                                       execution_options={'synchronize_session': False})
+                if target_devices:
+                    db.session.execute(update(Device).where(Device.id.in_(target_devices)).values(is_active=is_active),
+                                       execution_options={'synchronize_session': False})
+            elif action == 'delete':
+                db.session.execute(delete(Device).where(selected), execution_options={'synchronize_session': False})
+                if target_users:
+                    # What the ORM cascades would delete, or a user reusing the id inherits the rules
+                    db.session.execute(delete(AccessRule).where(AccessRule.user_id.in_(target_users)),
+                                       execution_options={'synchronize_session': False})
+                    db.session.execute(delete(user_access_groups).where(user_access_groups.c.user_id.in_(target_users)))
+                    db.session.execute(delete(User).where(User.id.in_(target_users)),
+                                       execution_options={'synchronize_session': False})
+            else:
+                if rekey_devices:
+                    devices = Device.__table__
+                    db.session.execute(
+                        update(devices).where(devices.c.id == bindparam('device_id'))
+                        .values(wg_private_key=bindparam('private_key'), wg_public_key=bindparam('public_key'),
+                                wg_preshared_key=bindparam('preshared_key'), keys_rotated_at=datetime.utcnow(),
+                                # A manual rekey supersedes any staged rotation
+                                pending_private_key=None, pending_public_key=None, pending_preshared_key=None,
+                                rotation_started_at=None, rotation_fetched_at=None),
+                        [{'device_id': device_id, 'private_key': private_key, 'public_key': public_key, 'preshared_key': psk}
+                         for device_id, (private_key, public_key, psk) in zip(rekey_devices, keys)]
+                    )
+                if rekey_users:
+                    users_table = User.__table__
+                    db.session.execute(
+                        update(users_table).where(users_table.c.id == bindparam('user_id'))
+                        .values(wg_private_key=bindparam('private_key'), wg_public_key=bindparam('public_key'),
+                                wg_preshared_key=bindparam('preshared_key')),
+                        [{'user_id': user_id, 'private_key': private_key, 'public_key': public_key, 'preshared_key': psk}
+                         for user_id, (private_key, public_key, psk) in zip(rekey_users, keys[len(rekey_devices):])]
+                    )
+            # Rows were changed behind the ORM's back, don't serve stale objects
+            db.session.expire_all()
             
-            # Restart WireGuard interface
-            subprocess.run(['wg-quick', 'down', Config.WG_INTERFACE], 
-                         stderr=subprocess.DEVNULL)
-            subprocess.run(['wg-quick', 'up', Config.WG_INTERFACE], check=True)
+            after = WireGuardManager.get_peer_sets(interfaces)
+            diff = WireGuardManager.diff_peer_sets(before, after)
             
-            return True
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
         except Exception as e:
-            raise Exception(f"Failed to apply server config: {e}")
+            db.session.rollback()
+            raise Exception(f"Batch {action} failed: {e}")
+        
+        changed = [interface for interface in interfaces if interface.name in diff]
+        if changed and not dry_run:
+            WireGuardManager.apply_server_config_with_devices(changed)
+        
+        return {
+            'action': action,
+            'dry_run': dry_run,
+            'user_ids': sorted(target_users),
+            'device_ids': sorted(target_devices),
+            'rekeyed': len(keys),
+            'skipped': skipped,
+            'diff': diff,
+            'applied': bool(changed) and not dry_run
+        }
+    
+    # ==================== Key Rotation ====================
     
     @staticmethod
-    def get_peer_statistics():
-        """Get statistics for all connected peers"""
+    def set_interface_peers(interface_name, peers):
+        """Update peers of a running interface in place with one 'wg set'
+
+        peers is a list of dicts with public_key, preshared_key, allowed_ips
+        and optionally remove (an old public key to drop first, so its
+        allowed IPs can move to the new key). An entry with only remove
+        drops a peer. Other peers are not disturbed.
+        """
+        if not Config.WG_LOCAL:
+            return
+        args = [Config.WG_BINARY, 'set', interface_name]
         try:
-            # Run 'wg show' command to get peer statistics
-            result = subprocess.check_output(
-                ['wg', 'show', Config.WG_INTERFACE, 'dump'],
-                stderr=subprocess.DEVNULL
-            ).decode().strip()
+            with tempfile.TemporaryDirectory() as directory:
+                for index, peer in enumerate(peers):
+                    if peer.get('remove'):
+                        args += ['peer', peer['remove'], 'remove']
+                    if not peer.get('public_key'):
+                        continue
+                    args += ['peer', peer['public_key']]
+                    if peer.get('preshared_key'):
+                        # wg only reads preshared keys from files
+                        psk_path = os.path.join(directory, f'{index}.psk')
+                        with os.fdopen(os.open(psk_path, os.O_WRONLY | os.O_CREAT, 0o600), 'w') as f:
+                            f.write(peer['preshared_key'])
+                        args += ['preshared-key', psk_path]
+                    args += ['allowed-ips', peer['allowed_ips']]
+                subprocess.run(args, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"Failed to update peers on {interface_name}: {e.stderr.decode().strip() or e}")
+    
+    @staticmethod
+    def is_device_live(device):
+        """Whether the device is a peer of its interface's server config"""
+        return (device.is_active and not device.is_parked
+                and device.user.is_active and not device.user.is_over_quota)
+    
+    @staticmethod
+    def apply_peer_diff(interfaces, before):
+        """Push peer changes since `before` (from get_peer_sets) to the running interfaces
+
+        Only the differing peers are sent, with one 'wg set' per interface,
+        and the config files are rewritten without a restart. Returns the diff.
+        """
+        after = WireGuardManager.get_peer_sets(interfaces)
+        diff = WireGuardManager.diff_peer_sets(before, after)
+        
+        for interface in interfaces:
+            changes = diff.get(interface.name)
+            if not changes:
+                continue
+            peers = WireGuardManager.get_peer_updates(changes, after[interface.name])
+            try:
+                WireGuardManager.set_interface_peers(interface.name, peers)
+            except Exception as e:
+                # The config file below still has the right peers for the next restart
+                print(f"Error updating peers on {interface.name}: {e}")
+            WireGuardManager.write_interface_config(
+                interface.name, WireGuardManager.update_server_config_with_devices(interface))
+        
+        if diff:
+            WireGuardManager.publish_peer_changes(interfaces)
+        if Config.ACL_ENABLED and Config.WG_LOCAL and any(diff.values()):
+            try:
+                acl.sync()
+            except Exception as e:
+                print(f"Error updating access control sets: {e}")
+        
+        return diff
+    
+    @staticmethod
+    def get_peer_updates(changes, peers):
+        """set_interface_peers entries for one interface's diff_peer_sets changes
+
+        peers is the interface's new peer set, removals come first.
+        """
+        updates = [{'remove': peer['public_key']} for peer in changes['removed']]
+        for peer in changes['added'] + changes['changed']:
+            _, preshared_key, allowed_ips = peers[peer['public_key']]
+            updates.append({'public_key': peer['public_key'], 'preshared_key': preshared_key,
+                            'allowed_ips': allowed_ips})
+        return updates
+    
+    @staticmethod
+    def publish_peer_changes(interfaces=None):
+        """Record peer changes in the change feed for gateway agents, returns how many"""
+        if not Config.CHANGEFEED_ENABLED:
+            return 0
+        try:
+            return changefeed.publish(interfaces)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error publishing peer changes: {e}")
+            return 0
+    
+    @staticmethod
+    def start_key_rotations(max_age, limit, keypairs=False, now=None):
+        """Stage new keys for up to limit devices whose keys are older than max_age
+
+        Only the preshared key is replaced unless keypairs is set. Nothing
+        changes on the server yet; get_device_config serves the new keys
+        from now on. Returns the number of devices staged.
+        """
+        now = now or datetime.utcnow()
+        rotated_at = func.coalesce(Device.keys_rotated_at, Device.created_at)
+        device_ids = [device_id for device_id, in db.session.query(Device.id).filter(
+            Device.rotation_started_at.is_(None),
+            rotated_at <= now - max_age
+        ).order_by(rotated_at).limit(limit)]
+        if not device_ids:
+            return 0
+        
+        if keypairs:
+            keys = WireGuardManager.generate_keys_bulk(len(device_ids))
+        else:
+            keys = [(None, None, psk) for psk in WireGuardManager.generate_preshared_keys_bulk(len(device_ids))]
+        
+        devices = Device.__table__
+        db.session.execute(
+            update(devices).where(devices.c.id == bindparam('device_id'))
+            .values(pending_private_key=bindparam('private_key'), pending_public_key=bindparam('public_key'),
+                    pending_preshared_key=bindparam('preshared_key'), rotation_started_at=now,
+                    rotation_fetched_at=None),
+            [{'device_id': device_id, 'private_key': private_key, 'public_key': public_key, 'preshared_key': psk}
+             for device_id, (private_key, public_key, psk) in zip(device_ids, keys)]
+        )
+        db.session.commit()
+        return len(device_ids)
+    
+    @staticmethod
+    def promote_key_rotations(grace, limit, now=None):
+        """Switch up to limit staged rotations over to the new keys
+
+        A rotation is due once its client fetched the new config or grace has
+        passed. Live peers are updated incrementally per interface and the
+        config files rewritten without restarting anything. Returns the
+        number of devices promoted.
+        """
+        now = now or datetime.utcnow()
+        due = Device.query.options(joinedload(Device.user)).filter(
+            Device.rotation_started_at.isnot(None),
+            Device.rotation_fetched_at.isnot(None) | (Device.rotation_started_at <= now - grace)
+        ).order_by(Device.rotation_fetched_at.is_(None), Device.rotation_started_at).limit(limit).all()
+        if not due:
+            return 0
+        
+        interfaces = {}
+        updates = {}
+        for device in due:
+            interface = WireGuardManager.get_device_interface(device)
+            interfaces[interface.name] = interface
+            device_updates = updates.setdefault(interface.name, [])
+            # Peers that aren't in the server config only change in the database
+            if WireGuardManager.is_device_live(device):
+                device_updates.append({
+                    'public_key': device.pending_public_key or device.wg_public_key,
+                    'remove': device.wg_public_key if device.pending_public_key else None,
+                    'preshared_key': device.pending_preshared_key or device.wg_preshared_key,
+                    'allowed_ips': f'{device.wg_ip_address}/32'
+                })
+        
+        failed = set()
+        for name, peers in updates.items():
+            if not peers:
+                continue
+            try:
+                WireGuardManager.set_interface_peers(name, peers)
+            except Exception as e:
+                print(f"Error rotating keys on {name}: {e}")
+                failed.add(name)
+        
+        promoted = 0
+        for device in due:
+            if WireGuardManager.get_device_interface(device).name in failed:
+                continue
+            if device.pending_public_key:
+                device.wg_private_key = device.pending_private_key
+                device.wg_public_key = device.pending_public_key
+            device.wg_preshared_key = device.pending_preshared_key or device.wg_preshared_key
+            device.pending_private_key = None
+            device.pending_public_key = None
+            device.pending_preshared_key = None
+            device.rotation_started_at = None
+            device.rotation_fetched_at = None
+            device.keys_rotated_at = now
+            promoted += 1
+        db.session.commit()
+        
+        # Keep the config files in sync so the next restart uses the new keys
+        for name, interface in interfaces.items():
+            if name not in failed and updates[name]:
+                WireGuardManager.write_interface_config(
+                    name, WireGuardManager.update_server_config_with_devices(interface))
+        WireGuardManager.publish_peer_changes(list(interfaces.values()))
+        
+        return promoted
+    
+    # ==================== Idle Peers ====================
+    
+    @staticmethod
+    def _sync_parked_peers(devices, parked):
+        """Remove (parked) or re-add (not parked) live devices incrementally per interface"""
+        updates = {}
+        for device in devices:
+            if not (device.is_active and device.user.is_active and not device.user.is_over_quota):
+                continue
+            interface = WireGuardManager.get_device_interface(device)
+            peers = updates.setdefault(interface.name, (interface, []))[1]
+            if parked:
+                peers.append({'remove': device.wg_public_key})
+            else:
+                peers.append({'public_key': device.wg_public_key, 'preshared_key': device.wg_preshared_key,
+                              'allowed_ips': f'{device.wg_ip_address}/32'})
+        
+        for name, (interface, peers) in updates.items():
+            try:
+                WireGuardManager.set_interface_peers(name, peers)
+            except Exception as e:
+                # The config file below still has the right peers for the next restart
+                print(f"Error updating parked peers on {name}: {e}")
+            WireGuardManager.write_interface_config(
+                name, WireGuardManager.update_server_config_with_devices(interface))
+        if updates:
+            WireGuardManager.publish_peer_changes([interface for interface, _ in updates.values()])
+        if Config.ACL_ENABLED and Config.WG_LOCAL and updates:
+            try:
+                acl.sync()
+            except Exception as e:
+                print(f"Error updating access control sets: {e}")
+    
+    @staticmethod
+    def park_idle_devices(max_idle, now=None):
+        """Park active devices without a handshake for max_idle
+
+        Parked devices stay active in the database but are removed from the
+        live interface and its config file. Devices that never connected
+        count from their creation, re-activated ones from their
+        re-activation. now is UTC like created_at; handshakes are stored in
+        local time by the monitor and compared against a local cutoff.
+        Returns the number of devices parked.
+        """
+        now = now or datetime.utcnow()
+        cutoff = now - max_idle
+        handshake_cutoff = datetime.fromtimestamp(cutoff.replace(tzinfo=timezone.utc).timestamp())
+        devices = Device.query.options(joinedload(Device.user)).filter(
+            Device.is_active == True,
+            Device.is_parked == False,
+            or_(Device.last_handshake <= handshake_cutoff,
+                Device.last_handshake.is_(None) & (Device.created_at <= cutoff)),
+            Device.unparked_at.is_(None) | (Device.unparked_at <= cutoff)
+        ).all()
+        if not devices:
+            return 0
+        
+        for device in devices:
+            device.is_parked = True
+            device.parked_at = now
+            device.is_connected = False
+        db.session.commit()
+        
+        WireGuardManager._sync_parked_peers(devices, parked=True)
+        return len(devices)
+    
+    @staticmethod
+    def unpark_devices(devices):
+        """Put parked devices back on the live interface, returns how many were parked"""
+        devices = [device for device in devices if device.is_parked]
+        if not devices:
+            return 0
+        
+        for device in devices:
+            device.is_parked = False
+            device.parked_at = None
+            device.unparked_at = datetime.utcnow()
+        db.session.commit()
+        
+        WireGuardManager._sync_parked_peers(devices, parked=False)
+        return len(devices)
+    
+    @staticmethod
+    def unpark_user_devices(user):
+        """Re-activate all parked devices of a user, e.g. when they log in"""
+        return WireGuardManager.unpark_devices(Device.query.filter_by(user_id=user.id, is_parked=True).all())
+    
+    @staticmethod
+    def get_parked_count():
+        return Device.query.filter_by(is_active=True, is_parked=True).count()
+    
+    # ==================== Quotas ====================
+    
+    @staticmethod
+    def _quota_exceeded(day, month):
+        """SQL condition: the user's current-period usage reached a quota"""
+        return or_(
+            # Coalesced so the negation never meets a NULL
+            and_(User.quota_daily_bytes.isnot(None), func.coalesce(User.usage_day, '') == day,
+                 func.coalesce(User.usage_day_bytes, 0) >= User.quota_daily_bytes),
+            and_(User.quota_monthly_bytes.isnot(None), func.coalesce(User.usage_month, '') == month,
+                 func.coalesce(User.usage_month_bytes, 0) >= User.quota_monthly_bytes)
+        )
+    
+    @staticmethod
+    def enforce_quotas(now=None):
+        """Take peers of users over quota off the live interfaces and restore the others
+
+        Users get restored once a new day/month starts or an admin raises
+        their quota. Peers change incrementally; nothing is restarted.
+        Returns (blocked usernames, restored usernames).
+        """
+        now = now or datetime.now()
+        exceeded = WireGuardManager._quota_exceeded(now.strftime('%Y-%m-%d'), now.strftime('%Y-%m'))
+        blocked = User.query.filter(User.is_over_quota == False, exceeded).all()
+        restored = User.query.filter(User.is_over_quota == True, ~exceeded).all()
+        if not blocked and not restored:
+            return [], []
+        
+        interfaces = WireGuardManager.get_interfaces()
+        before = WireGuardManager.get_peer_sets(interfaces)
+        for user in blocked:
+            user.is_over_quota = True
+        for user in restored:
+            user.is_over_quota = False
+        db.session.commit()
+        
+        WireGuardManager.apply_peer_diff(interfaces, before)
+        return [user.username for user in blocked], [user.username for user in restored]
+    
+    # ==================== Statistics ====================
+    
+    @staticmethod
+    def get_dump_sources():
+        """Dump sources for every active interface plus configured remote sources"""
+        names = [interface.name for interface in WireGuardManager.get_interfaces()]
+        return interface_sources(names) + Config.WG_DUMP_SOURCES
+    
+    @staticmethod
+    def collect_snapshot():
+        """Collect all dump sources in parallel into one Snapshot"""
+        return get_collector().collect(WireGuardManager.get_dump_sources())
+    
+    @staticmethod
+    def get_published_snapshot():
+        """Snapshot the connection monitor published, None if it isn't running"""
+        return peer_snapshot.get_reader(Config.PEER_SNAPSHOT_PATH).read(max_age=Config.PEER_SNAPSHOT_MAX_AGE)
+    
+    @staticmethod
+    def get_live_snapshot():
+        """Published snapshot if the monitor is running, otherwise collect one"""
+        return WireGuardManager.get_published_snapshot() or WireGuardManager.collect_snapshot()
+    
+    @staticmethod
+    def get_peer_index():
+        """Map every known public key to (username, device name)"""
+        index = {}
+        rows = db.session.query(Device.wg_public_key, User.username, Device.device_name).join(User).all()
+        for public_key, username, device_name in rows:
+            index[public_key] = (username, device_name)
+        legacy = db.session.query(User.wg_public_key, User.username).filter(User.wg_public_key.isnot(None)).all()
+        for public_key, username in legacy:
+            index.setdefault(public_key, (username, 'Legacy Config'))
+        return index
+    
+    # Fields returned by get_peer_statistics(), in column order
+    PEER_STAT_FIELDS = (
+        'username', 'device_name', 'email', 'ip_address', 'public_key',
+        'endpoint', 'is_online', 'latest_handshake', 'rx_bytes', 'tx_bytes',
+        'interface'
+    )
+    
+    @staticmethod
+    def get_peer_statistics(snapshot=None):
+        """Get statistics for all connected peers on every interface
+        
+        Byte counters are returned raw; formatting is left to the client.
+        """
+        try:
+            if snapshot is None:
+                snapshot = WireGuardManager.get_live_snapshot()
             
-            if not result:
+            if not snapshot.peers:
                 return []
             
-            peers = []
-            lines = result.split('\n')
+            # Look up all devices and legacy users once instead of per peer
+            devices = {d.wg_public_key: d for d in Device.query.all()}
+            users = {u.id: u for u in User.query.all()}
+            legacy_users = {u.wg_public_key: u for u in users.values() if u.wg_public_key}
             
-            # Skip header line (first line is interface info)
-            for line in lines[1:]:
-                parts = line.split('\t')
-                if len(parts) >= 6:
-                    public_key = parts[0]
-                    preshared_key = parts[1]
-                    endpoint = parts[2] if parts[2] != '(none)' else None
-                    allowed_ips = parts[3]
-                    latest_handshake = int(parts[4]) if parts[4] != '0' else None
-                    rx_bytes = int(parts[5])
-                    tx_bytes = int(parts[6]) if len(parts) > 6 else 0
-                    
-                    # Find corresponding user or device
-                    device = Device.query.filter_by(wg_public_key=public_key).first()
-                    user = None
-                    
-                    if device:
-                        user = device.user
-                    else:
-                        # Fallback to legacy user config
-                        user = User.query.filter_by(wg_public_key=public_key).first()
-                    
-                    if user or device:
-                        # Convert bytes to human readable format
-                        def format_bytes(bytes_val):
-                            for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-                                if bytes_val < 1024.0:
-                                    return f"{bytes_val:.2f} {unit}"
-                                bytes_val /= 1024.0
-                            return f"{bytes_val:.2f} PB"
-                        
-                        # Check if peer is currently connected (handshake within last 3 minutes)
-                        is_online = latest_handshake is not None and (time.time() - latest_handshake) < 180
-                        
-                        peers.append({
-                            'username': user.username if user else 'Unknown',
-                            'device_name': device.device_name if device else 'Legacy Config',
-                            'email': user.email if user else '',
-                            'ip_address': device.wg_ip_address if device else (user.wg_ip_address if user else 'N/A'),
-                            'public_key': public_key[:16] + '...',  # Truncate for display
-                            'endpoint': endpoint,
-                            'is_online': is_online,
-                            'latest_handshake': latest_handshake,
-                            'rx_bytes': rx_bytes,
-                            'tx_bytes': tx_bytes,
-                            'rx_formatted': format_bytes(rx_bytes),
-                            'tx_formatted': format_bytes(tx_bytes),
-                            'total_formatted': format_bytes(rx_bytes + tx_bytes)
-                        })
+            peers = []
+            for sample in snapshot.peers.values():
+                # Find corresponding user or device
+                device = devices.get(sample.public_key)
+                if device:
+                    user = users.get(device.user_id)
+                else:
+                    # Fallback to legacy user config
+                    user = legacy_users.get(sample.public_key)
+                
+                if user or device:
+                    peers.append({
+                        'username': user.username if user else 'Unknown',
+                        'device_name': device.device_name if device else 'Legacy Config',
+                        'email': user.email if user else '',
+                        'ip_address': device.wg_ip_address if device else (user.wg_ip_address if user else 'N/A'),
+                        'public_key': sample.public_key[:16] + '...',  # Truncate for display
+                        'endpoint': sample.endpoint,
+                        'is_online': snapshot.is_online(sample),
+                        'latest_handshake': sample.latest_handshake,
+                        'rx_bytes': sample.rx_bytes,
+                        'tx_bytes': sample.tx_bytes,
+                        'interface': sample.source
+                    })
             
             return peers
-            
-        except subprocess.CalledProcessError:
-            # Interface might not be up
-            return []
+        
         except Exception as e:
             print(f"Error getting peer statistics: {e}")
             return []
     
+    # ==================== Devices ====================
+    
     @staticmethod
-    def create_device_config(user, device_name):
+    def create_device_config(user, device_name, interface=None):
         """Create WireGuard configuration for a specific device"""
-        wg_config = WireGuardConfig.query.first()
-        if not wg_config:
-            raise Exception("WireGuard server not configured")
-        
         # Check if user has reached max connections
         active_devices = Device.query.filter_by(user_id=user.id, is_active=True).count()
         if active_devices >= user.max_connections:
@@ -284,14 +929,18 @@ AllowedIPs = {user.wg_ip_address}/32
         if existing:
             raise Exception(f"Device '{device_name}' already exists for this user")
         
+        if interface is None:
+            interface = WireGuardManager.select_interface_for_device(user)
+        
         # Generate keys for device
         private_key, public_key = WireGuardManager.generate_keypair()
         preshared_key = WireGuardManager.generate_preshared_key()
-        ip_address = WireGuardManager.get_next_ip()
+        ip_address = WireGuardManager.get_next_ip(interface)
         
         # Create device record
         device = Device(
             user_id=user.id,
+            interface_id=interface.id,
             device_name=device_name,
             wg_public_key=public_key,
             wg_private_key=private_key,
@@ -305,162 +954,259 @@ AllowedIPs = {user.wg_ip_address}/32
         db.session.commit()
         
         # Create client config
-        config = f"""[Interface]
-PrivateKey = {device.wg_private_key}
-Address = {device.wg_ip_address}/32
-DNS = {Config.WG_DNS}
-
-[Peer]
-PublicKey = {wg_config.server_public_key}
-PresharedKey = {device.wg_preshared_key}
-Endpoint = {Config.WG_SERVER_PUBLIC_IP}:{Config.WG_SERVER_PORT}
-AllowedIPs = {device.wg_allowed_ips}
-PersistentKeepalive = 25
-"""
+        config = WireGuardManager.render_client_config(
+            device.wg_private_key, device.wg_ip_address, device.wg_preshared_key,
+            device.wg_allowed_ips, interface
+        )
         return device, config
     
     @staticmethod
     def get_device_config(device):
-        """Get WireGuard configuration for an existing device"""
-        wg_config = WireGuardConfig.query.first()
-        if not wg_config:
-            raise Exception("WireGuard server not configured")
-        
-        config = f"""[Interface]
-PrivateKey = {device.wg_private_key}
-Address = {device.wg_ip_address}/32
-DNS = {Config.WG_DNS}
+        """Get WireGuard configuration for an existing device
 
-[Peer]
-PublicKey = {wg_config.server_public_key}
-PresharedKey = {device.wg_preshared_key}
-Endpoint = {Config.WG_SERVER_PUBLIC_IP}:{Config.WG_SERVER_PORT}
-AllowedIPs = {device.wg_allowed_ips}
-PersistentKeepalive = 25
-"""
-        return config
+        While a key rotation is pending the new keys are served, and the
+        fetch is recorded so the server can switch over without waiting for
+        the grace period.
+        """
+        interface = WireGuardManager.get_device_interface(device)
+        if device.rotation_started_at and not device.rotation_fetched_at:
+            device.rotation_fetched_at = datetime.utcnow()
+            db.session.commit()
+        return WireGuardManager.render_client_config(
+            device.pending_private_key or device.wg_private_key, device.wg_ip_address,
+            device.pending_preshared_key or device.wg_preshared_key,
+            device.wg_allowed_ips, interface
+        )
     
     @staticmethod
-    def update_server_config_with_devices():
-        """Update WireGuard server configuration with all active devices"""
-        wg_config = WireGuardConfig.query.first()
-        if not wg_config:
-            raise Exception("WireGuard server not configured")
-        
-        # Get all active devices
-        devices = Device.query.filter_by(is_active=True).all()
-        
-        # Also get legacy users (those with wg_public_key but no devices)
-        legacy_users = User.query.filter(
+    def live_device_condition():
+        """SQL condition for devices that are peers on an interface, with Device joined to User"""
+        return and_(Device.is_active == True, Device.is_parked == False,
+                    User.is_active == True, User.is_over_quota == False)
+    
+    @staticmethod
+    def live_legacy_user_condition():
+        """SQL condition for legacy users (own keys, no active device) that are peers on the primary interface"""
+        return and_(
             User.is_active == True,
             User.is_admin == False,
+            User.is_over_quota == False,
             User.wg_public_key.isnot(None),
-            ~User.id.in_([d.user_id for d in devices])
-        ).all()
+            User.wg_ip_address.isnot(None),
+            ~User.id.in_(db.session.query(Device.user_id).filter_by(is_active=True))
+        )
+    
+    @staticmethod
+    def get_interface_peers(interface, primary=None):
+        """Peers of an interface's server config as (comment, public key, psk, ip) rows"""
+        if primary is None:
+            primary = WireGuardManager.get_primary_interface()
+        is_primary = interface.id == primary.id
+        
+        # Get all active, unparked devices of active users placed on this interface
+        query = db.session.query(
+            User.username, Device.device_name, Device.wg_public_key,
+            Device.wg_preshared_key, Device.wg_ip_address
+        ).join(User, Device.user_id == User.id).filter(WireGuardManager.live_device_condition())
+        if is_primary:
+            query = query.filter((Device.interface_id == interface.id) | (Device.interface_id.is_(None)))
+        else:
+            query = query.filter(Device.interface_id == interface.id)
+        peers = [(f'{username} - {device_name}', public_key, psk, ip)
+                 for username, device_name, public_key, psk, ip in query.order_by(Device.id)]
+        
+        # Legacy users (those with wg_public_key but no devices) live on the primary interface
+        if is_primary:
+            legacy_users = db.session.query(
+                User.username, User.wg_public_key, User.wg_preshared_key, User.wg_ip_address
+            ).filter(WireGuardManager.live_legacy_user_condition()).order_by(User.id)
+            peers += [(f'{username} (Legacy)', public_key, psk, ip)
+                      for username, public_key, psk, ip in legacy_users]
         
+        return peers
+    
+    @staticmethod
+    def update_server_config_with_devices(interface=None):
+        """Update WireGuard server configuration with all active devices of an interface"""
+        if interface is None:
+            interface = WireGuardManager.get_primary_interface()
+        peers = [(comment, public_key, psk, f'{ip}/32')
+                 for comment, public_key, psk, ip in WireGuardManager.get_interface_peers(interface)]
+        return WireGuardManager.render_server_config(interface, peers)
+    
+    @staticmethod
+    def render_server_config(interface, peers):
+        """Server config text for an interface and its (comment, public key, psk, allowed ips) peers"""
         # Get default network interface
         net_interface = WireGuardManager.get_default_interface()
+        prefixlen = ipaddress.ip_network(interface.subnet).prefixlen
         
         # Build server config
         config = f"""[Interface]
-Address = {Config.WG_SERVER_IP}/24
-ListenPort = {Config.WG_SERVER_PORT}
-PrivateKey = {wg_config.server_private_key}
-PostUp = iptables -A FORWARD -i {Config.WG_INTERFACE} -j ACCEPT; iptables -t nat -A POSTROUTING -o {net_interface} -j MASQUERADE
-PostDown = iptables -D FORWARD -i {Config.WG_INTERFACE} -j ACCEPT; iptables -t nat -D POSTROUTING -o {net_interface} -j MASQUERADE
-
+Address = {interface.address}/{prefixlen}
+ListenPort = {interface.listen_port}
+PrivateKey = {interface.server_private_key}
 """
-        
-        # Add each device as a peer
-        for device in devices:
-            if device.user.is_active:
-                config += f"""# {device.user.username} - {device.device_name}
-[Peer]
-PublicKey = {device.wg_public_key}
-PresharedKey = {device.wg_preshared_key}
-AllowedIPs = {device.wg_ip_address}/32
+        if Config.ACL_ENABLED:
+            # Forwarding and NAT live in the nftables table from acl.py, not in wg-quick hooks
+            config += "\n"
+        else:
+            config += f"""PostUp = iptables -A FORWARD -i {interface.name} -j ACCEPT; iptables -t nat -A POSTROUTING -o {net_interface} -j MASQUERADE
+PostDown = iptables -D FORWARD -i {interface.name} -j ACCEPT; iptables -t nat -D POSTROUTING -o {net_interface} -j MASQUERADE
 
 """
         
-        # Add legacy user configs
-        for user in legacy_users:
-            if user.wg_public_key and user.wg_ip_address:
-                config += f"""# {user.username} (Legacy)
+        # Add each device (and legacy user) as a peer
+        for comment, public_key, preshared_key, allowed_ips in peers:
+            config += f"""# {comment}
 [Peer]
-PublicKey = {user.wg_public_key}
-PresharedKey = {user.wg_preshared_key}
-AllowedIPs = {user.wg_ip_address}/32
+PublicKey = {public_key}
+PresharedKey = {preshared_key}
+AllowedIPs = {allowed_ips}
 
 """
         
         return config
     
     @staticmethod
-    def apply_server_config_with_devices():
-        """Apply the server configuration to WireGuard with device support"""
+    def write_interface_config(interface_name, config):
+        """Write one interface's config file without touching the running interface"""
+        if not Config.WG_LOCAL:
+            return
+        config_path = os.path.join(Config.WG_CONFIG_DIR, f'{interface_name}.conf')
+        with open(config_path, 'w') as f:
+            f.write(config)
+    
+    @staticmethod
+    def apply_interface_config(interface_name, config):
+        """Write one interface's config and restart it
+
+        Does not touch the database, so it is safe to run from worker threads.
+        """
+        if not Config.WG_LOCAL:
+            return
+        WireGuardManager.write_interface_config(interface_name, config)
+        
+        # Restart WireGuard interface
+        subprocess.run([Config.WG_QUICK_BINARY, 'down', interface_name],
+                     stderr=subprocess.DEVNULL)
+        subprocess.run([Config.WG_QUICK_BINARY, 'up', interface_name], check=True)
+    
+    @staticmethod
+    def apply_server_config_with_devices(interfaces=None, ruleset=False):
+        """Apply the server configuration to WireGuard with device support
+
+        Configs are rendered from the database first, then every interface is
+        reconciled in parallel so one slow restart doesn't delay the others.
+        Only the changed ACL set elements are applied, unless ruleset is set
+        because interfaces were added or this is a fresh setup.
+        """
         try:
-            config = WireGuardManager.update_server_config_with_devices()
-            
-            # Write to temp file
-            config_path = f'/etc/wireguard/{Config.WG_INTERFACE}.conf'
-            with open(config_path, 'w') as f:
-                f.write(config)
-            
-            # Restart WireGuard interface
-            subprocess.run(['wg-quick', 'down', Config.WG_INTERFACE], 
-                         stderr=subprocess.DEVNULL)
-            subprocess.run(['wg-quick', 'up', Config.WG_INTERFACE], check=True)
-            
+            with CONFIG_APPLY_SECONDS.time():
+                WireGuardManager._apply_interfaces(interfaces, ruleset)
             return True
         except Exception as e:
             raise Exception(f"Failed to apply server config: {e}")
     
     @staticmethod
-    def update_device_connection_status():
+    def _apply_interfaces(interfaces, ruleset=False):
+        publish_all = interfaces is None
+        if interfaces is None:
+            interfaces = WireGuardManager.get_interfaces()
+        
+        configs = [(interface.name, WireGuardManager.update_server_config_with_devices(interface))
+                   for interface in interfaces]
+        # Remote gateways don't wait for the local restarts
+        WireGuardManager.publish_peer_changes(None if publish_all else interfaces)
+        
+        workers = max(min(Config.WG_RECONCILE_WORKERS, len(configs)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       WireGuardManager.apply_interface_config, name, config)
+                       for name, config in configs]
+            errors = []
+            for (name, _), future in zip(configs, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(f"{name}: {e}")
+        
+        if Config.ACL_ENABLED and Config.WG_LOCAL:
+            try:
+                if ruleset:
+                    acl.apply_ruleset()
+                else:
+                    acl.sync()
+            except Exception as e:
+                errors.append(f"acl: {e}")
+        
+        if errors:
+            raise Exception('; '.join(errors))
+    
+    @staticmethod
+    def update_device_connection_status(snapshot=None):
         """Update connection status for all devices based on WireGuard stats"""
         try:
-            result = subprocess.check_output(
-                ['wg', 'show', Config.WG_INTERFACE, 'dump'],
-                stderr=subprocess.DEVNULL
-            ).decode().strip()
-            
-            if not result:
-                # No peers connected, mark all as disconnected
-                Device.query.update({Device.is_connected: False})
-                db.session.commit()
-                return
-            
-            connected_keys = set()
-            lines = result.split('\n')
-            
-            # Skip header line
-            for line in lines[1:]:
-                parts = line.split('\t')
-                if len(parts) >= 5:
-                    public_key = parts[0]
-                    latest_handshake = int(parts[4]) if parts[4] != '0' else None
-                    
-                    # Check if handshake is recent (within 3 minutes)
-                    if latest_handshake and (time.time() - latest_handshake) < 180:
-                        connected_keys.add(public_key)
-                        
-                        # Update device
-                        device = Device.query.filter_by(wg_public_key=public_key).first()
-                        if device:
-                            device.is_connected = True
-                            device.last_handshake = datetime.fromtimestamp(latest_handshake)
+            if snapshot is None:
+                if WireGuardManager.get_published_snapshot() is not None:
+                    return  # The connection monitor keeps the devices table current
+                snapshot = WireGuardManager.collect_snapshot()
             
-            # Mark disconnected devices
-            all_devices = Device.query.all()
-            for device in all_devices:
-                if device.wg_public_key not in connected_keys:
+            for device in Device.query.all():
+                sample = snapshot.peers.get(device.wg_public_key)
+                
+                # Check if handshake is recent (within 3 minutes)
+                if sample and snapshot.is_online(sample):
+                    device.is_connected = True
+                    device.last_handshake = datetime.fromtimestamp(sample.latest_handshake)
+                else:
                     device.is_connected = False
             
             db.session.commit()
-            
+        
         except Exception as e:
             print(f"Error updating device connection status: {e}")
     
+    @staticmethod
+    def apply_peer_changes(table, changes, full_sync=False):
+        """Write only the connection state that changed since the last cycle
+        
+        table is a PeerTable and changes the list its update() returned. With
+        full_sync every device is first marked disconnected, which is what the
+        first cycle after startup needs.
+        """
+        devices = Device.__table__
+        if full_sync:
+            db.session.execute(update(devices).values(is_connected=False))
+        
+        with_handshake = []
+        without_handshake = []
+        for public_key in {c.public_key for c in changes}:
+            record = table.peers.get(public_key)
+            if record is None:
+                # Removed from the interface
+                without_handshake.append({'key': public_key, 'connected': False})
+            elif record.latest_handshake is not None:
+                with_handshake.append({'key': public_key, 'connected': record.is_online,
+                                       'handshake': datetime.fromtimestamp(record.latest_handshake)})
+            else:
+                without_handshake.append({'key': public_key, 'connected': record.is_online})
+        
+        if with_handshake:
+            db.session.execute(
+                update(devices).where(devices.c.wg_public_key == bindparam('key'))
+                .values(is_connected=bindparam('connected'), last_handshake=bindparam('handshake')),
+                with_handshake
+            )
+        if without_handshake:
+            db.session.execute(
+                update(devices).where(devices.c.wg_public_key == bindparam('key'))
+                .values(is_connected=bindparam('connected')),
+                without_handshake
+            )
+        db.session.commit()
+        return len(with_handshake) + len(without_handshake)
+    
     @staticmethod
     def get_user_connected_device_count(user_id):
         """Get count of currently connected devices for a user"""